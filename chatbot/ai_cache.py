@@ -0,0 +1,113 @@
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import TTLCache
+
+
+_cache = TTLCache(
+    max_entries=getattr(settings, "AI_CACHE_MAX_ENTRIES", 1000),
+    ttl=getattr(settings, "AI_CACHE_TTL", 86400),
+)
+bypasses = 0
+
+# Leading pleasantries that do not change the question
+FILLER_PREFIXES = (
+    "hi", "hello", "hey", "please", "pls", "kindly", "tell me", "can you tell me",
+    "i want to know", "i would like to know", "habari", "sasa",
+)
+
+# Words that refer back to earlier turns; answers to these depend on history
+CONTEXT_WORDS = {
+    "it", "its", "that", "this", "those", "these", "they", "them", "their",
+    "he", "she", "him", "her", "his", "hers", "also", "again", "more", "else",
+    "above", "earlier", "previous", "same", "instead", "then",
+}
+CONTEXT_OPENERS = ("and ", "but ", "so ", "what about", "how about")
+
+_punctuation = re.compile(r"[^\w\s]")
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _punctuation.sub(" ", text)
+    text = _whitespace.sub(" ", text).strip()
+
+    stripped = True
+    while stripped:
+        stripped = False
+        for prefix in FILLER_PREFIXES:
+            if text.startswith(prefix + " "):
+                text = text[len(prefix) + 1:]
+                stripped = True
+    return text
+
+
+def is_context_dependent(text):
+    """
+    True for follow-up turns ("why?", "tell me more", "is it safe for him")
+    whose answer depends on the conversation so far.
+    """
+    normalized = normalize_question(text)
+    words = normalized.split()
+
+    if len(words) < 3 or len(normalized) > 200:
+        return True
+    if normalized.startswith(CONTEXT_OPENERS):
+        return True
+    return any(word in CONTEXT_WORDS for word in words)
+
+
+def cache_key(text, role=None, language="English"):
+    digest = hashlib.sha1(normalize_question(text).encode()).hexdigest()
+    return f"ai:{role or 'any'}:{(language or 'English').lower()}:{digest}"
+
+
+def _shared():
+    alias = getattr(settings, "AI_CACHE_SHARED_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def get_cached_reply(text, role=None, language="English"):
+    """
+    Returns a cached reply for a context-free question, or None.
+    """
+    global bypasses
+
+    if is_context_dependent(text):
+        bypasses += 1
+        return None
+
+    key = cache_key(text, role, language)
+    reply = _cache.get(key)
+    if reply is None:
+        shared = _shared()
+        if shared is not None:
+            reply = shared.get(key)
+            if reply is not None:
+                _cache.set(key, reply)
+    return reply
+
+
+def cache_reply(text, reply, role=None, language="English"):
+    if is_context_dependent(text):
+        return
+
+    key = cache_key(text, role, language)
+    _cache.set(key, reply)
+
+    shared = _shared()
+    if shared is not None:
+        shared.set(key, reply, timeout=_cache.ttl)
+
+
+def stats():
+    return dict(_cache.stats(), bypasses=bypasses)
+
+
+def clear():
+    _cache.clear()
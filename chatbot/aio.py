@@ -0,0 +1,275 @@
+"""
+Async counterparts of the AI and outbound WhatsApp helpers, used by the
+ASGI webhook (views.whatsapp_webhook_async).
+
+DeepSeek and Twilio each get one httpx.AsyncClient per event loop, so a
+single process can keep thousands of AI calls in flight while holding a
+bounded pool of connections to each. The pools are separate so streaming
+replies, which hold a DeepSeek connection while sending segments, can
+never starve the Twilio sends they are waiting on. httpx is an optional
+dependency; only the async webhook needs it.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import ai_cache, memory, metrics, tasks, utils
+from .gateway import GatewayError, get_gateway, response_sid, split_message, whatsapp_address
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+# Without httpx, get_upstream() fails before any of these could be raised
+_http_errors = (httpx.HTTPError,) if httpx else ()
+_timeouts = (httpx.TimeoutException,) if httpx else ()
+
+
+logger = logging.getLogger(__name__)
+
+_upstreams = weakref.WeakKeyDictionary()
+_tasks = set()
+
+
+class Upstream:
+    """
+    HTTP client for one upstream API on one event loop. Callers take a slot
+    before each request, so at most `size` requests are inside httpx at a
+    time; the rest queue on the semaphore, which stays cheap however long
+    the queue gets (httpx's own pool rescans every waiting request).
+    """
+
+    def __init__(self, size):
+        self.client = httpx.AsyncClient(
+            timeout=15,
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+        )
+        self.slots = asyncio.Semaphore(size)
+
+
+def get_upstream(name):
+    """
+    Returns the shared Upstream for `name` ("deepseek" or "twilio") on the
+    running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    upstreams = _upstreams.setdefault(loop, {})
+    upstream = upstreams.get(name)
+    if upstream is None:
+        if httpx is None:
+            raise ImproperlyConfigured("The async webhook needs httpx (pip install httpx).")
+        upstream = upstreams[name] = Upstream(settings.ASYNC_HTTP_MAX_CONNECTIONS[name])
+    return upstream
+
+
+def spawn(coro):
+    """
+    Runs `coro` in the background of the current event loop and keeps a
+    reference to it until it finishes.
+    """
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def drain():
+    """
+    Waits for the background tasks started on this event loop. Needed when
+    the async view is served by WSGI, where the loop ends with the request.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [task for task in _tasks if task.get_loop() is loop]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def call_deepseek(messages, api_key):
+    upstream = get_upstream("deepseek")
+    async with upstream.slots:
+        with metrics.timed("stage.ai_call"):
+            response = await upstream.client.post(
+                utils.DEEPSEEK_URL,
+                headers={"Authorization": f"Bearer {api_key}"},
+                json={
+                    "model": "deepseek-chat",
+                    "messages": messages,
+                    "max_tokens": 300,
+                    "temperature": 0.6,
+                },
+            )
+    response.raise_for_status()
+    return utils.shorten_reply(response.json()["choices"][0]["message"]["content"])
+
+
+async def stream_deepseek(messages, api_key):
+    """
+    Yields content deltas from a streaming (SSE) chat completion.
+    """
+    upstream = get_upstream("deepseek")
+    with metrics.timed("stage.ai_call"):
+        async with upstream.slots, upstream.client.stream(
+            "POST",
+            utils.DEEPSEEK_URL,
+            headers={"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"},
+            json={
+                "model": "deepseek-chat",
+                "messages": messages,
+                "max_tokens": 300,
+                "temperature": 0.6,
+                "stream": True,
+            },
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+
+async def send_message(to, body=None, media_url=None):
+    """
+    Async version of WhatsAppGateway.send, using the gateway's account and
+    endpoint. Returns the message SIDs; raises GatewayError on failure.
+    """
+    gateway = get_gateway()
+    if not gateway.configured:
+        raise GatewayError("Twilio credentials not set in environment variables.")
+    upstream = get_upstream("twilio")
+
+    parts = [body or ""] if media_url else split_message(body or "")
+
+    sids = []
+    for index, part in enumerate(parts):
+        data = {
+            "From": whatsapp_address(gateway.from_number),
+            "To": whatsapp_address(to),
+            "Body": part,
+        }
+        if media_url and index == 0:
+            data["MediaUrl"] = media_url
+
+        try:
+            async with upstream.slots:
+                with metrics.timed("stage.twilio_send"):
+                    response = await upstream.client.post(
+                        gateway.messages_url,
+                        data=data,
+                        auth=(gateway.account_sid, gateway.auth_token),
+                        timeout=gateway.timeout,
+                    )
+        except _http_errors as e:
+            raise GatewayError(str(e) or type(e).__name__) from e
+
+        if response.status_code >= 400:
+            raise GatewayError(f"HTTP {response.status_code}: {response.text[:200]}")
+        sids.append(response_sid(response))
+
+    return sids
+
+
+def _in_thread(fn):
+    # Cache and database calls run in the shared thread pool, off the event
+    # loop, so replies for many users proceed in parallel
+    return sync_to_async(fn, thread_sensitive=False)
+
+
+async def reply_with_ai(user, user_input):
+    """
+    Generates the AI reply for `user_input` and sends it to the user, in
+    segments as it streams when settings.AI_STREAMING is on. Mirrors
+    utils.get_ai_response / utils.stream_ai_response.
+    """
+    start = time.monotonic()
+    sent_any = False
+
+    failed = False
+
+    async def deliver(segment):
+        nonlocal sent_any, failed
+        # Like tasks.segment_sender: after a failed send, the rest of the
+        # reply goes through the retried send task, in order
+        if not failed:
+            try:
+                await send_message(user.phone_number, segment)
+            except GatewayError as e:
+                logger.warning("Sending a reply segment to %s failed, queueing the rest: %s", user.phone_number, e)
+                failed = True
+        if failed:
+            await _in_thread(tasks.enqueue)(tasks.send_message_async, user.phone_number, segment)
+        if not sent_any:
+            sent_any = True
+            metrics.observe("ai_time_to_first_message", time.monotonic() - start)
+
+    ai_reply = await _in_thread(ai_cache.get_cached_reply)(user_input, user.role, user.preferred_language)
+    if ai_reply is not None:
+        await deliver(ai_reply)
+        await _in_thread(utils.save_exchange)(user, user_input, ai_reply)
+        return ai_reply
+
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        await _in_thread(memory.record_turn)(user, "user", user_input)
+        ai_reply = "⚠️ AI service unavailable. Please try again later."
+        await deliver(ai_reply)
+        return ai_reply
+
+    # May read ChatHistory when the user is not in the turn buffer
+    prompt = await _in_thread(utils.build_prompt)(user, user_input)
+    await _in_thread(memory.record_turn)(user, "user", user_input)
+
+    parts = []
+    complete = False
+    segments = utils.SegmentBuffer()
+    try:
+        if settings.AI_STREAMING:
+            async for delta in stream_deepseek(prompt, api_key):
+                parts.append(delta)
+                for segment in segments.feed(delta):
+                    await deliver(segment)
+        else:
+            parts.append(await call_deepseek(prompt, api_key))
+            await deliver(parts[0])
+        complete = True
+    except _timeouts:
+        if not sent_any:
+            ai_reply = "⚠️ The AI service took too long to respond. Please try again."
+            await deliver(ai_reply)
+            return ai_reply
+    except Exception:
+        logger.exception("AI request failed")
+        if not sent_any:
+            ai_reply = "⚠️ AI service unavailable. Please try again later."
+            await deliver(ai_reply)
+            return ai_reply
+
+    # Whatever was generated before a failure is still sent
+    for segment in segments.close():
+        await deliver(segment)
+
+    ai_reply = "".join(parts).strip()
+    if ai_reply:
+        if complete:
+            metrics.observe("ai_stream_total", time.monotonic() - start)
+            if utils.is_generic_prompt(prompt):
+                await _in_thread(ai_cache.cache_reply)(user_input, ai_reply, user.role, user.preferred_language)
+        await _in_thread(memory.record_turn)(user, "bot", ai_reply)
+    return ai_reply
+
+
+metrics.gauge("async_background_tasks", lambda: len(_tasks))
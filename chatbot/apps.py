@@ -1,15 +1,28 @@
+import logging
 import os
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class ChatbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatbot'
         
     def ready(self):
-        if os.environ.get('RUN_MAIN') == 'true':
+        from django.conf import settings
+
+        # Connects the profile cache, resource snapshot and upload signal receivers
+        from . import media, profiles, resources  # noqa: F401
+
+        # Registers the message handlers, then renders their constant replies once
+        from . import handler, twiml  # noqa: F401
+        twiml.render_static()
+
+        # Reminder claims are leased, so any number of processes may run this
+        if os.environ.get('RUN_MAIN') == 'true' or settings.REMINDER_SCHEDULER_ENABLED:
             from .scheduler import start_scheduler
             try:
                 start_scheduler()
-            except Exception as e:
-                print(f"Error starting scheduler: {e}")
+            except Exception:
+                logger.exception("Error starting scheduler")
@@ -0,0 +1,71 @@
+"""
+Coalesces bursts of free-text messages into one AI request.
+
+People often type one thought as several quick WhatsApp messages. Each
+message is parked in the Django cache under a per-user sequence number
+and a flush is scheduled settings.AI_BURST_WINDOW seconds later; a newer
+message makes the older flushes stand down, so the AI is asked once, with
+all the messages of the burst, after the user pauses. A burst is flushed
+early once it reaches settings.AI_BURST_MAX_MESSAGES.
+
+The flush usually runs in another process (a Celery worker), so bursts
+are only coalesced when the cache is shared; with the per-process LocMem
+cache, or when tasks run eagerly (which ignores the countdown), every
+message is answered on its own.
+
+Crisis messages never come through here (they are routed before the AI
+fallback), so they are never delayed.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import is_shared
+
+
+def enabled():
+    return bool(settings.AI_BURST_WINDOW) and is_shared()
+
+
+def _key(user_id, name):
+    return f"burst:{user_id}:{name}"
+
+
+def _timeout():
+    # Parked messages only need to outlive the flush that picks them up
+    return max(settings.AI_BURST_WINDOW * 10, 60)
+
+
+def add(user_id, text):
+    """
+    Parks `text` and returns (seq, countdown): the flush for `seq` should
+    run after `countdown` seconds.
+    """
+    cache.add(_key(user_id, "seq"), 0, timeout=None)
+    seq = cache.incr(_key(user_id, "seq"))
+    cache.set(_key(user_id, seq), text, timeout=_timeout())
+
+    flushed = cache.get(_key(user_id, "flushed"), 0)
+    if seq - flushed >= settings.AI_BURST_MAX_MESSAGES:
+        return seq, 0
+    return seq, settings.AI_BURST_WINDOW
+
+
+def take(user_id, seq):
+    """
+    Returns the parked messages up to `seq` joined into one text, or None
+    when a newer message has arrived (its own flush will take them).
+    """
+    if cache.get(_key(user_id, "seq")) != seq:
+        return None
+
+    flushed = cache.get(_key(user_id, "flushed"), 0)
+    if flushed >= seq:
+        return None
+    cache.set(_key(user_id, "flushed"), seq, timeout=None)
+
+    keys = [_key(user_id, n) for n in range(flushed + 1, seq + 1)]
+    parked = cache.get_many(keys)
+    cache.delete_many(keys)
+
+    texts = [parked[key] for key in keys if key in parked]
+    return "\n".join(texts) if texts else None
@@ -0,0 +1,149 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from . import metrics
+from .gateway import PRIORITY_CRISIS, get_gateway
+from .hospitals import get_nearby_hospitals
+
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="crisis")
+
+
+def parse_contacts(raw_contacts):
+    if isinstance(raw_contacts, list):
+        return [c for c in raw_contacts if c]
+    if isinstance(raw_contacts, str):
+        return [c.strip() for c in raw_contacts.split(",") if c.strip()]
+    return []
+
+
+def build_alert_text(user, message):
+    return (
+        f"🚨 *SickleCare Emergency Alert!*\n\n"
+        f"User: {user.name or user.phone_number}\n"
+        f"Phone: {user.phone_number}\n"
+        f"Message: {message}\n\n"
+        f"The user may be in crisis. Please contact them immediately."
+    )
+
+
+# What the patient is told about their emergency contacts
+ALERT_STATUS = {
+    "sent": "I've notified your emergency contacts.",
+    "pending": "I'm alerting your emergency contacts now.",
+    "failed": (
+        "⚠️ I couldn't reach your emergency contacts yet and will keep trying. "
+        "If you can, call them or emergency services now."
+    ),
+}
+
+
+def build_patient_message(hospitals, alerts="sent"):
+    if not hospitals:
+        return f"{ALERT_STATUS[alerts]}\n\n⚠️ No nearby hospitals were found for your location."
+
+    # Combine all hospitals into ONE text block
+    hospital_lines = []
+    for h in hospitals:
+        hospital_lines.append(
+            f"🏥 *{h['name']}*\n📍 {h['address']}\n📞 {h.get('phone') or 'N/A'}"
+        )
+
+    hospitals_text = "\n\n".join(hospital_lines)
+
+    return (
+        "🚨 Crisis Detected!\n"
+        f"{ALERT_STATUS[alerts]}\n\n"
+        "Here are nearby hospitals:\n\n"
+        f"{hospitals_text}\n\n"
+        "Follow the steps above and stay safe. ❤️"
+    )
+
+
+def dispatch_crisis(user, message, deadline=None):
+    """
+    Sends the emergency-contact alerts and looks up nearby hospitals at the
+    same time, then sends the patient their hospital list. Everything is
+    bound by one end-to-end deadline (settings.CRISIS_DEADLINE seconds) and
+    goes out on the gateway's crisis priority lane.
+
+    Sends that fail are queued again on the crisis queue (send_alert_async,
+    which retries), and the patient is only told their contacts were
+    notified once one alert got through.
+
+    Returns {recipient: {"ok": bool, "latency": seconds or None, "retried": bool}},
+    where latency is measured from the start of the dispatch and stays None
+    for sends still in flight at the deadline.
+    """
+    # tasks imports this module through utils
+    from .tasks import enqueue, send_alert_async
+
+    start = time.monotonic()
+    if deadline is None:
+        deadline = start + getattr(settings, "CRISIS_DEADLINE", 8.0)
+
+    gateway = get_gateway()
+    report = {}
+
+    def track(recipient, body):
+        report[recipient] = {"ok": False, "latency": None, "retried": False}
+
+        def done(f):
+            latency = time.monotonic() - start
+            ok = f.exception() is None
+            retried = False
+            if not ok:
+                logger.warning("Crisis send to %s failed, retrying: %s", recipient, f.exception())
+                retried = enqueue(send_alert_async, recipient, body)
+            report[recipient] = {"ok": ok, "latency": latency, "retried": retried}
+            metrics.observe("crisis_send_latency", latency)
+
+        future = gateway.submit(recipient, body, priority=PRIORITY_CRISIS)
+        future.add_done_callback(done)
+        return future
+
+    def alert_status():
+        alerts = [report[number] for number in contacts]
+        if any(result["ok"] for result in alerts):
+            return "sent"
+        if alerts and all(result["latency"] is not None for result in alerts):
+            return "failed"
+        return "pending"
+
+    alert_text = build_alert_text(user, message)
+    contacts = parse_contacts(user.emergency_contacts)
+    pending = [track(number, alert_text) for number in contacts]
+
+    # 2. Optionally send local medical facility suggestions
+    if user.location:
+        lookup = _executor.submit(get_nearby_hospitals, user.location)
+        done, _ = wait([lookup], timeout=max(deadline - time.monotonic(), 0))
+
+        hospitals = []
+        if done:
+            try:
+                hospitals = lookup.result()
+            except Exception:
+                logger.exception("Hospital lookup failed for %s", user.phone_number)
+        else:
+            logger.warning("Hospital lookup for %s missed the crisis deadline", user.location)
+
+        # Send ONE message only
+        pending.append(track(user.phone_number, build_patient_message(hospitals, alert_status())))
+
+    wait(pending, timeout=max(deadline - time.monotonic(), 0))
+
+    elapsed = time.monotonic() - start
+    metrics.observe("crisis_dispatch", elapsed)
+
+    failed = [recipient for recipient, result in report.items() if not result["ok"]]
+    if failed:
+        logger.error("Crisis dispatch for %s: not delivered in time to %s", user.phone_number, ", ".join(failed))
+    logger.info("Crisis dispatch for %s finished in %.2fs", user.phone_number, elapsed)
+
+    return report
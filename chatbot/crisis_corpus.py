@@ -0,0 +1,101 @@
+# Labelled messages for checking and timing the crisis detector (checked
+# by CrisisDetectorTests in tests.py, timed by `python manage.py
+# bench_crisis`). True means the message should start the crisis flow.
+# Add real misclassified messages here when the phrase list is tuned.
+
+LABELLED_MESSAGES = [
+    # English, crisis
+    ("I'm in pain", True),
+    ("im in so much pain please help", True),
+    ("Severe pain in my legs and back", True),
+    ("my chest hurts so much", True),
+    ("chest pain and I can't breathe", True),
+    ("I cant breathe", True),
+    ("cannot breathe properly since morning", True),
+    ("having a crisis right now", True),
+    ("Pain crisis started last night and it's getting worse", True),
+    ("my son has a high fever and is crying", True),
+    ("She fainted at school", True),
+    ("he passed out, what do I do", True),
+    ("my daughter is having a seizure", True),
+    ("take me to the hospital", True),
+    ("I need to go to hospital now", True),
+    ("emergency", True),
+    ("please call an ambulance", True),
+    ("I feel like I'm dying", True),
+    ("the pain is unbearable", True),
+    ("unbearable pain in my joints", True),
+    ("help me the pain is too much", True),
+    ("excruciating back pain", True),
+    ("urgent, my arm is swollen and painful", True),
+    ("his speech is slurred and one side is numb", True),
+    ("slurred speech and can't move my arm", True),
+    ("PAIN!!!", True),
+    ("shortness of breath and fever", True),
+    ("crisis", True),
+    ("I'm in so much pain, how can I manage it?", True),
+    ("is it normal to have chest pain like this", True),
+    # Swahili, crisis
+    ("nina maumivu makali", True),
+    ("naumwa sana", True),
+    ("nasikia maumivu mgongoni", True),
+    ("kifua kinauma", True),
+    ("siwezi kupumua", True),
+    ("tafadhali nisaidie", True),
+    ("dharura! mtoto amezimia", True),
+    ("nipeleke hospitali", True),
+    ("mtoto ana homa kali", True),
+    ("nakufa na maumivu", True),
+    ("tunahitaji gari la wagonjwa", True),
+    ("mtoto ana degedege", True),
+    # Sheng, crisis
+    ("niko na uchungu mob", True),
+    ("naskia vibaya sana bro", True),
+    ("mwili inauma", True),
+    ("siezi pumua", True),
+    ("nimezidiwa na pain", True),
+    ("nipelekeni hosi haraka", True),
+    ("crisis imeanza", True),
+    ("niko na crisis", True),
+    ("body inauma sana", True),
+    ("nisaidieni", True),
+    # Not a crisis
+    ("hello", False),
+    ("menu", False),
+    ("which hospital is best for checkups", False),
+    ("Which hospital do you recommend for a checkup?", False),
+    ("I have a hospital appointment tomorrow", False),
+    ("What is a sickle cell crisis?", False),
+    ("What causes pain in sickle cell?", False),
+    ("How can I prevent a sickle cell crisis?", False),
+    ("When should I go to the hospital during a crisis?", False),
+    ("tips for managing pain at home", False),
+    ("no pain today, feeling good", False),
+    ("I'm not in pain anymore", False),
+    ("it's not an emergency, just a question", False),
+    ("I had a crisis last year", False),
+    ("what foods help with sickle cell", False),
+    ("can you help me understand hydroxyurea", False),
+    ("thank you", False),
+    ("Is sickle cell contagious?", False),
+    ("my friend works at the hospital", False),
+    ("I used to have fevers as a child", False),
+    ("sina maumivu leo", False),
+    ("hakuna maumivu, asante", False),
+    ("habari yako", False),
+    ("sickle cell ni nini", False),
+    ("nini husababisha sickle cell", False),
+    ("vipi kuzuia crisis", False),
+    ("niko poa", False),
+    ("sasa bro", False),
+    ("hospitali gani ni nzuri kwa checkup", False),
+    ("how much water should I drink", False),
+    ("set reminder", False),
+    ("add contact", False),
+    ("painting is my hobby", False),
+    ("my pain is gone", False),
+    ("Is pain normal after transfusion?", False),
+    ("How can I manage pain at home?", False),
+    ("What triggers a sickle cell crisis?", False),
+    ("the crisis went away after two days", False),
+]
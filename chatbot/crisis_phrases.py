@@ -0,0 +1,187 @@
+# Phrases the crisis detector looks for, per language, with a weight each.
+# A message is treated as a crisis when the weights of the phrases it
+# contains add up to the detector's threshold (see chatbot/detector.py).
+#
+# Weights: 1.0 on its own means crisis, whatever else the message says;
+# smaller weights need support from another phrase; negative weights mark
+# benign contexts ("checkup", "how to", "is gone") that pull an otherwise
+# borderline message, such as a question mentioning "pain" or "crisis",
+# below the threshold.
+# Phrases are matched on whole words after lowercasing, so list them in
+# lowercase with single spaces; other punctuation is ignored, apostrophes
+# are kept ("can't").
+
+PHRASES = {
+    "english": {
+        # Pain
+        "pain": 0.7,
+        "in pain": 1.0,
+        "so much pain": 1.0,
+        "severe pain": 1.0,
+        "bad pain": 1.0,
+        "terrible pain": 1.0,
+        "unbearable pain": 1.0,
+        "excruciating": 1.0,
+        "pain crisis": 1.0,
+        "chest pain": 1.0,
+        "hurts so much": 1.0,
+        "hurting badly": 1.0,
+        "it hurts": 0.7,
+        "aching": 0.4,
+        "painful": 0.6,
+        # Crisis and emergencies
+        "crisis": 0.7,
+        "sickle crisis": 1.0,
+        "having a crisis": 1.0,
+        "emergency": 1.0,
+        "help me": 0.5,
+        "please help": 0.5,
+        "i need help": 0.6,
+        "ambulance": 1.0,
+        "dying": 1.0,
+        "i'm dying": 1.0,
+        # Breathing, chest, stroke signs
+        "can't breathe": 1.0,
+        "cant breathe": 1.0,
+        "cannot breathe": 1.0,
+        "short of breath": 1.0,
+        "shortness of breath": 1.0,
+        "difficulty breathing": 1.0,
+        "struggling to breathe": 1.0,
+        "fainted": 1.0,
+        "passed out": 1.0,
+        "unconscious": 1.0,
+        "seizure": 1.0,
+        "fits": 0.6,
+        "slurred speech": 1.0,
+        "slurred": 0.8,
+        "numb": 0.5,
+        "can't move": 0.8,
+        "cannot move": 0.8,
+        "high fever": 1.0,
+        "fever": 0.5,
+        "vomiting": 0.4,
+        "yellow eyes": 0.4,
+        "swollen": 0.3,
+        "priapism": 1.0,
+        # Severity and urgency
+        "severe": 0.5,
+        "very bad": 0.4,
+        "getting worse": 0.5,
+        "urgent": 0.6,
+        "right now": 0.2,
+        # Hospital: urgent only with a verb of going or needing
+        "hospital": 0.3,
+        "take me to hospital": 1.0,
+        "take me to the hospital": 1.0,
+        "rush me to hospital": 1.0,
+        "need a hospital": 0.9,
+        "need to go to hospital": 0.9,
+        "need to go to the hospital": 0.9,
+        "going to hospital": 0.5,
+        "nearest hospital": 0.5,
+        "admitted": 0.4,
+    },
+    "swahili": {
+        "maumivu": 0.7,
+        "maumivu makali": 1.0,
+        "nina maumivu": 1.0,
+        "nasikia maumivu": 1.0,
+        "naumwa": 0.8,
+        "naumwa sana": 1.0,
+        "inauma": 0.7,
+        "inauma sana": 1.0,
+        "kifua kinauma": 1.0,
+        "siwezi kupumua": 1.0,
+        "sipumui": 1.0,
+        "napumua kwa shida": 1.0,
+        "nisaidie": 0.8,
+        "tafadhali nisaidie": 1.0,
+        "msaada": 0.6,
+        "dharura": 1.0,
+        "gari la wagonjwa": 1.0,
+        "ambulensi": 1.0,
+        "nakufa": 1.0,
+        "nimezimia": 1.0,
+        "amezimia": 1.0,
+        "degedege": 1.0,
+        "homa kali": 1.0,
+        "homa": 0.5,
+        "natapika": 0.4,
+        "hospitali": 0.3,
+        "nipeleke hospitali": 1.0,
+        "nipelekeni hospitali": 1.0,
+        "napelekwa hospitali": 0.8,
+        "hali mbaya": 0.6,
+    },
+    "sheng": {
+        "niko na uchungu": 1.0,
+        "uchungu": 0.6,
+        "naskia uchungu": 1.0,
+        "naskia vibaya": 0.7,
+        "naskia vibaya sana": 1.0,
+        "mwili inauma": 0.9,
+        "body inauma": 0.9,
+        "inanuma": 0.7,
+        "siwezi pumua": 1.0,
+        "siezi pumua": 1.0,
+        "nimezidiwa": 0.9,
+        "niko poor sana": 0.8,
+        "niko mbaya": 0.8,
+        "nisort": 0.6,
+        "nisaidieni": 0.9,
+        "hosi": 0.3,
+        "nipeleke hosi": 1.0,
+        "nipelekeni hosi": 1.0,
+        "crisis imeanza": 1.0,
+        "niko na crisis": 1.0,
+    },
+    "benign": {
+        # Routine, informational or past-tense contexts
+        "checkup": -0.5,
+        "check up": -0.5,
+        "checkups": -0.5,
+        "appointment": -0.5,
+        "clinic day": -0.5,
+        "best hospital": -0.3,
+        "which hospital": -0.3,
+        "recommend": -0.3,
+        "what is": -0.4,
+        "what causes": -0.4,
+        "what are": -0.3,
+        "how to": -0.3,
+        "when should i": -0.5,
+        "how do i prevent": -0.5,
+        "how can i prevent": -0.5,
+        "tips": -0.3,
+        "prevent": -0.3,
+        "last year": -0.5,
+        "last month": -0.5,
+        "used to": -0.4,
+        "my friend": -0.2,
+        # Questions and relief
+        "how can i": -0.3,
+        "manage": -0.3,
+        "managing": -0.3,
+        "normal": -0.3,
+        "what triggers": -0.4,
+        "is gone": -0.5,
+        "has gone": -0.5,
+        "went away": -0.5,
+        "better now": -0.5,
+        "ni nini": -0.4,
+        "nini husababisha": -0.4,
+        "vipi kuzuia": -0.4,
+    },
+}
+
+# Words that cancel a phrase when they appear just before it
+# ("no pain", "sina maumivu", "not an emergency")
+NEGATIONS = {
+    "no", "not", "never", "without", "don't", "dont", "doesn't", "isn't", "wasn't",
+    "none", "zero", "hakuna", "sina", "si", "sio", "siyo", "bila", "hapana",
+    "sijawahi", "sisikii", "haina",
+}
+
+# Words that end a negation's reach ("no pain but severe fever")
+CLAUSE_BREAKS = {"but", "and", "though", "although", "ila", "lakini", "na"}
@@ -0,0 +1,115 @@
+"""
+Crisis detection for inbound messages.
+
+Every phrase in crisis_phrases.PHRASES is compiled into one regular
+expression shaped like a trie (shared prefixes are matched once), so a
+message is scanned in a single pass however many phrases there are.
+Each match adds its weight to the message's score unless a negation word
+("no", "sina", ...) appears just before it. The score, capped to 0..1, is
+the confidence; messages at or above THRESHOLD are crises. A phrase
+weighing 1.0 makes the confidence 1.0 by itself, so benign phrases only
+ever talk a borderline message out of the crisis flow.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+
+from .crisis_phrases import CLAUSE_BREAKS, NEGATIONS, PHRASES
+
+
+THRESHOLD = getattr(settings, "CRISIS_THRESHOLD", 0.6)
+
+# How many words before a phrase are checked for a negation
+NEGATION_WINDOW = 3
+
+_non_word = re.compile(r"[^\w']+")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("’", "'")
+    return _non_word.sub(" ", text).strip()
+
+
+def _trie_pattern(phrases):
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node):
+        end = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end:
+            # Optional so longer phrases are tried first, then the shorter one
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class Detection:
+    __slots__ = ("is_crisis", "confidence", "matches")
+
+    def __init__(self, is_crisis, confidence, matches):
+        self.is_crisis = is_crisis
+        self.confidence = confidence
+        self.matches = matches
+
+    def __repr__(self):
+        return f"Detection(is_crisis={self.is_crisis}, confidence={self.confidence}, matches={self.matches})"
+
+
+class CrisisDetector:
+    def __init__(self, phrases=PHRASES, negations=NEGATIONS, clause_breaks=CLAUSE_BREAKS, threshold=THRESHOLD):
+        self.weights = {}
+        for table in phrases.values():
+            for phrase, weight in table.items():
+                self.weights[normalize(phrase)] = weight
+        self.negations = frozenset(negations)
+        self.clause_breaks = frozenset(clause_breaks)
+        self.threshold = threshold
+        self.pattern = re.compile(r"(?<![\w'])" + _trie_pattern(self.weights) + r"(?![\w'])")
+
+    def _negated(self, text, start):
+        negated = False
+        for word in text[max(start - 40, 0):start].split()[-NEGATION_WINDOW:]:
+            if word in self.negations:
+                negated = True
+            elif word in self.clause_breaks:
+                negated = False
+        return negated
+
+    def detect(self, message):
+        """
+        Returns a Detection with the confidence and the phrases that
+        counted (negated phrases are left out).
+        """
+        text = normalize(message)
+        score = 0.0
+        strong = False
+        matches = []
+
+        for match in self.pattern.finditer(text):
+            phrase = match.group()
+            weight = self.weights[phrase]
+            if weight > 0 and self._negated(text, match.start()):
+                continue
+            score += weight
+            strong = strong or weight >= 1.0
+            matches.append(phrase)
+
+        confidence = 1.0 if strong else round(min(max(score, 0.0), 1.0), 2)
+        return Detection(confidence >= self.threshold, confidence, matches)
+
+
+detector = CrisisDetector()
+
+
+def detect(message):
+    return detector.detect(message)
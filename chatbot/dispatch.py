@@ -0,0 +1,207 @@
+"""
+Table-driven dispatch for inbound WhatsApp messages.
+
+A message is routed in this order, each step being a dict lookup:
+
+1. registration state (new user, waiting for name, waiting for role)
+2. pending actions that must be answered before anything else
+3. commands, looked up by the lowercased message text
+4. crisis detection
+5. pending multi-step flows (e.g. setting a reminder)
+6. the fallback handler (free text for the AI)
+
+Handlers register themselves with the decorators below and receive a
+Context. They change the profile through ctx.set() so the webhook can
+persist everything with a single UPDATE of the dirty fields (plus
+last_interaction, which every message refreshes), and answer
+constant replies with ctx.reply_static() so the webhook can serve
+pre-rendered TwiML (see twiml.py).
+
+The async webhook uses adispatch(): handlers with an @async_variant are
+awaited directly, the rest run in a thread through sync_to_async.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from twilio.twiml.messaging_response import MessagingResponse
+
+from . import metrics, twiml
+
+
+class Context:
+    def __init__(self, user, text):
+        self.user = user
+        self.text = text
+        self.lowered = text.lower()
+        self.dirty = set()
+        self.response = None
+        self.static = None
+
+    @property
+    def msg(self):
+        # Built on the first dynamic reply; static replies never need it
+        if self.response is None:
+            self.response = MessagingResponse()
+            self._msg = self.response.message()
+        return self._msg
+
+    def reply(self, body):
+        if self.static is not None:
+            self.msg.body(twiml.text(self.static, self.user.preferred_language))
+            self.static = None
+        self.msg.body(body)
+
+    def reply_static(self, name):
+        if self.response is not None:
+            self.msg.body(twiml.text(name, self.user.preferred_language))
+        else:
+            self.static = name
+
+    def render(self):
+        """
+        The TwiML answer, as bytes.
+        """
+        if self.response is not None:
+            return str(self.response).encode()
+        if self.static is not None:
+            return twiml.get(self.static, self.user.preferred_language)
+        return twiml.EMPTY
+
+    def set(self, **fields):
+        for name, value in fields.items():
+            setattr(self.user, name, value)
+            self.dirty.add(name)
+
+    def mark_dirty(self, *names):
+        self.dirty.update(names)
+
+    def save(self):
+        self.user.save(update_fields=self._update_fields())
+        self.dirty.clear()
+
+    async def asave(self):
+        await self.user.asave(update_fields=self._update_fields())
+        self.dirty.clear()
+
+    def _update_fields(self):
+        # last_interaction (auto_now) is kept current on every message
+        return sorted(self.dirty | {"last_interaction"})
+
+
+REGISTRATION = {}
+PRIORITY_PENDING = {}
+COMMANDS = {}
+PENDING = {}
+CRISIS = {}
+FALLBACK = {}
+ASYNC_VARIANTS = {}
+
+
+def _register(table, keys):
+    def decorator(fn):
+        for key in keys:
+            table[key] = fn
+        return fn
+    return decorator
+
+
+def registration(state):
+    return _register(REGISTRATION, [state])
+
+
+def priority_pending(*actions):
+    return _register(PRIORITY_PENDING, actions)
+
+
+def command(*aliases):
+    return _register(COMMANDS, [alias.lower() for alias in aliases])
+
+
+def pending(*actions):
+    return _register(PENDING, actions)
+
+
+def crisis(detector):
+    def decorator(fn):
+        CRISIS["detector"] = detector
+        CRISIS["handler"] = fn
+        return fn
+    return decorator
+
+
+def fallback(fn):
+    FALLBACK["handler"] = fn
+    return fn
+
+
+def async_variant(handler):
+    """
+    Registers a coroutine to run instead of `handler` under adispatch().
+    """
+    def decorator(fn):
+        ASYNC_VARIANTS[handler] = fn
+        return fn
+    return decorator
+
+
+def registration_state(user):
+    if not user.registered:
+        return "new"
+    if not user.name:
+        return "ask_name"
+    if not user.role:
+        return "ask_role"
+    return None
+
+
+def resolve(ctx):
+    user = ctx.user
+
+    state = registration_state(user)
+    if state:
+        return REGISTRATION[state]
+
+    handler = PRIORITY_PENDING.get(user.pending_action)
+    if handler:
+        return handler
+
+    handler = COMMANDS.get(ctx.lowered)
+    if handler:
+        return handler
+
+    if CRISIS and CRISIS["detector"](ctx.text):
+        return CRISIS["handler"]
+
+    handler = PENDING.get(user.pending_action)
+    if handler:
+        return handler
+
+    return FALLBACK["handler"]
+
+
+def dispatch(ctx):
+    """
+    Runs the handler for this message and records how long it took.
+    Returns the handler's name.
+    """
+    handler = resolve(ctx)
+
+    start = time.perf_counter()
+    handler(ctx)
+    metrics.observe(f"handler.{handler.__name__}", time.perf_counter() - start)
+
+    return handler.__name__
+
+
+async def adispatch(ctx):
+    handler = resolve(ctx)
+
+    start = time.perf_counter()
+    variant = ASYNC_VARIANTS.get(handler)
+    if variant:
+        await variant(ctx)
+    else:
+        await sync_to_async(handler)(ctx)
+    metrics.observe(f"handler.{handler.__name__}", time.perf_counter() - start)
+
+    return handler.__name__
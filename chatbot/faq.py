@@ -0,0 +1,29 @@
+# Curated questions used to pre-warm the AI response cache
+# (see `python manage.py warm_ai_cache`).
+
+FAQ_QUESTIONS = [
+    "What is sickle cell disease?",
+    "What causes sickle cell disease?",
+    "Is sickle cell disease contagious?",
+    "What are the symptoms of sickle cell disease?",
+    "What is a sickle cell crisis?",
+    "What triggers a sickle cell crisis?",
+    "How can I prevent a sickle cell crisis?",
+    "What foods help with sickle cell?",
+    "How much water should I drink every day?",
+    "Can people with sickle cell exercise?",
+    "What is the difference between sickle cell trait and sickle cell disease?",
+    "How is sickle cell disease diagnosed?",
+    "What treatments are available for sickle cell disease?",
+    "What is hydroxyurea used for?",
+    "Why is folic acid important in sickle cell?",
+    "When should I go to the hospital during a crisis?",
+    "How can I manage pain at home?",
+    "Can a person with sickle cell trait donate blood?",
+    "Who can donate blood for sickle cell patients?",
+    "How can I support a child with sickle cell disease?",
+    "How does cold weather affect sickle cell?",
+    "Can people with sickle cell travel by plane?",
+    "Is there a cure for sickle cell disease?",
+    "How does sickle cell affect mental health?",
+]
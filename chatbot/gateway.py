@@ -0,0 +1,229 @@
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+
+# Twilio WhatsApp max per message
+MAX_MESSAGE_LEN = 1600
+
+# Lower numbers leave the outbound queue first
+PRIORITY_CRISIS = 0
+PRIORITY_REPLY = 5
+PRIORITY_REMINDER = 10
+
+
+class GatewayError(Exception):
+    pass
+
+
+def whatsapp_address(number):
+    """
+    Normalises a phone number (or an existing whatsapp: address) to the
+    whatsapp:+<digits> form the Messages API expects.
+    """
+    number = str(number).strip()
+    if number.startswith("whatsapp:"):
+        return number
+    number = number.replace(" ", "")
+    if not number.startswith("+"):
+        number = f"+{number}"
+    return f"whatsapp:{number}"
+
+
+def response_sid(response):
+    """
+    The message SID from a Messages API response. Raises GatewayError when
+    the body is not the JSON object Twilio sends (e.g. a proxy error page).
+    """
+    try:
+        return response.json().get("sid")
+    except (ValueError, AttributeError) as e:
+        raise GatewayError(f"Unexpected response (HTTP {response.status_code}): {response.text[:200]}") from e
+
+
+def split_message(message, max_len=MAX_MESSAGE_LEN):
+    return [message[i:i + max_len] for i in range(0, len(message), max_len)] or [""]
+
+
+class WhatsAppGateway:
+    """
+    Process-wide outbound WhatsApp sender.
+
+    Keeps one keep-alive HTTP session to the Twilio Messages API and a small
+    pool of sender threads so bursts (reminders, crisis alerts) are sent
+    concurrently instead of one blocking request after another. Queued
+    messages are sent in priority order, so crisis alerts overtake a
+    reminder burst that is already waiting.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number,
+                 api_base="https://api.twilio.com", max_workers=8, timeout=10):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+    @property
+    def messages_url(self):
+        return f"{self.api_base}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+
+    @property
+    def configured(self):
+        return bool(self.account_sid and self.auth_token and self.from_number)
+
+    def send(self, to, body=None, media_url=None):
+        """
+        Sends one message (split into 1600-char parts if needed) and returns
+        the list of Twilio message SIDs. Raises GatewayError on failure.
+        """
+        if not self.configured:
+            raise GatewayError("Twilio credentials not set in environment variables.")
+
+        if media_url:
+            parts = [body or ""]
+        else:
+            parts = split_message(body or "")
+
+        sids = []
+        for index, part in enumerate(parts):
+            data = {
+                "From": whatsapp_address(self.from_number),
+                "To": whatsapp_address(to),
+                "Body": part,
+            }
+            if media_url and index == 0:
+                data["MediaUrl"] = media_url
+
+            try:
+                with metrics.timed("stage.twilio_send"):
+                    response = self.session.post(self.messages_url, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                raise GatewayError(str(e)) from e
+
+            if response.status_code >= 400:
+                raise GatewayError(f"HTTP {response.status_code}: {response.text[:200]}")
+            sids.append(response_sid(response))
+
+        return sids
+
+    def submit(self, to, body=None, media_url=None, priority=PRIORITY_REPLY):
+        """
+        Queues a message and returns a Future resolving to its SIDs.
+        """
+        self._start_workers()
+        future = Future()
+        self._queue.put((priority, next(self._sequence), future, (to, body, media_url)))
+        return future
+
+    def send_many(self, messages, priority=PRIORITY_REPLY):
+        """
+        Sends (to, body) or (to, body, media_url) tuples concurrently.
+        Returns a list of (to, sids or None, error or None) in input order.
+        """
+        futures = [(message[0], self.submit(*message, priority=priority)) for message in messages]
+
+        results = []
+        for to, future in futures:
+            try:
+                results.append((to, future.result(), None))
+            except Exception as e:
+                results.append((to, None, e))
+        return results
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def active_workers(self):
+        return sum(worker.is_alive() for worker in self._workers)
+
+    def _start_workers(self):
+        if len(self._workers) >= self.max_workers:
+            return
+        with self._workers_lock:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._work,
+                    name=f"whatsapp-gateway-{len(self._workers)}",
+                    daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            _, _, future, args = self._queue.get()
+            if future is None:
+                break
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.send(*args))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def close(self):
+        with self._workers_lock:
+            for _ in self._workers:
+                # Sorts after every real message, so queued work is drained first
+                self._queue.put((float("inf"), next(self._sequence), None, None))
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+        self.session.close()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = WhatsAppGateway(
+                    account_sid=os.getenv("TWILIO_ACCOUNT_SID"),
+                    auth_token=os.getenv("TWILIO_AUTH_TOKEN"),
+                    from_number=os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886"),
+                    api_base=os.getenv("TWILIO_API_BASE", "https://api.twilio.com"),
+                    max_workers=int(os.getenv("WHATSAPP_GATEWAY_WORKERS", "8")),
+                    timeout=float(os.getenv("WHATSAPP_GATEWAY_TIMEOUT", "10")),
+                )
+    return _gateway
+
+
+def set_gateway(gateway):
+    """
+    Replaces the process-wide gateway (e.g. to point it at a stub server).
+    """
+    global _gateway
+
+    with _gateway_lock:
+        previous, _gateway = _gateway, gateway
+    if previous is not None and previous is not gateway:
+        previous.close()
+
+
+# Read from whichever gateway is current when metrics are scraped
+metrics.gauge("outbound_queue_depth", lambda: _gateway.pending() if _gateway else 0)
+metrics.gauge("gateway_sender_threads", lambda: _gateway.active_workers() if _gateway else 0)
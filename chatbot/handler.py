@@ -1,38 +1,383 @@
+import asyncio
+from datetime import datetime
 
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from . import aio, bursts, detector
+from .dispatch import async_variant, command, crisis, fallback, pending, priority_pending, registration, resolve
+from .models import Reminder, Resource
 from .resources import get_resources_by_keyword
-from .utils import send_whatsapp_media
+from .media import media_url
+from .tasks import (
+    enqueue, flush_ai_burst, handle_ai_async, handle_crisis_async, send_media_batch_async, update_summary_async,
+)
+from .retention import clear_chat_history
+from .twiml import static_reply
+from .utils import handle_crisis
 
-resource_map = {
-    "1": "hydration",
-    "2": "pain",
-    "3": "medication",
+
+def detect_crisis(message):
+    return detector.detect(message).is_crisis
+
+
+# --- Registration flow ---
+
+WELCOME = static_reply("welcome", "👋 Welcome to *SickleCare*! Please reply with your *name* to register.")
+REGISTERED = static_reply("registered", "✅ Registration complete! Type *menu* to see options.")
+ASK_ROLE_AGAIN = static_reply("ask_role_again", "Please reply with one of: Patient, Caregiver, or Donor.")
+
+
+@registration("new")
+def register_new_user(ctx):
+    ctx.reply_static(WELCOME)
+    ctx.set(registered=True)
+
+
+@registration("ask_name")
+def register_name(ctx):
+    ctx.set(name=ctx.text)
+    ctx.reply(f"Thanks {ctx.user.name}! Are you a *Patient*, *Caregiver*, or *Donor*?")
+
+
+@registration("ask_role")
+def register_role(ctx):
+    if ctx.lowered in ["patient", "caregiver", "donor"]:
+        ctx.set(role=ctx.lowered)
+        ctx.reply_static(REGISTERED)
+    else:
+        ctx.reply_static(ASK_ROLE_AGAIN)
+
+
+# --- Pending actions answered before any command ---
+
+LOCATION_SAVED = static_reply("location_saved", "Thanks. I will use this location to send help suggestions.")
+INVALID_CONTACT = static_reply(
+    "invalid_contact",
+    "❌ Invalid number format. Please send a valid WhatsApp number including country code.\n\nExample: +254712345678",
+)
+
+
+@priority_pending("set_location_for_crisis")
+def save_crisis_location(ctx):
+    ctx.set(location=ctx.text, pending_action=None)
+    ctx.reply_static(LOCATION_SAVED)
+
+
+# Continue emergency contact registration
+@priority_pending("add_emergency_contact")
+def save_emergency_contact(ctx):
+    number = ctx.text.strip()
+
+    # Simple validation
+    if not number.startswith("+") or len(number) < 10:
+        ctx.reply_static(INVALID_CONTACT)
+        return
+
+    # Save number (copy so the change is detected as dirty)
+    contacts = list(ctx.user.emergency_contacts or [])
+    contacts.append(number)
+    ctx.set(emergency_contacts=contacts, pending_action=None)
+
+    ctx.reply(
+        f"✅ Emergency contact *{number}* saved!\n"
+        "You can add more later by typing *add contact*.\n\n"
+        "If you're still in crisis, just say: *help* or *I'm in pain*."
+    )
+
+
+# --- Commands and menu ---
+
+MENU = static_reply(
+    "menu",
+    "📋 *Main Menu*\n"
+    "1️⃣ Sickle Cell Info\n"
+    "2️⃣ Find Resources\n"
+    "3️⃣ Crisis Support\n\n"
+    "Type 1, 2, or 3."
+)
+INFO_PROMPT = static_reply("info_prompt", "🧬 Ask me anything about Sickle Cell Disease.")
+COMMUNITIES = static_reply(
+    "communities",
+    "🌍 *Sickle Cell Communities & Support Groups*\n\n"
+
+    "🔴 *YouTube Channels*\n"
+    "• Sickle Cell 101: https://www.youtube.com/@sicklecell101\n"
+    "• Sickle Cell Society UK: https://www.youtube.com/@SickleCellUK\n\n"
+
+    "🔵 *Facebook Groups*\n"
+    "• Sickle Cell Warriors: https://www.facebook.com/groups/SCWarriors\n"
+    "• Sickle Cell Association: https://www.facebook.com/sicklecellassociation\n\n"
+
+    "🟣 *Instagram Communities*\n"
+    "• @sicklecell101: https://instagram.com/sicklecell101\n"
+    "• @sicklecellwarriors: https://instagram.com/sicklecellwarriors\n\n"
+
+    "🟠 *Reddit Community*\n"
+    "• r/Sicklecell: https://www.reddit.com/r/sicklecell/\n"
+    "• r/ChronicIllnes: https://www.reddit.com/r/ChronicIllness/\n\n"
+
+    "🌐 *Helpful Websites*\n"
+    "• Sickle Cell 101: https://www.sicklecell101.org\n"
+    "• Sickle Cell Society UK: https://www.sicklecellsociety.org\n"
+    "• CDC Sickle Cell Info: https://www.cdc.gov/ncbddd/sicklecell\n"
+    "• WHO Sickle Cell: https://www.who.int/health-topics/sickle-cell-disease\n\n"
+
+    "Feel free to explore these communities for support and information!\n"
+    "Type *resources* for our guides on hydration, pain, medication and more."
+)
+
+
+@command("menu")
+def show_menu(ctx):
+    ctx.reply_static(MENU)
+
+
+@command("1")
+def show_info_prompt(ctx):
+    ctx.reply_static(INFO_PROMPT)
+
+
+@command("2")
+def show_communities(ctx):
+    ctx.reply_static(COMMUNITIES)
+
+
+# --- Resource library ---
+
+# Menu numbers for the Resource categories
+RESOURCE_CATEGORIES = {
+    "1": "education",
+    "2": "nutrition",
+    "3": "pain",
     "4": "emergency",
     "5": "mental",
-    "6": "caregiver"
+    "6": "caregiver",
 }
+RESOURCE_MENU = static_reply(
+    "resource_menu",
+    "📚 *Resources*\n"
+    "1️⃣ Sickle Cell Education\n"
+    "2️⃣ Nutrition & Hydration\n"
+    "3️⃣ Pain Management\n"
+    "4️⃣ Emergency Guide\n"
+    "5️⃣ Mental Health\n"
+    "6️⃣ Caregiver Guide\n\n"
+    "Type a number from 1 to 6."
+)
 
-def handle_resource_menu(incoming_msg, profile, msg, response, phone):
-    if incoming_msg not in resource_map:
-        return None  # Means not handled here
 
-    keyword = resource_map[incoming_msg]
-    user_lang = profile.preferred_language if profile else "English"
+@command("resources")
+def show_resource_menu(ctx):
+    ctx.set(pending_action="choose_resource")
+    ctx.reply_static(RESOURCE_MENU)
 
-    results = get_resources_by_keyword(keyword, user_lang)
 
-    if not results.exists():
-        msg.body(f"⚠️ Sorry, no resources available for *{keyword.title()}* yet.")
-        return HttpResponse(str(response), content_type="application/xml")
+@priority_pending("choose_resource")
+def send_resources(ctx):
+    ctx.set(pending_action=None)
+    category = RESOURCE_CATEGORIES.get(ctx.text.strip())
+    if category is None:
+        # Anything else leaves the resource menu and is handled as usual
+        resolve(ctx)(ctx)
+        return
 
-    msg.body(f"📎 *Resources for {keyword.title()}*:\n")
+    label = dict(Resource.CATEGORY_CHOICES)[category]
+    results = get_resources_by_keyword(category, ctx.user.preferred_language or "English")
+    if not results:
+        ctx.reply(f"⚠️ Sorry, no resources available for *{label}* yet.")
+        return
 
+    ctx.reply(f"📎 *Resources for {label}*:\n")
+
+    media = []
     for r in results:
         if r.link:
-            msg.body(f"\n🔗 *{r.title}*\n{r.link}")
+            ctx.reply(f"\n🔗 *{r.title}*\n{r.link}")
+
+        url = media_url(r)
+        if url:
+            media.append((url, r.title))
+
+    # Files follow the reply, sent together by an outbound worker
+    if media and not enqueue(send_media_batch_async, ctx.user.phone_number, media):
+        ctx.reply("\n⚠️ The files can't be sent right now. Type *resources* to try again in a minute.")
+
+    ctx.reply("\n✅ Reply *menu* to go back.")
+
+
+# --- Menu Options - Crisis Support ---
+CRISIS_SUPPORT = static_reply("crisis_support", "🚑 Crisis support activated. How are you feeling?")
+
+
+@command("3")
+def show_crisis_support(ctx):
+    ctx.reply_static(CRISIS_SUPPORT)
+
+
+# --- 1. CLEAR LOCATION ---
+LOCATION_CLEARED = static_reply(
+    "location_cleared",
+    "🗑️ Your saved location has been cleared.\nYou can set a new one by typing:\n\n• location Nairobi\n• set location Kisumu",
+)
+
+
+@command("clear location", "reset location")
+def clear_location(ctx):
+    ctx.set(location=None)
+    ctx.reply_static(LOCATION_CLEARED)
+
+
+# --- 2. CLEAR EMERGENCY CONTACTS ---
+CONTACTS_CLEARED = static_reply(
+    "contacts_cleared",
+    "🗑️ All emergency contacts have been removed.\nYou can add a new one anytime using:\n\n• add contact\n• +2547xxxxxxxx",
+)
+
+
+@command("clear contacts", "reset contacts", "delete contacts")
+def clear_contacts(ctx):
+    ctx.set(emergency_contacts=[])
+    ctx.reply_static(CONTACTS_CLEARED)
+
+
+# --- Reset chat history ---
+CHAT_CLEARED = static_reply("chat_cleared", "🧠 Chat memory cleared!")
+
+
+@command("reset")
+def reset_chat(ctx):
+    clear_chat_history(ctx.user)
+    ctx.reply_static(CHAT_CLEARED)
+
+
+# Add emergency contact flow
+ASK_CONTACT = static_reply("ask_contact", "📞 Send the phone number of your emergency contact.\nExample: +254712345678")
+
+
+@command("add contact", "add emergency contact")
+def ask_emergency_contact(ctx):
+    ctx.reply_static(ASK_CONTACT)
+    ctx.set(pending_action="add_emergency_contact")
+
+
+# --- Reminder flow ---
+
+ASK_REMINDER_TEXT = static_reply("ask_reminder_text", "📌 Sure! What should I remind you about?")
+ASK_REMINDER_TIME = static_reply("ask_reminder_time", "⏰ Great! What time? (24hr format HH:MM)")
+INVALID_TIME = static_reply("invalid_time", "❌ Invalid time format. Use HH:MM (24hr)")
+
+@command("reminder", "set reminder", "remind me")
+def start_reminder(ctx):
+    if ctx.user.pending_action:
+        # Already in the middle of setting one; treat the text as the answer
+        handler = REMINDER_STEPS.get(ctx.user.pending_action)
+        if handler:
+            handler(ctx)
+        return
+
+    ctx.set(pending_action="ask_reminder_text")
+    ctx.reply_static(ASK_REMINDER_TEXT)
+
+
+@pending("ask_reminder_text")
+def save_reminder_text(ctx):
+    ctx.set(temp_reminder_text=ctx.text, pending_action="ask_reminder_time")
+    ctx.reply_static(ASK_REMINDER_TIME)
+
+
+@pending("ask_reminder_time")
+def save_reminder_time(ctx):
+    try:
+        datetime.strptime(ctx.text, "%H:%M")
+        Reminder.objects.create(
+            user=ctx.user,
+            message=ctx.user.temp_reminder_text,
+            time=ctx.text,
+            recurring=True
+        )
+        ctx.reply(f"✅ Daily reminder set for *{ctx.text}*")
+    except ValueError:
+        ctx.reply_static(INVALID_TIME)
+
+    ctx.set(pending_action=None, temp_reminder_text=None)
+
+
+REMINDER_STEPS = {
+    "ask_reminder_text": save_reminder_text,
+    "ask_reminder_time": save_reminder_time,
+}
+
+
+# --- Crisis check ---
+
+ASK_CRISIS_LOCATION = static_reply(
+    "ask_crisis_location",
+    "📍 I need your location name to guide you to the nearest hospital.\n"
+    "Please send your location (e.g., 'Nairobi', 'Kisumu', 'Rongai').",
+)
+ASK_CRISIS_CONTACT = static_reply(
+    "ask_crisis_contact",
+    "⚠️ You have *no emergency contacts* saved.\n"
+    "Please send at least *one phone number* of someone to notify during a crisis.\n\n"
+    "Example: +254712345678",
+)
+
+@crisis(detect_crisis)
+def start_crisis_support(ctx):
+    user = ctx.user
+
+    # 1. Require location next
+    if not user.location:
+        ctx.reply_static(ASK_CRISIS_LOCATION)
+        ctx.set(pending_action="set_location_for_crisis")
+        return
+
+    # 2. Require emergency contacts first
+    if not user.emergency_contacts or len(user.emergency_contacts) == 0:
+        ctx.reply_static(ASK_CRISIS_CONTACT)
+        ctx.set(pending_action="add_emergency_contact")
+        return
+
+    # 3. If both exist → proceed with crisis help (right here if the queue is down)
+    if not enqueue(handle_crisis_async, user.id, ctx.text):
+        handle_crisis(user, ctx.text)
+
+
+#  --- AI HANDLING (ASYNC) ---
+AI_BUSY = static_reply("ai_busy", "⚠️ I can't answer questions right now. Please send yours again in a minute.")
+
+
+@fallback
+def ask_ai(ctx):
+    # The worker records the user's turn together with the reply
+    if not bursts.enabled() or flush_ai_burst.app.conf.task_always_eager:
+        queued = enqueue(handle_ai_async, ctx.user.id, ctx.text)
+    else:
+        # Answered once the user stops typing, together with the rest of the burst
+        seq, countdown = bursts.add(ctx.user.id, ctx.text)
+        queued = enqueue(flush_ai_burst, ctx.user.id, seq, countdown=countdown)
+
+    if not queued:
+        ctx.reply_static(AI_BUSY)
+
+
+@async_variant(ask_ai)
+async def ask_ai_in_loop(ctx):
+    # Answered from the event loop once the webhook has replied to Twilio
+    if not bursts.enabled():
+        aio.spawn(_reply_with_ai(ctx.user, ctx.text))
+        return
+
+    seq, countdown = await sync_to_async(bursts.add, thread_sensitive=False)(ctx.user.id, ctx.text)
+    aio.spawn(_flush_burst(ctx.user, seq, countdown))
+
+
+async def _flush_burst(user, seq, countdown):
+    await asyncio.sleep(countdown)
+    text = await sync_to_async(bursts.take, thread_sensitive=False)(user.id, seq)
+    if text:
+        await _reply_with_ai(user, text)
 
-        if r.file:
-            send_whatsapp_media(phone, r.file.url)
 
-    msg.body("\n✅ Reply *menu* to go back.")
-    return HttpResponse(str(response), content_type="application/xml")
+async def _reply_with_ai(user, text):
+    await aio.reply_with_ai(user, text)
+    await sync_to_async(enqueue, thread_sensitive=False)(update_summary_async, user.id)
@@ -0,0 +1,149 @@
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .cache import SingleFlight, TTLCache
+
+
+TEXT_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+DETAILS_URL = "https://maps.googleapis.com/maps/api/place/details/json"
+
+logger = logging.getLogger(__name__)
+
+# Results where a lookup failed or timed out are kept only briefly
+PARTIAL_RESULT_TTL = 10 * 60
+
+_cache = TTLCache(
+    max_entries=getattr(settings, "HOSPITAL_CACHE_MAX_ENTRIES", 2000),
+    ttl=getattr(settings, "HOSPITAL_CACHE_TTL", 7 * 24 * 60 * 60),
+)
+_flight = SingleFlight()
+_session = requests.Session()
+_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="hospital-lookup")
+
+_non_word = re.compile(r"[^\w\s]")
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_location(location):
+    location = _non_word.sub(" ", (location or "").lower())
+    location = _whitespace.sub(" ", location).strip()
+    for prefix in ("set location ", "location "):
+        if location.startswith(prefix):
+            location = location[len(prefix):]
+    return location
+
+
+def _shared():
+    alias = getattr(settings, "HOSPITAL_CACHE_SHARED_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def _fetch_phone(place_id, api_key, timeout):
+    response = _session.get(
+        DETAILS_URL,
+        params={"place_id": place_id, "fields": "formatted_phone_number", "key": api_key},
+        timeout=timeout,
+    )
+    return response.json().get("result", {}).get("formatted_phone_number")
+
+
+def lookup_hospitals(user_location, deadline):
+    """
+    Uncached lookup: one text search, then the top three Place Details
+    requests in parallel. Everything has to finish before `deadline`
+    (a time.monotonic() value); hospitals whose details are late are
+    returned without a phone number.
+
+    Returns (hospitals, complete).
+    """
+    api_key = os.getenv("GOOGLE_MAPS_KEY")
+
+    try:
+        response = _session.get(
+            TEXT_SEARCH_URL,
+            params={"query": f"hospitals near {user_location}", "key": api_key},
+            timeout=max(deadline - time.monotonic(), 0.1),
+        )
+        data = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("Hospital search failed for %s: %s", user_location, e)
+        return [], False
+
+    hospitals = []
+    futures = {}
+
+    for result in data.get("results", [])[:3]:  # Return top 3
+        hospital = {
+            "name": result["name"],
+            "address": result.get("formatted_address", "N/A"),
+            "location": result["geometry"]["location"],
+            "phone": None
+        }
+        hospitals.append(hospital)
+
+        place_id = result.get("place_id")
+        if place_id:
+            timeout = max(deadline - time.monotonic(), 0.1)
+            futures[_executor.submit(_fetch_phone, place_id, api_key, timeout)] = hospital
+
+    complete = True
+    if futures:
+        done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        complete = not not_done
+        for future in done:
+            try:
+                futures[future]["phone"] = future.result()
+            except (requests.RequestException, ValueError):
+                complete = False
+
+    return hospitals, complete
+
+
+def get_nearby_hospitals(user_location):
+    """
+    Cached hospital lookup keyed on the normalised location. Concurrent
+    lookups for the same place share one upstream request.
+    """
+    key = normalize_location(user_location)
+    if not key:
+        return []
+
+    hospitals = _cache.get(key)
+    if hospitals is not None:
+        return hospitals
+
+    shared = _shared()
+    if shared is not None:
+        hospitals = shared.get(f"hospitals:{key}")
+        if hospitals is not None:
+            _cache.set(key, hospitals)
+            return hospitals
+
+    def load():
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+        deadline = time.monotonic() + getattr(settings, "HOSPITAL_LOOKUP_DEADLINE", 4.0)
+        with metrics.timed("stage.maps_lookup"):
+            result, complete = lookup_hospitals(user_location, deadline)
+        ttl = _cache.ttl if complete and result else PARTIAL_RESULT_TTL
+
+        _cache.set(key, result, ttl=ttl)
+        if shared is not None:
+            shared.set(f"hospitals:{key}", result, timeout=ttl)
+        return result
+
+    return _flight.do(key, load)
+
+
+def stats():
+    return dict(_cache.stats(), shared_lookups=_flight.shared)
@@ -0,0 +1,147 @@
+"""
+Absorbs Twilio webhook retries.
+
+Twilio re-sends a webhook it did not get a quick answer to, with the same
+MessageSid. The first delivery claims the sid by inserting a
+ProcessedMessage row (the unique index makes this safe across processes)
+and stores its TwiML when done; a retry gets that TwiML back without the
+conversation being run again. A retry that arrives while the first
+delivery is still running gets an empty response, since the original
+will still answer. A delivery that fails releases its claim, so the
+retry runs the conversation again.
+
+Finished responses are also kept in a bounded in-process cache, so most
+replays do not touch the database.
+"""
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import metrics
+from .cache import TTLCache
+from .models import ProcessedMessage
+
+
+EMPTY_RESPONSE = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+_cache = TTLCache(
+    max_entries=getattr(settings, "IDEMPOTENCY_CACHE_MAX_ENTRIES", 10000),
+    ttl=getattr(settings, "IDEMPOTENCY_TTL", 24 * 60 * 60),
+)
+
+
+def _claim(message_sid):
+    """
+    Inserts the record for `message_sid`. Returns None when this delivery
+    got it, otherwise the stored TwiML ("" while still being handled).
+    """
+    try:
+        # In a savepoint, so a duplicate does not break an enclosing transaction
+        with transaction.atomic():
+            ProcessedMessage.objects.create(message_sid=message_sid)
+        return None
+    except IntegrityError:
+        return (
+            ProcessedMessage.objects
+            .filter(message_sid=message_sid)
+            .values_list("response", flat=True)
+            .first()
+        ) or ""
+
+
+def begin(message_sid):
+    """
+    Claims `message_sid` for this delivery. Returns None for a new message,
+    or the TwiML to answer a duplicate with.
+    """
+    metrics.incr("webhook.messages")
+    if not message_sid:
+        return None
+
+    response = _cache.get(message_sid)
+    if response is None:
+        response = _claim(message_sid)
+        if response is None:
+            return None
+        if response:
+            _cache.set(message_sid, response)
+
+    metrics.incr("webhook.duplicates")
+    return response or EMPTY_RESPONSE
+
+
+def finish(message_sid, response):
+    """
+    Stores the TwiML (str or bytes) returned for `message_sid`.
+    """
+    if not message_sid:
+        return
+    if isinstance(response, bytes):
+        response = response.decode()
+    ProcessedMessage.objects.filter(message_sid=message_sid).update(response=response)
+    _cache.set(message_sid, response)
+
+
+def release(message_sid):
+    """
+    Gives up the claim on `message_sid` after its handling failed, so a
+    retry is handled afresh instead of getting an empty response.
+    """
+    if message_sid:
+        ProcessedMessage.objects.filter(message_sid=message_sid, response="").delete()
+
+
+async def abegin(message_sid):
+    metrics.incr("webhook.messages")
+    if not message_sid:
+        return None
+
+    response = _cache.get(message_sid)
+    if response is None:
+        # Transactions have no async API yet
+        response = await sync_to_async(_claim)(message_sid)
+        if response is None:
+            return None
+        if response:
+            _cache.set(message_sid, response)
+
+    metrics.incr("webhook.duplicates")
+    return response or EMPTY_RESPONSE
+
+
+async def afinish(message_sid, response):
+    if not message_sid:
+        return
+    if isinstance(response, bytes):
+        response = response.decode()
+    await ProcessedMessage.objects.filter(message_sid=message_sid).aupdate(response=response)
+    _cache.set(message_sid, response)
+
+
+async def arelease(message_sid):
+    if message_sid:
+        await ProcessedMessage.objects.filter(message_sid=message_sid, response="").adelete()
+
+
+def purge_processed_messages():
+    """
+    Deletes records older than the replay window. Returns the number removed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=_cache.ttl)
+    deleted, _ = ProcessedMessage.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def stats():
+    counters = metrics.counters()
+    messages = counters.get("webhook.messages", 0)
+    duplicates = counters.get("webhook.duplicates", 0)
+    return {
+        "messages": messages,
+        "duplicates": duplicates,
+        "duplicate_rate": round(duplicates / messages, 4) if messages else 0.0,
+        "cache": _cache.stats(),
+    }
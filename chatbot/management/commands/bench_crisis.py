@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.crisis_corpus import LABELLED_MESSAGES
+from chatbot.detector import CrisisDetector
+
+
+def keyword_detect(message):
+    # The detector the webhook used before, kept for comparison
+    crisis_keywords = ["pain", "crisis", "can't breathe", "severe", "hospital"]
+    return any(word in message.lower() for word in crisis_keywords)
+
+
+class Command(BaseCommand):
+    help = "Scores the crisis detector against the labelled corpus and times it per message."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=200, help="Passes over the corpus when timing")
+        parser.add_argument("--show-errors", action="store_true", help="List misclassified messages")
+
+    def handle(self, *args, **options):
+        detector = CrisisDetector()
+        rounds = options["rounds"]
+        texts = [text for text, _ in LABELLED_MESSAGES]
+
+        self.report("compiled", lambda text: detector.detect(text).is_crisis, options["show_errors"])
+        self.report("keywords", keyword_detect, False)
+
+        for name, fn in (("compiled", detector.detect), ("keywords", keyword_detect)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for text in texts:
+                    fn(text)
+            per_message = (time.perf_counter() - start) / (rounds * len(texts))
+            self.stdout.write(f"{name}: {per_message * 1e6:.2f} µs/message")
+
+    def report(self, name, fn, show_errors):
+        tp = fp = fn_ = tn = 0
+        errors = []
+        for text, expected in LABELLED_MESSAGES:
+            got = fn(text)
+            if got and expected:
+                tp += 1
+            elif got:
+                fp += 1
+            elif expected:
+                fn_ += 1
+            else:
+                tn += 1
+            if got != expected:
+                errors.append((text, expected))
+
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn_) if tp + fn_ else 0.0
+        self.stdout.write(
+            f"{name}: {len(LABELLED_MESSAGES)} messages, accuracy {(tp + tn) / len(LABELLED_MESSAGES):.1%}, "
+            f"precision {precision:.1%}, recall {recall:.1%} ({fp} false alarms, {fn_} missed)"
+        )
+        if show_errors:
+            for text, expected in errors:
+                self.stdout.write(f"  {'missed' if expected else 'false alarm'}: {text}")
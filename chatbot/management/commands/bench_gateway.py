@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.gateway import WhatsAppGateway
+from chatbot.stubs import TwilioStub
+
+
+class Command(BaseCommand):
+    help = "Measures outbound WhatsApp throughput against a local stub Twilio server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=0.05, help="Stub latency per request (seconds)")
+        parser.add_argument("--error-rate", type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        total = options["messages"]
+
+        with TwilioStub(latency=options["latency"], error_rate=options["error_rate"]) as stub:
+            gateway = WhatsAppGateway(
+                account_sid="ACstub",
+                auth_token="stub",
+                from_number="whatsapp:+14155238886",
+                api_base=stub.url,
+                max_workers=options["workers"],
+            )
+
+            messages = [(f"+2547{i:08d}", f"⏰ Reminder: drink water ({i})") for i in range(total)]
+
+            start = time.perf_counter()
+            results = gateway.send_many(messages)
+            elapsed = time.perf_counter() - start
+            gateway.close()
+
+        failed = sum(1 for _, _, error in results if error)
+        self.stdout.write(
+            f"Sent {total - failed}/{total} messages in {elapsed:.2f}s "
+            f"({total / elapsed:.1f} msg/s, {options['workers']} workers, {failed} failed)"
+        )
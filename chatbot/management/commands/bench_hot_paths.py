@@ -0,0 +1,279 @@
+import contextlib
+import json
+import platform
+import random
+import statistics
+import time
+import timeit
+from datetime import timedelta
+from itertools import cycle
+from unittest import mock
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chatbot import memory, resources, twiml
+from chatbot.crisis import parse_contacts
+from chatbot.crisis_corpus import LABELLED_MESSAGES
+from chatbot.dispatch import Context, resolve
+from chatbot.gateway import split_message
+from chatbot.handler import detect_crisis
+from chatbot.models import ChatHistory, Resource, UserProfile
+from chatbot.scratch import scratch_database
+from chatbot.utils import build_prompt
+
+
+PHONE_PREFIX = "+999300"
+RESOURCE_PREFIX = "[bench] "
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function gets the Seed and returns
+    the callable to time. Anything entered on seed.stack stays in effect
+    until that benchmark has been timed.
+    """
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return decorator
+
+
+class Seed:
+    def __init__(self, user_ids, rng):
+        self.user_ids = user_ids
+        self.rng = rng
+        self.stack = None
+
+    def users(self):
+        # Unsaved instances carrying what build_prompt reads, so no query loads them
+        ids = self.user_ids[:]
+        self.rng.shuffle(ids)
+        return cycle(UserProfile(pk=pk, phone_number=f"{PHONE_PREFIX}{pk}") for pk in ids)
+
+
+@benchmark("detect_crisis")
+def bench_detect_crisis(seed):
+    texts = cycle([text for text, _ in LABELLED_MESSAGES])
+    return lambda: detect_crisis(next(texts))
+
+
+@benchmark("build_prompt.buffered")
+def bench_build_prompt_buffered(seed):
+    # The turn buffer is only used with a shared cache; this process is the
+    # only one writing, so the local cache can stand in for it here
+    seed.stack.enter_context(mock.patch.object(memory, "is_shared", return_value=True))
+    user = next(seed.users())
+    build_prompt(user, "warm up")
+
+    hits = memory.buffer.hits
+    build_prompt(user, "warm up")
+    if memory.buffer.hits == hits:
+        raise CommandError("build_prompt.buffered is not reading from the turn buffer")
+    return lambda: build_prompt(user, "How much water should I drink?")
+
+
+@benchmark("build_prompt.database")
+def bench_build_prompt_database(seed):
+    # The user is dropped from the turn buffer first, so every call reads ChatHistory
+    users = seed.users()
+
+    def build():
+        user = next(users)
+        memory.forget_user(user)
+        return build_prompt(user, "How much water should I drink?")
+    return build
+
+
+@benchmark("split_message")
+def bench_split_message(seed):
+    text = "Stay hydrated and keep warm during cold weather. " * 100
+    return lambda: split_message(text)
+
+
+@benchmark("twiml.static")
+def bench_twiml_static(seed):
+    return lambda: twiml.get("menu")
+
+
+@benchmark("twiml.dynamic")
+def bench_twiml_dynamic(seed):
+    user = UserProfile(name="Bench", registered=True, role="patient")
+
+    def render():
+        ctx = Context(user, "08:30")
+        ctx.reply("✅ Daily reminder set for *08:30*")
+        return ctx.render()
+    return render
+
+
+@benchmark("dispatch.resolve")
+def bench_resolve(seed):
+    user = UserProfile(name="Bench", registered=True, role="patient")
+    texts = cycle(["menu", "2", "What foods help?", "I'm in severe pain"])
+    return lambda: resolve(Context(user, next(texts)))
+
+
+@benchmark("parse_contacts")
+def bench_parse_contacts(seed):
+    contacts = cycle([
+        ["+254711111111", "+254722222222", "", "+254733333333"],
+        "+254711111111, +254722222222,,+254733333333",
+    ])
+    return lambda: parse_contacts(next(contacts))
+
+
+@benchmark("resources.by_keyword")
+def bench_resources_by_keyword(seed):
+    keywords = cycle(["pain", "nutrition", "emergency", "mental"])
+    return lambda: resources.get_resources_by_keyword(next(keywords))
+
+
+@benchmark("resources.search_database")
+def bench_resources_search_database(seed):
+    queries = cycle(["pain", "hydration water", "crisis"])
+    return lambda: resources.search_database(next(queries))
+
+
+def measure(fn, repeat, min_time):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "per_call_us": round(min(runs) * 1e6, 3),
+        "median_us": round(statistics.median(runs) * 1e6, 3),
+        "calls": number * repeat,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the per-message hot paths against a seeded scratch database and writes the results "
+        "as JSON; with --compare, fails when a benchmark is slower than the baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--chat-rows", type=int, default=10_000_000)
+        parser.add_argument("--keep-seed", action="store_true",
+                            help="Keep the scratch database, and reuse its rows next time")
+        parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Benchmarks to run")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per repeat, roughly")
+        parser.add_argument("--output", help="Write results to this JSON file")
+        parser.add_argument("--compare", help="Baseline JSON file to compare against")
+        parser.add_argument("--threshold", type=float, default=0.25,
+                            help="Allowed slowdown before --compare fails (0.25 = 25%%)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+
+        with scratch_database(keep=options["keep_seed"]):
+            seed = Seed(self.seed_database(options["users"], options["chat_rows"]), random.Random(options["seed"]))
+            try:
+                results = {}
+                for name in options["only"] or BENCHMARKS:
+                    with contextlib.ExitStack() as seed.stack:
+                        results[name] = measure(BENCHMARKS[name](seed), options["repeat"], options["min_time"])
+                    self.stdout.write(f"{name:<28}{results[name]['per_call_us']:>12.2f} µs/call")
+            finally:
+                memory.writer.flush()
+
+        report = {
+            "meta": {
+                "created": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "users": options["users"],
+                "chat_rows": options["chat_rows"],
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline is not None:
+            self.compare(baseline["results"], results, options["threshold"])
+
+    def seed_database(self, users, chat_rows):
+        """
+        Creates `users` registered users with `chat_rows` chat turns between
+        them, unless they are already there. Returns the user ids.
+        """
+        seeded = UserProfile.objects.filter(phone_number__startswith=PHONE_PREFIX)
+        if seeded.count() != users:
+            self.drop_seed()
+            UserProfile.objects.bulk_create(
+                (UserProfile(phone_number=f"{PHONE_PREFIX}{i:07d}", name="Bench", role="patient", registered=True)
+                 for i in range(users)),
+                batch_size=5000,
+            )
+        user_ids = list(seeded.values_list("id", flat=True))
+
+        existing = ChatHistory.objects.filter(user_id__in=user_ids[:1]).count() * len(user_ids)
+        if user_ids and abs(existing - chat_rows) > len(user_ids):
+            self.stdout.write(f"Seeding {chat_rows} chat rows for {len(user_ids)} users...")
+            ChatHistory.objects.filter(user__phone_number__startswith=PHONE_PREFIX).delete()
+            self.seed_chat_rows(user_ids, chat_rows)
+
+        Resource.objects.filter(title__startswith=RESOURCE_PREFIX).delete()
+        for category, label in Resource.CATEGORY_CHOICES:
+            for i in range(10):
+                Resource.objects.create(
+                    title=f"{RESOURCE_PREFIX}{label} guide {i}", description=f"About {label.lower()}", category=category,
+                )
+        return user_ids
+
+    def seed_chat_rows(self, user_ids, chat_rows, batch_size=20_000):
+        table = ChatHistory._meta.db_table
+        sql = f"INSERT INTO {table} (user_id, message, sender, timestamp) VALUES (%s, %s, %s, %s)"
+        now = timezone.now()
+        per_user = max(1, chat_rows // len(user_ids))
+        start = time.perf_counter()
+
+        rows = []
+        for n in range(chat_rows):
+            user_id = user_ids[n % len(user_ids)]
+            turn = n // len(user_ids)
+            sender = "user" if turn % 2 == 0 else "bot"
+            rows.append((user_id, f"Bench {sender} message {turn}", sender, now - timedelta(minutes=per_user - turn)))
+            if len(rows) == batch_size or n == chat_rows - 1:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.executemany(sql, rows)
+                rows = []
+        self.stdout.write(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    def drop_seed(self):
+        # One DELETE for the chat rows, instead of cascading from each user
+        ChatHistory.objects.filter(user__phone_number__startswith=PHONE_PREFIX).delete()
+        UserProfile.objects.filter(phone_number__startswith=PHONE_PREFIX).delete()
+        Resource.objects.filter(title__startswith=RESOURCE_PREFIX).delete()
+
+    def compare(self, baseline, results, threshold):
+        slower = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before, after = baseline[name]["per_call_us"], result["per_call_us"]
+            change = (after - before) / before if before else 0.0
+            flag = "  SLOWER" if change > threshold else ""
+            self.stdout.write(f"{name:<28}{before:>10.2f} -> {after:>10.2f} µs ({change:+.1%}){flag}")
+            if flag:
+                slower.append(name)
+
+        if slower:
+            raise CommandError(
+                f"{len(slower)} benchmark(s) slowed down by more than {threshold:.0%}: {', '.join(slower)}"
+            )
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from chatbot import memory, utils
+from chatbot.gateway import WhatsAppGateway, set_gateway
+from chatbot.models import UserProfile
+from chatbot.scratch import scratch_database
+from chatbot.stubs import DeepSeekStub, TwilioStub
+from sicklecare.celery import app
+
+
+PHONE_PREFIX = "+999000"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the sync webhook (thread pool, Celery eager) with the async one "
+        "(one event loop) for free-text messages answered by a stub DeepSeek, against a "
+        "scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--threads", type=int, default=16, help="Request threads for the sync webhook")
+        parser.add_argument("--ai-latency", type=float, default=2.0, help="Stub DeepSeek latency (seconds)")
+        parser.add_argument("--twilio-latency", type=float, default=0.02)
+        parser.add_argument("--mode", choices=["both", "sync", "async"], default="both")
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.bench(options)
+
+    def bench(self, options):
+        total = options["messages"]
+        users = [
+            UserProfile(phone_number=f"{PHONE_PREFIX}{i:05d}", name="Bench", role="patient", registered=True)
+            for i in range(total)
+        ]
+        UserProfile.objects.filter(phone_number__startswith=PHONE_PREFIX).delete()
+        UserProfile.objects.bulk_create(users)
+
+        previous_key = os.environ.get("DEEPSEEK_API_KEY")
+        previous_url = utils.DEEPSEEK_URL
+        previous_eager = app.conf.task_always_eager
+        os.environ["DEEPSEEK_API_KEY"] = "stub"
+        app.conf.CELERY_TASK_ALWAYS_EAGER = True  # settings use the CELERY_ namespace
+
+        try:
+            # The test clients send Host: testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]), \
+                    DeepSeekStub(latency=options["ai_latency"]) as deepseek, \
+                    TwilioStub(latency=options["twilio_latency"]) as twilio:
+                utils.DEEPSEEK_URL = f"{deepseek.url}/v1/chat/completions"
+                set_gateway(WhatsAppGateway(
+                    account_sid="ACstub", auth_token="stub",
+                    from_number="whatsapp:+14155238886", api_base=twilio.url,
+                ))
+
+                modes = ["sync", "async"] if options["mode"] == "both" else [options["mode"]]
+                for mode in modes:
+                    requests = [
+                        {"From": f"whatsapp:{user.phone_number}", "Body": f"{mode} question {i} about hydration"}
+                        for i, user in enumerate(users)
+                    ]
+                    sent_before = twilio.requests
+                    if mode == "sync":
+                        latencies, elapsed = self.run_sync(requests, options["threads"])
+                    else:
+                        latencies, elapsed = asyncio.run(self.run_async(requests))
+                    self.report(mode, latencies, elapsed, twilio.requests - sent_before)
+        finally:
+            utils.DEEPSEEK_URL = previous_url
+            app.conf.CELERY_TASK_ALWAYS_EAGER = previous_eager
+            if previous_key is None:
+                os.environ.pop("DEEPSEEK_API_KEY", None)
+            else:
+                os.environ["DEEPSEEK_API_KEY"] = previous_key
+            set_gateway(None)
+            memory.writer.flush()
+            UserProfile.objects.filter(phone_number__startswith=PHONE_PREFIX).delete()
+
+    def run_sync(self, requests, threads):
+        def post(data):
+            start = time.perf_counter()
+            Client().post("/whatsapp/", data)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(post, requests))
+        # Celery runs eagerly, so each reply was sent before its webhook returned
+        return latencies, time.perf_counter() - start
+
+    async def run_async(self, requests):
+        from chatbot import aio
+
+        client = AsyncClient()
+
+        async def post(data):
+            start = time.perf_counter()
+            await client.post("/whatsapp/async/", data)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(post(data) for data in requests))
+        # Replies are generated in the background after each webhook returns
+        await aio.drain()
+        return latencies, time.perf_counter() - start
+
+    def report(self, mode, latencies, elapsed, replies):
+        self.stdout.write(
+            f"{mode:>5}: {len(latencies)} messages, webhook p50 {percentile(latencies, 0.5) * 1000:.0f}ms "
+            f"p99 {percentile(latencies, 0.99) * 1000:.0f}ms, all {replies} replies delivered in "
+            f"{elapsed:.2f}s ({len(latencies) / elapsed:.1f} msg/s)"
+        )
@@ -0,0 +1,380 @@
+import asyncio
+import contextvars
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+
+from chatbot import hospitals, memory, utils
+from chatbot.gateway import WhatsAppGateway, set_gateway
+from chatbot.models import ProcessedMessage, UserProfile
+from chatbot.scratch import scratch_database
+from chatbot.stubs import DeepSeekStub, PlacesStub, TwilioStub
+from sicklecare.celery import app
+
+
+USER_PREFIX = "+999100"  # seeded, registered users
+NEW_USER_PREFIX = "+999200"  # registration scenarios
+SID_PREFIX = "SMload"
+
+QUESTIONS = [
+    "How much water should I drink each day?",
+    "What foods help with sickle cell anaemia?",
+    "Can I exercise with sickle cell disease?",
+    "Why do I get tired so easily?",
+    "Is it safe to travel by plane?",
+    "What does hydroxyurea do?",
+]
+CRISIS_MESSAGES = [
+    "I'm in severe pain and can't breathe",
+    "My chest hurts badly, this is a crisis",
+    "Nina maumivu makali sana",
+]
+
+# Each scenario is the conversation one user has; messages of a session are
+# sent in order, one after the other
+SCENARIOS = {
+    "registration": lambda rng: ["hi", "Load Test", "patient"],
+    "menu": lambda rng: ["menu", rng.choice(["1", "2", "3"]), "menu"],
+    "free_text": lambda rng: [rng.choice(QUESTIONS)],
+    "crisis": lambda rng: [rng.choice(CRISIS_MESSAGES)],
+    "reminder": lambda rng: ["remind me", "take hydroxyurea", f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"],
+}
+DEFAULT_MIX = "registration=5,menu=40,free_text=35,crisis=5,reminder=15"
+
+# Query tally of the message being handled; copied into sync_to_async
+# threads, eager Celery tasks and tasks spawned by the async webhook
+_tally = contextvars.ContextVar("loadtest_tally", default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    tally = _tally.get()
+    if tally is not None:
+        tally[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _attach(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise CommandError(f"Unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Session:
+    def __init__(self, kind, phone, bodies):
+        self.kind = kind
+        self.phone = phone
+        self.bodies = deque(bodies)
+
+
+class Result:
+    __slots__ = ("kind", "latency", "lag", "ok", "tally")
+
+    def __init__(self, kind, latency, lag, ok, tally):
+        self.kind = kind
+        self.latency = latency
+        self.lag = lag
+        self.ok = ok
+        self.tally = tally
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a mix of webhook conversations (registration, menu, free text, crisis, "
+        "reminders) at a target rate against stub Twilio, DeepSeek and Google Places servers "
+        "and a scratch database, and reports latency percentiles, errors, DB queries and "
+        "outbound calls per message."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500, help="Inbound messages to send")
+        parser.add_argument("--rate", type=float, default=50.0, help="Target inbound messages per second")
+        parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,... (default: %(default)s)")
+        parser.add_argument("--users", type=int, default=200, help="Registered users to seed")
+        parser.add_argument("--threads", type=int, default=32, help="Request threads for the sync webhook")
+        parser.add_argument("--hook", choices=["sync", "async"], default="sync")
+        parser.add_argument("--ai-latency", type=float, default=1.0, help="Stub DeepSeek latency (seconds)")
+        parser.add_argument("--ai-error-rate", type=float, default=0.0)
+        parser.add_argument("--twilio-latency", type=float, default=0.05, help="Stub Twilio latency (seconds)")
+        parser.add_argument("--twilio-error-rate", type=float, default=0.0)
+        parser.add_argument("--maps-latency", type=float, default=0.2, help="Stub Google Places latency (seconds)")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        mix = parse_mix(options["mix"])
+        with scratch_database():
+            self.load_test(options, mix, rng)
+
+    def load_test(self, options, mix, rng):
+        users = [
+            UserProfile(
+                phone_number=f"{USER_PREFIX}{i:05d}", name="Load", role="patient", registered=True,
+                location="Nairobi", emergency_contacts=[f"+2547{i:08d}"],
+            )
+            for i in range(options["users"])
+        ]
+        self.cleanup()
+        UserProfile.objects.bulk_create(users)
+        sessions = self.plan(options["messages"], mix, [user.phone_number for user in users], rng)
+
+        previous_env = {name: os.environ.get(name) for name in ("DEEPSEEK_API_KEY", "GOOGLE_MAPS_KEY")}
+        previous_urls = utils.DEEPSEEK_URL, hospitals.TEXT_SEARCH_URL, hospitals.DETAILS_URL
+        previous_eager = app.conf.task_always_eager
+        os.environ.update(DEEPSEEK_API_KEY="stub", GOOGLE_MAPS_KEY="stub")
+        # There is no worker to hand tasks to: they run inside the webhook
+        app.conf.CELERY_TASK_ALWAYS_EAGER = True  # settings use the CELERY_ namespace
+        connection_created.connect(_attach)
+        for connection in connections.all(initialized_only=True):
+            _attach(None, connection)
+
+        try:
+            # The test clients send Host: testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]), \
+                    DeepSeekStub(latency=options["ai_latency"], error_rate=options["ai_error_rate"]) as deepseek, \
+                    TwilioStub(latency=options["twilio_latency"], error_rate=options["twilio_error_rate"]) as twilio, \
+                    PlacesStub(latency=options["maps_latency"]) as places:
+                utils.DEEPSEEK_URL = f"{deepseek.url}/v1/chat/completions"
+                hospitals.TEXT_SEARCH_URL = f"{places.url}/textsearch/json"
+                hospitals.DETAILS_URL = f"{places.url}/details/json"
+                set_gateway(WhatsAppGateway(
+                    account_sid="ACstub", auth_token="stub",
+                    from_number="whatsapp:+14155238886", api_base=twilio.url,
+                ))
+
+                if options["hook"] == "sync":
+                    results, elapsed = self.run_sync(sessions, options["rate"], options["threads"])
+                    settled = time.perf_counter()
+                else:
+                    results, elapsed, settled = asyncio.run(self.run_async(sessions, options["rate"]))
+                # Background sends still queued on the gateway count too
+                set_gateway(None)
+                settle = time.perf_counter() - settled
+                self.report(results, elapsed, settle, options, twilio, deepseek, places)
+        finally:
+            connection_created.disconnect(_attach)
+            for connection in connections.all(initialized_only=True):
+                if count_queries in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(count_queries)
+            utils.DEEPSEEK_URL, hospitals.TEXT_SEARCH_URL, hospitals.DETAILS_URL = previous_urls
+            app.conf.CELERY_TASK_ALWAYS_EAGER = previous_eager
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            set_gateway(None)
+            memory.writer.flush()
+            self.cleanup()
+
+    def cleanup(self):
+        UserProfile.objects.filter(phone_number__startswith=USER_PREFIX).delete()
+        UserProfile.objects.filter(phone_number__startswith=NEW_USER_PREFIX).delete()
+        ProcessedMessage.objects.filter(message_sid__startswith=SID_PREFIX).delete()
+
+    def plan(self, total, mix, phones, rng):
+        """
+        Sessions adding up to `total` messages. Each seeded user appears in
+        at most one session at a time (sessions are started in order).
+        """
+        names, weights = list(mix), list(mix.values())
+        free = deque(phones)
+        sessions = []
+        planned = 0
+        while planned < total:
+            kind = rng.choices(names, weights)[0]
+            if kind == "registration":
+                phone = f"{NEW_USER_PREFIX}{len(sessions):05d}"
+            else:
+                phone = free[0]
+                free.rotate(-1)
+            bodies = SCENARIOS[kind](rng)[:total - planned]
+            sessions.append(Session(kind, phone, bodies))
+            planned += len(bodies)
+        return sessions
+
+    def payload(self, session):
+        return {
+            "From": f"whatsapp:{session.phone}",
+            "Body": session.bodies.popleft(),
+            "MessageSid": f"{SID_PREFIX}{uuid.uuid4().hex}",
+        }
+
+    def run_sync(self, sessions, rate, threads):
+        waiting = deque(sessions)
+        ready = queue.Queue()
+        in_flight = defaultdict(int)  # phone -> sessions started and not finished
+        lock = threading.Lock()
+        results = []
+        local = threading.local()
+
+        def post(session, scheduled):
+            data = self.payload(session)
+            tally = [0]
+            token = _tally.set(tally)
+            start = time.perf_counter()
+            try:
+                client = getattr(local, "client", None) or Client()
+                local.client = client
+                ok = client.post("/whatsapp/", data).status_code == 200
+            except Exception:
+                ok = False
+            finally:
+                latency = time.perf_counter() - start
+                _tally.reset(token)
+
+            with lock:
+                results.append(Result(session.kind, latency, start - scheduled, ok, tally))
+                if session.bodies:
+                    ready.put(session)
+                else:
+                    in_flight[session.phone] -= 1
+                    ready.put(None)  # wakes the scheduler: the user is free again
+
+        def next_session():
+            while True:
+                try:
+                    session = ready.get_nowait()
+                except queue.Empty:
+                    session = None
+                if session is not None:
+                    return session
+                with lock:
+                    if waiting and not in_flight[waiting[0].phone]:
+                        session = waiting.popleft()
+                        in_flight[session.phone] += 1
+                        return session
+                # Every startable session is waiting on its previous message
+                session = ready.get()
+                if session is not None:
+                    return session
+
+        total = sum(len(session.bodies) for session in sessions)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for i in range(total):
+                scheduled = start + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(post, next_session(), scheduled)
+        # Celery runs eagerly, so replies were sent before each webhook returned
+        return results, time.perf_counter() - start
+
+    async def run_async(self, sessions, rate):
+        from chatbot import aio
+
+        client = AsyncClient()
+        waiting = deque(sessions)
+        ready = asyncio.Queue()
+        in_flight = defaultdict(int)
+        results = []
+        tasks = set()
+
+        async def post(session, scheduled):
+            data = self.payload(session)
+            tally = [0]
+            _tally.set(tally)  # this task's own context
+            start = time.perf_counter()
+            try:
+                ok = (await client.post("/whatsapp/async/", data)).status_code == 200
+            except Exception:
+                ok = False
+            results.append(Result(session.kind, time.perf_counter() - start, start - scheduled, ok, tally))
+            if session.bodies:
+                ready.put_nowait(session)
+            else:
+                in_flight[session.phone] -= 1
+                ready.put_nowait(None)
+
+        async def next_session():
+            while True:
+                session = None if ready.empty() else ready.get_nowait()
+                if session is not None:
+                    return session
+                if waiting and not in_flight[waiting[0].phone]:
+                    session = waiting.popleft()
+                    in_flight[session.phone] += 1
+                    return session
+                session = await ready.get()
+                if session is not None:
+                    return session
+
+        total = sum(len(session.bodies) for session in sessions)
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(post(await next_session(), scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        # Replies are generated in the background after each webhook returns
+        settled = time.perf_counter()
+        await aio.drain()
+        return results, elapsed, settled
+
+    def report(self, results, elapsed, settle, options, twilio, deepseek, places):
+        by_kind = defaultdict(list)
+        for result in results:
+            by_kind[result.kind].append(result)
+        by_kind["all"] = results
+
+        self.stdout.write(
+            f"{'scenario':<13}{'messages':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+            f"{'errors':>8}{'queries':>9}"
+        )
+        for kind, group in by_kind.items():
+            latencies = [r.latency * 1000 for r in group]
+            errors = sum(not r.ok for r in group)
+            queries = sum(r.tally[0] for r in group) / len(group)
+            self.stdout.write(
+                f"{kind:<13}{len(group):>9}{percentile(latencies, 0.5):>9.1f}{percentile(latencies, 0.95):>9.1f}"
+                f"{percentile(latencies, 0.99):>9.1f}{max(latencies):>9.1f}"
+                f"{errors / len(group):>8.1%}{queries:>9.1f}"
+            )
+
+        total = len(results)
+        lag = percentile([r.lag for r in results], 0.99) * 1000
+        self.stdout.write(
+            f"\n{total} messages in {elapsed:.2f}s: {total / elapsed:.1f} msg/s (target {options['rate']:.1f}), "
+            f"p99 start lag {lag:.1f}ms, background work done {settle:.2f}s after the last response"
+        )
+        self.stdout.write(
+            f"Outbound per inbound message: Twilio {twilio.requests / total:.2f} "
+            f"({twilio.errors} injected errors), DeepSeek {deepseek.requests / total:.2f} "
+            f"({deepseek.errors} injected errors), Google Places {places.requests / total:.2f}"
+        )
+        self.stdout.write(
+            "Note: Celery tasks ran eagerly in this process, not on a worker"
+            + ("; sync latencies include the AI calls and sends a worker would make." if options["hook"] == "sync" else ".")
+        )
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot import profiling
+from chatbot.cache import is_shared
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows or changes the fraction of webhook requests and AI/reminder jobs that are "
+        "profiled, for every process sharing the cache."
+    )
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("--rate", type=float, help="Fraction to profile, 0 to 1 (0 turns profiling off)")
+        group.add_argument("--reset", action="store_true", help="Go back to PROFILING_SAMPLE_RATE")
+
+    def handle(self, *args, **options):
+        rate = options["rate"]
+        if (rate is not None or options["reset"]) and not is_shared():
+            raise CommandError(
+                "The running processes cannot see this change without a shared cache "
+                "(set REDIS_CACHE_URL); set PROFILING_SAMPLE_RATE and restart instead"
+            )
+
+        if rate is not None:
+            if not 0 <= rate <= 1:
+                raise CommandError("--rate must be between 0 and 1")
+            profiling.set_sample_rate(rate)
+        elif options["reset"]:
+            profiling.set_sample_rate(None)
+
+        self.stdout.write(f"Sample rate: {profiling.sample_rate():g} (setting: {settings.PROFILING_SAMPLE_RATE:g})")
+        self.stdout.write(f"Profiles:    {settings.PROFILING_DIR}")
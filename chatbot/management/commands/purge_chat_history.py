@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.retention import purge_chat_history
+
+
+class Command(BaseCommand):
+    help = "Deletes chat history older than the retention period, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.CHAT_RETENTION_DAYS)
+        parser.add_argument("--batch-size", type=int, default=settings.CHAT_PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = purge_chat_history(days=options["days"], batch_size=options["batch_size"])
+        self.stdout.write(f"Reclaimed {deleted} chat history rows.")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.tasks import queue_depths
+
+
+class Command(BaseCommand):
+    help = "Shows how many jobs are waiting in each Celery queue."
+
+    def handle(self, *args, **options):
+        for name, depth in queue_depths().items():
+            self.stdout.write(f"{name:<10} {depth}")
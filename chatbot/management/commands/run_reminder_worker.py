@@ -0,0 +1,71 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chatbot.idempotency import purge_processed_messages
+from chatbot.retention import purge_chat_history
+from chatbot.scheduler import WORKER_ID, send_due_reminders
+
+# Housekeeping done by whichever process dispatches reminders (this worker,
+# or the in-process scheduler in scheduler.start_scheduler): job, seconds
+# between runs. Each job also runs when the worker starts.
+HOUSEKEEPING = [
+    (purge_processed_messages, 60 * 60),
+    (purge_chat_history, 24 * 60 * 60),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a standalone reminder dispatcher. Start as many as needed; "
+        "due reminders are leased so each occurrence is sent once. Also purges "
+        "expired webhook records and chat history past the retention period."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, default=settings.REMINDER_POLL_INTERVAL)
+        parser.add_argument("--once", action="store_true", help="Dispatch one round (and housekeeping) and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Reminder worker {WORKER_ID} started.")
+        next_run = [0.0] * len(HOUSEKEEPING)
+
+        if options["once"]:
+            self.dispatch()
+            self.housekeeping(next_run)
+            return
+
+        # A long purge must not hold up reminders, so housekeeping has its own thread
+        threading.Thread(
+            target=self.housekeeping_loop, args=(next_run, options["interval"]),
+            name="housekeeping", daemon=True,
+        ).start()
+        while True:
+            self.dispatch()
+            time.sleep(options["interval"])
+
+    def dispatch(self):
+        try:
+            send_due_reminders()
+        except Exception as e:
+            self.stderr.write(f"Reminder dispatch failed: {e}")
+
+    def housekeeping_loop(self, next_run, interval):
+        while True:
+            self.housekeeping(next_run)
+            close_old_connections()
+            time.sleep(interval)
+
+    def housekeeping(self, next_run):
+        now = time.monotonic()
+        for index, (job, every) in enumerate(HOUSEKEEPING):
+            if now < next_run[index]:
+                continue
+            next_run[index] = now + every
+            try:
+                job()
+            except Exception as e:
+                self.stderr.write(f"{job.__name__} failed: {e}")
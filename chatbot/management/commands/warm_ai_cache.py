@@ -0,0 +1,51 @@
+import os
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot import ai_cache
+from chatbot.faq import FAQ_QUESTIONS
+from chatbot.utils import SYSTEM_PROMPT, call_deepseek
+
+
+class Command(BaseCommand):
+    help = "Pre-warms the AI response cache with answers to the curated FAQ list."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--roles", default="patient,caregiver,donor",
+            help="Comma separated roles to warm answers for",
+        )
+        parser.add_argument("--language", default="English")
+
+    def handle(self, *args, **options):
+        api_key = os.getenv("DEEPSEEK_API_KEY")
+        if not api_key:
+            raise CommandError("DEEPSEEK_API_KEY is not set.")
+
+        roles = [role.strip() for role in options["roles"].split(",") if role.strip()]
+        warmed = 0
+
+        for role in roles:
+            for question in FAQ_QUESTIONS:
+                if ai_cache.get_cached_reply(question, role, options["language"]) is not None:
+                    continue
+
+                messages = [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": question},
+                ]
+                try:
+                    reply = call_deepseek(messages, api_key)
+                except requests.RequestException as e:
+                    self.stderr.write(f"Skipped '{question}' ({role}): {e}")
+                    continue
+
+                ai_cache.cache_reply(question, reply, role, options["language"])
+                warmed += 1
+
+        self.stdout.write(f"Warmed {warmed} answers. Cache stats: {ai_cache.stats()}")
+        if not ai_cache._shared():
+            self.stdout.write(
+                "Note: no shared cache configured (REDIS_CACHE_URL), so only this process was warmed."
+            )
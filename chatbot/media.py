@@ -0,0 +1,90 @@
+"""
+Outbound media for Resources.
+
+Twilio downloads a MediaUrl itself, so it needs an absolute public URL.
+Each Resource file's URL is resolved once and cached under the file name,
+so menu taps do not go back to the storage backend for it.
+
+Images larger than settings.RESOURCE_MEDIA_MAX_BYTES are downscaled and
+re-encoded once, when they are uploaded, so every later send fetches the
+smaller file. Pillow is an optional dependency; without it, and for other
+file types (PDFs), uploads are stored as they are.
+"""
+import os
+from io import BytesIO
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .cache import TTLCache
+from .models import Resource
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+
+_urls = TTLCache(max_entries=5000, ttl=24 * 60 * 60)
+
+
+def media_url(resource):
+    """
+    Absolute URL of the resource's file, or None when it has none.
+    """
+    if not resource.file:
+        return None
+
+    key = (resource.pk, resource.file.name)
+    url = _urls.get(key)
+    if url is None:
+        url = resource.file.url
+        if not urlsplit(url).scheme and settings.PUBLIC_BASE_URL:
+            url = urljoin(f"{settings.PUBLIC_BASE_URL.rstrip('/')}/", url.lstrip("/"))
+        _urls.set(key, url)
+    return url
+
+
+def shrink(upload):
+    """
+    Returns a smaller JPEG of an oversized image upload, or None when the
+    upload is small enough, is not an image, or Pillow is not installed.
+    """
+    limit = settings.RESOURCE_MEDIA_MAX_BYTES
+    if Image is None or upload.size <= limit:
+        return None
+
+    try:
+        upload.seek(0)
+        image = Image.open(upload)
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+    side = settings.RESOURCE_IMAGE_MAX_DIMENSION
+    image.thumbnail((side, side))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    for quality in (85, 70, 55, 40):
+        buffer.seek(0)
+        buffer.truncate()
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= limit:
+            break
+
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    return ContentFile(buffer.getvalue(), name=f"{name}.jpg")
+
+
+@receiver(pre_save, sender=Resource, dispatch_uid="resource_media_shrink")
+def _shrink_upload(sender, instance, **kwargs):
+    # Only a newly uploaded file is uncommitted; stored files are left alone
+    if instance.file and not instance.file._committed:
+        smaller = shrink(instance.file)
+        if smaller is not None:
+            instance.file = smaller
@@ -0,0 +1,255 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from celery.signals import task_postrun, worker_process_shutdown
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from . import metrics
+from .cache import is_shared
+from .models import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    __slots__ = ("sender", "message", "timestamp")
+
+    def __init__(self, sender, message, timestamp):
+        self.sender = sender
+        self.message = message
+        self.timestamp = timestamp
+
+
+class TurnBuffer:
+    """
+    Per-user ring buffer of the most recent chat turns, used to build AI
+    prompts without querying ChatHistory.
+
+    Users are kept in LRU order; the least recently active are dropped when
+    there are more than `max_users` or the buffered text exceeds
+    `max_bytes`. A user is loaded from the database once, on first use.
+
+    Only used with a shared default cache, which holds the per-user version
+    that tells each process about turns written (or a reset) by the others.
+    With the per-process LocMem cache every read goes to ChatHistory.
+    """
+
+    def __init__(self, turns=8, max_users=10000, max_bytes=50 * 1024 * 1024):
+        self.turns = turns
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._users = OrderedDict()
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def recent(self, user_id, limit=None):
+        """
+        Returns up to `limit` most recent turns, oldest first.
+        """
+        if not is_shared():
+            writer.flush()
+            turns = self._load(user_id)
+            return turns[-limit:] if limit else turns
+
+        shared_version = cache.get(_version_key(user_id))
+
+        with self._lock:
+            turns = self._users.get(user_id)
+            if turns is not None and self._versions.get(user_id) == shared_version:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return list(turns)[-limit:] if limit else list(turns)
+            self.misses += 1
+
+        # Another process wrote turns for this user since we loaded them
+        writer.flush()
+        turns = deque(self._load(user_id), maxlen=self.turns)
+
+        with self._lock:
+            self._discard(user_id)
+            self._users[user_id] = turns
+            self._versions[user_id] = shared_version
+            self._bytes += sum(len(t.message) for t in turns)
+            self._shrink()
+            return list(turns)[-limit:] if limit else list(turns)
+
+    def _load(self, user_id):
+        rows = list(
+            ChatHistory.objects
+            .filter(user_id=user_id)
+            .order_by("-timestamp")
+            .values_list("sender", "message", "timestamp")[:self.turns]
+        )
+        return [Turn(*row) for row in rows[::-1]]
+
+    def append(self, user_id, sender, message, timestamp):
+        if not is_shared():
+            return
+
+        version = time.time_ns()
+        cache.set(_version_key(user_id), version, timeout=None)
+
+        with self._lock:
+            turns = self._users.get(user_id)
+            if turns is None:
+                # Not loaded yet; the next read loads it from the database
+                return
+            if len(turns) == turns.maxlen:
+                self._bytes -= len(turns[0].message)
+            turns.append(Turn(sender, message, timestamp))
+            self._bytes += len(message)
+            self._versions[user_id] = version
+            self._users.move_to_end(user_id)
+            self._shrink()
+
+    def forget(self, user_id):
+        # A new version, not a deleted one: a copy loaded before any turn was
+        # recorded has no version either, and would still look current
+        cache.set(_version_key(user_id), time.time_ns(), timeout=None)
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id):
+        turns = self._users.pop(user_id, None)
+        self._versions.pop(user_id, None)
+        if turns is not None:
+            self._bytes -= sum(len(t.message) for t in turns)
+
+    def _shrink(self):
+        while self._users and (len(self._users) > self.max_users or self._bytes > self.max_bytes):
+            user_id, turns = self._users.popitem(last=False)
+            self._versions.pop(user_id, None)
+            self._bytes -= sum(len(t.message) for t in turns)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _version_key(user_id):
+    return f"chat:version:{user_id}"
+
+
+class HistoryWriter:
+    """
+    Write-behind persistence for chat turns: rows are queued in memory and
+    inserted with one bulk_create per flush (every `interval` seconds, or
+    sooner once `batch_size` rows are waiting).
+    """
+
+    def __init__(self, interval=1.0, batch_size=200):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.written = 0
+
+    def add(self, row):
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+
+        try:
+            with metrics.timed("stage.chat_history_write"):
+                ChatHistory.objects.bulk_create(rows)
+        except IntegrityError:
+            # Usually a turn of a user deleted meanwhile; keep the others
+            rows = self._write_each(rows)
+        except Exception:
+            # Put them back, ahead of newer turns, for the next flush
+            with self._lock:
+                self._pending[:0] = rows
+            raise
+        self.written += len(rows)
+
+    def _write_each(self, rows):
+        written = []
+        for row in rows:
+            try:
+                row.save(force_insert=True)
+                written.append(row)
+            except IntegrityError:
+                logger.warning("Dropped a chat turn of user %s that cannot be saved", row.user_id)
+        return written
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Chat history flush failed")
+            finally:
+                close_old_connections()
+
+
+buffer = TurnBuffer(
+    turns=settings.AI_PROMPT_RECENT_TURNS * 2 + settings.AI_SUMMARY_MIN_MESSAGES,
+    max_users=settings.AI_HISTORY_BUFFER_USERS,
+    max_bytes=settings.AI_HISTORY_BUFFER_MAX_BYTES,
+)
+writer = HistoryWriter(interval=settings.AI_HISTORY_FLUSH_INTERVAL)
+atexit.register(writer.flush)
+
+
+@task_postrun.connect(dispatch_uid="chat_history_flush_after_task")
+@worker_process_shutdown.connect(dispatch_uid="chat_history_flush_on_shutdown")
+def _flush_in_worker(**kwargs):
+    # Prefork children can be killed without running atexit handlers, so
+    # turns recorded by a task are written before the task is acknowledged
+    try:
+        writer.flush()
+    except Exception:
+        logger.exception("Chat history flush failed")
+
+
+def record_turn(user, sender, message):
+    timestamp = timezone.now()
+    writer.add(ChatHistory(user_id=user.pk, sender=sender, message=message, timestamp=timestamp))
+    buffer.append(user.pk, sender, message, timestamp)
+
+
+def recent_turns(user, limit=None):
+    return buffer.recent(user.pk, limit)
+
+
+def forget_user(user):
+    buffer.forget(user.pk)
+
+metrics.gauge("chat_history_pending_rows", writer.pending)
@@ -0,0 +1,249 @@
+"""
+In-process metrics: durations (as histograms), counters and gauges, served
+in the Prometheus text format by views.metrics_endpoint and, in Celery
+workers, by serve() (see the worker hooks in tasks.py).
+
+Each process keeps its own numbers; Prometheus scrapes every process and
+aggregates. Every series carries a pid label so the processes' series stay
+apart. Web server workers (gunicorn, uvicorn --workers) share one port, so
+a scrape of /metrics sees whichever worker took the request: each worker's
+series is then sampled at random intervals, which is fine for rate() and
+histogram_quantile() over a few minutes but not for single scrapes. Run
+one worker per port (or per container) where exact numbers matter.
+
+Per-stage webhook timings are recorded as "stage.<name>" and per-handler
+ones as "handler.<name>", which become labels of one metric.
+"""
+import ipaddress
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Observations that are not durations: name -> (bucket bounds, unit)
+HISTOGRAMS = {
+    "ai_prompt_tokens": ((100, 200, 300, 400, 600, 800, 1000, 1500, 2000), "tokens"),
+}
+
+# Name prefixes rendered as one metric with a label
+LABELLED = ("stage", "handler")
+
+PREFIX = "sicklecare"
+
+
+class Timing:
+    """
+    Running count / sum / min / max of an observed value, plus bucket counts.
+    """
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        index = bisect_left(self.bounds, value)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "min": round(self.min or 0.0, 4),
+            "max": round(self.max or 0.0, 4),
+        }
+
+
+_timings = {}
+_counters = {}
+_gauges = {}
+_lock = threading.Lock()
+
+
+def observe(name, value):
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            bounds = HISTOGRAMS.get(name, (BUCKETS,))[0]
+            timing = _timings[name] = Timing(bounds)
+        timing.observe(value)
+
+
+@contextmanager
+def timed(name):
+    """
+    Records how long the block took under `name`, e.g. timed("stage.ai_call").
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def gauge(name, fn, label=None):
+    """
+    Registers a gauge read when metrics are scraped. `fn` returns a number,
+    or {label value: number} when `label` is given.
+    """
+    _gauges[name] = (fn, label)
+
+
+def snapshot():
+    with _lock:
+        data = {name: timing.as_dict() for name, timing in _timings.items()}
+        data.update({name: {"count": count} for name, count in _counters.items()})
+        return data
+
+
+_invalid = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _metric_name(name):
+    return f"{PREFIX}_{_invalid.sub('_', name)}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    pid = f'pid="{os.getpid()}"'
+    with _lock:
+        timings = {
+            name: (timing.bounds, list(timing.buckets), timing.count, timing.total)
+            for name, timing in _timings.items()
+        }
+        counts = dict(_counters)
+
+    families = {}
+    for name, data in sorted(timings.items()):
+        family, _, label_value = name.partition(".")
+        if family in LABELLED and label_value:
+            labels = f'{pid},{family}="{_escape(label_value)}"'
+        else:
+            family, labels = name, pid
+        unit = HISTOGRAMS.get(name, (None, "seconds"))[1]
+        if not family.endswith(f"_{unit}"):
+            family = f"{family}_{unit}"
+        families.setdefault(_metric_name(family), []).append((labels, data))
+
+    lines = []
+    for metric, series in families.items():
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, (bounds, buckets, count, total) in series:
+            cumulative = 0
+            for bound, bucket in zip(bounds, buckets):
+                cumulative += bucket
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{labels}}} {_number(total)}")
+            lines.append(f"{metric}_count{{{labels}}} {count}")
+
+    for name, count in sorted(counts.items()):
+        metric = _metric_name(f"{name}_total")
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{{{pid}}} {count}")
+
+    for name, (fn, label) in sorted(_gauges.items()):
+        metric = _metric_name(name)
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines.append(f"# TYPE {metric} gauge")
+        if label:
+            for key, number in sorted(value.items()):
+                lines.append(f'{metric}{{{pid},{label}="{_escape(key)}"}} {_number(number)}')
+        else:
+            lines.append(f"{metric}{{{pid}}} {_number(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _Exporter(BaseHTTPRequestHandler):
+    token = ""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        if self.token and self.headers.get("Authorization") != f"Bearer {self.token}":
+            self.send_error(401)
+            return
+
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(port, host="127.0.0.1", token=""):
+    """
+    Serves GET /metrics for this process on `port` from a daemon thread,
+    for processes without a web server (Celery workers). Returns the
+    server, or None when the port is taken. Addresses other than loopback
+    ("" is every interface) are refused without a token.
+    """
+    if not token and not is_loopback(host):
+        logger.error("Not serving metrics on %s:%s without a token (set METRICS_TOKEN)", host or "*", port)
+        return None
+
+    handler = type("Exporter", (_Exporter,), {"token": token})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.warning("Cannot serve metrics on port %s: %s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:15
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_next_fire_at(apps, schema_editor):
+    Reminder = apps.get_model('chatbot', 'Reminder')
+    tz = timezone.get_current_timezone()
+    now = timezone.now()
+    today = timezone.localtime(now, tz).date()
+
+    reminders = list(Reminder.objects.filter(active=True))
+    for reminder in reminders:
+        if reminder.date and not reminder.recurring:
+            occurrence = timezone.make_aware(datetime.combine(reminder.date, reminder.time), tz)
+            reminder.next_fire_at = occurrence if occurrence > now else None
+            continue
+
+        start_date = max(reminder.date, today) if reminder.date else today
+        occurrence = timezone.make_aware(datetime.combine(start_date, reminder.time), tz)
+        if occurrence <= now:
+            occurrence = timezone.make_aware(
+                datetime.combine(start_date + timedelta(days=1), reminder.time), tz
+            )
+        reminder.next_fire_at = occurrence
+
+    Reminder.objects.bulk_update(reminders, ['next_fire_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_alter_userprofile_emergency_contacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminder',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reminder',
+            index=models.Index(fields=['active', 'next_fire_at'], name='reminder_due_idx'),
+        ),
+        migrations.RunPython(populate_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_reminder_next_fire_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminder',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='reminder',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
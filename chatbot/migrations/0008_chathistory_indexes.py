@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_reminder_lease'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user', 'timestamp'], name='chat_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['timestamp'], name='chat_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0008_chathistory_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='conversation_summary',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='summary_through',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_userprofile_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chathistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
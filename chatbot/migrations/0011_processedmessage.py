@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0010_chathistory_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_sid', models.CharField(max_length=64, unique=True)),
+                ('response', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chatbot_resource_fts USING fts5(
+        title, description, category, content='chatbot_resource', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_resource_fts_ai AFTER INSERT ON chatbot_resource BEGIN
+        INSERT INTO chatbot_resource_fts(rowid, title, description, category)
+        VALUES (new.id, new.title, coalesce(new.description, ''), new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_resource_fts_ad AFTER DELETE ON chatbot_resource BEGIN
+        INSERT INTO chatbot_resource_fts(chatbot_resource_fts, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, coalesce(old.description, ''), old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_resource_fts_au AFTER UPDATE ON chatbot_resource BEGIN
+        INSERT INTO chatbot_resource_fts(chatbot_resource_fts, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, coalesce(old.description, ''), old.category);
+        INSERT INTO chatbot_resource_fts(rowid, title, description, category)
+        VALUES (new.id, new.title, coalesce(new.description, ''), new.category);
+    END
+    """,
+    "INSERT INTO chatbot_resource_fts(chatbot_resource_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chatbot_resource_fts_au",
+    "DROP TRIGGER IF EXISTS chatbot_resource_fts_ad",
+    "DROP TRIGGER IF EXISTS chatbot_resource_fts_ai",
+    "DROP TABLE IF EXISTS chatbot_resource_fts",
+]
+
+# Must match chatbot.resources.SEARCH_VECTOR
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX IF NOT EXISTS resource_search_idx ON chatbot_resource USING GIN (
+        to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '')
+        || ' ' || coalesce(category, ''))
+    )
+    """,
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS resource_search_idx",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0011_processedmessage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='resource',
+            index=models.Index(fields=['language', 'category'], name='resource_lang_cat_idx'),
+        ),
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+
 from django.db import models
 from django.utils import timezone
 
@@ -18,6 +20,9 @@ class UserProfile(models.Model):
     last_interaction = models.DateTimeField(auto_now=True)
     pending_action = models.CharField(max_length=50, null=True, blank=True)
     temp_reminder_text = models.TextField(null=True, blank=True)
+    # Rolling summary of older turns, kept up to date by a background task
+    conversation_summary = models.TextField(null=True, blank=True)
+    summary_through = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.phone_number or self.name
@@ -26,7 +31,16 @@ class ChatHistory(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="chats")
     message = models.TextField()
     sender = models.CharField(max_length=10, choices=[("user", "User"), ("bot", "Bot")])
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the turn happens, not when a write-behind batch is flushed
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Latest-messages-per-user lookups for the AI prompt
+            models.Index(fields=["user", "timestamp"], name="chat_user_ts_idx"),
+            # Retention purge
+            models.Index(fields=["timestamp"], name="chat_ts_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.phone_number} ({self.sender})"
@@ -51,6 +65,12 @@ class Resource(models.Model):
     language = models.CharField(max_length=20, default="English")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Per-language catalog loads (full-text search is set up in migration 0012)
+            models.Index(fields=["language", "category"], name="resource_lang_cat_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -64,6 +84,86 @@ class Reminder(models.Model):
     recurring = models.BooleanField(default=False)  
     created_at = models.DateTimeField(auto_now_add=True)
     active = models.BooleanField(default=True)
+    # Next time this reminder is due (UTC); NULL once it will never fire again
+    next_fire_at = models.DateTimeField(null=True, blank=True)
+    # Set while a dispatcher worker holds this reminder; expired leases can be reclaimed
+    lease_owner = models.CharField(max_length=64, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["active", "next_fire_at"], name="reminder_due_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.phone_number} at {self.time} - {self.message}"
+
+    def compute_next_fire(self, after):
+        """
+        Returns the first occurrence strictly after `after`, or None.
+        Reminder times are wall-clock times in the project time zone.
+        """
+        if not self.active:
+            return None
+
+        tz = timezone.get_current_timezone()
+        reminder_time = self.time
+        if isinstance(reminder_time, str):
+            reminder_time = datetime.strptime(reminder_time[:5], "%H:%M").time()
+
+        if self.date and not self.recurring:
+            occurrence = timezone.make_aware(datetime.combine(self.date, reminder_time), tz)
+            return occurrence if occurrence > after else None
+
+        today = timezone.localtime(after, tz).date()
+        start_date = max(self.date, today) if self.date else today
+        occurrence = timezone.make_aware(datetime.combine(start_date, reminder_time), tz)
+        if occurrence <= after:
+            occurrence = timezone.make_aware(
+                datetime.combine(start_date + timedelta(days=1), reminder_time), tz
+            )
+        return occurrence
+
+    # Fields next_fire_at is computed from
+    SCHEDULE_FIELDS = ("time", "date", "recurring", "active")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_schedule = instance._schedule()
+        return instance
+
+    def _schedule(self):
+        # Deferred fields read as None rather than being loaded
+        return tuple(self.__dict__.get(name) for name in self.SCHEDULE_FIELDS)
+
+    def save(self, *args, **kwargs):
+        schedule = self._schedule()
+        rescheduled = schedule != getattr(self, "_loaded_schedule", schedule)
+
+        if not self.active:
+            self.next_fire_at = None
+        elif self.next_fire_at is None or rescheduled:
+            self.next_fire_at = self.compute_next_fire(timezone.now())
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and set(update_fields) & set(self.SCHEDULE_FIELDS):
+            kwargs["update_fields"] = {*update_fields, "next_fire_at"}
+
+        super().save(*args, **kwargs)
+        self._loaded_schedule = schedule
+
+
+class ProcessedMessage(models.Model):
+    """
+    Inbound messages already handled, by Twilio MessageSid, with the TwiML
+    that was returned, so webhook retries are answered without re-running
+    the conversation. Rows older than settings.IDEMPOTENCY_TTL are purged.
+    """
+    message_sid = models.CharField(max_length=64, unique=True)
+    # Empty while the first delivery is still being handled
+    response = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.message_sid
@@ -0,0 +1,160 @@
+import copy
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import TTLCache, is_shared
+from .models import UserProfile
+
+
+# Profiles are cached as plain column values and rebuilt per request, so
+# handlers never share (and mutate) one instance between threads
+_cache = TTLCache(
+    max_entries=getattr(settings, "PROFILE_CACHE_MAX_ENTRIES", 10000),
+    ttl=getattr(settings, "PROFILE_CACHE_TTL", 15 * 60),
+)
+_fields = [field.attname for field in UserProfile._meta.concrete_fields]
+
+
+def _shared():
+    alias = getattr(settings, "PROFILE_CACHE_SHARED_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def _version_key(phone_number):
+    return f"profile:version:{phone_number}"
+
+
+def _data_key(phone_number):
+    return f"profile:{phone_number}"
+
+
+def _values(profile):
+    return tuple(getattr(profile, name) for name in _fields)
+
+
+def _build(values):
+    return UserProfile.from_db("default", _fields, copy.deepcopy(values))
+
+
+def get_profile(phone_number):
+    """
+    Returns the profile for `phone_number`, creating it on first contact.
+
+    Each save bumps a version stored in the Django cache; a cached copy is
+    used only while its version is still current, so a profile changed by
+    another process is reloaded. With a shared cache configured, profiles
+    loaded by one process are reused by the others.
+
+    The versions only mean something in a cache every process shares, so
+    with the per-process LocMem cache profiles are always read from the
+    database.
+    """
+    if not is_shared():
+        profile, _ = UserProfile.objects.get_or_create(phone_number=phone_number)
+        return profile
+
+    version = cache.get(_version_key(phone_number))
+
+    entry = _cache.get(phone_number)
+    if entry is not None and version is not None and entry[0] == version:
+        return _build(entry[1])
+
+    shared = _shared()
+    if shared is not None and version is not None:
+        entry = shared.get(_data_key(phone_number))
+        if entry is not None and entry[0] == version:
+            _cache.set(phone_number, entry)
+            return _build(entry[1])
+
+    profile, _ = UserProfile.objects.get_or_create(phone_number=phone_number)
+    if version is None:
+        # First load since the version expired; start a new one
+        version = time.time_ns()
+        cache.set(_version_key(phone_number), version, timeout=None)
+    _store(phone_number, version, _values(profile))
+    return profile
+
+
+async def aget_profile(phone_number):
+    """
+    Async version of get_profile for the ASGI webhook.
+    """
+    if not is_shared():
+        profile, _ = await UserProfile.objects.aget_or_create(phone_number=phone_number)
+        return profile
+
+    version = await cache.aget(_version_key(phone_number))
+
+    entry = _cache.get(phone_number)
+    if entry is not None and version is not None and entry[0] == version:
+        return _build(entry[1])
+
+    shared = _shared()
+    if shared is not None and version is not None:
+        entry = await shared.aget(_data_key(phone_number))
+        if entry is not None and entry[0] == version:
+            _cache.set(phone_number, entry)
+            return _build(entry[1])
+
+    profile, _ = await UserProfile.objects.aget_or_create(phone_number=phone_number)
+    if version is None:
+        version = time.time_ns()
+        await cache.aset(_version_key(phone_number), version, timeout=None)
+    _cache.set(phone_number, (version, _values(profile)))
+    if shared is not None:
+        await shared.aset(_data_key(phone_number), (version, _values(profile)), timeout=_cache.ttl)
+    return profile
+
+
+def _store(phone_number, version, values):
+    _cache.set(phone_number, (version, values))
+    shared = _shared()
+    if shared is not None:
+        shared.set(_data_key(phone_number), (version, values), timeout=_cache.ttl)
+
+
+def invalidate(phone_number):
+    cache.delete(_version_key(phone_number))
+    _cache.delete(phone_number)
+    shared = _shared()
+    if shared is not None:
+        shared.delete(_data_key(phone_number))
+
+
+def stats():
+    return _cache.stats()
+
+
+@receiver(post_save, sender=UserProfile, dispatch_uid="profile_cache_write_through")
+def _profile_saved(sender, instance, update_fields=None, **kwargs):
+    if not is_shared():
+        return
+
+    phone_number = instance.phone_number
+    values = _values(instance)
+
+    if update_fields is not None:
+        # Columns outside update_fields may be stale on this instance; take
+        # them from the cached copy, or drop the entry if that is not current
+        entry = _cache.get(phone_number)
+        if entry is None or entry[0] != cache.get(_version_key(phone_number)):
+            invalidate(phone_number)
+            return
+        written = {sender._meta.get_field(name).attname for name in update_fields}
+        values = tuple(
+            new if name in written else old
+            for name, old, new in zip(_fields, entry[1], values)
+        )
+
+    version = time.time_ns()
+    cache.set(_version_key(phone_number), version, timeout=None)
+    _store(phone_number, version, values)
+
+
+@receiver(post_delete, sender=UserProfile, dispatch_uid="profile_cache_delete")
+def _profile_deleted(sender, instance, **kwargs):
+    invalidate(instance.phone_number)
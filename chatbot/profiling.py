@@ -0,0 +1,192 @@
+"""
+On-demand sampling profiler for the webhook and background jobs.
+
+A fraction of executions wrapped with @profiled (settings.PROFILING_SAMPLE_RATE,
+or the runtime override set by `manage.py profiling`, which needs a shared
+cache such as REDIS_CACHE_URL to reach the other processes) are sampled: a
+background thread reads the executing thread's stack every
+settings.PROFILING_INTERVAL seconds. When the execution ends, its stacks
+are written in collapsed format ("frame;frame;frame count" per line, as
+read by flamegraph.pl and speedscope) to settings.PROFILING_DIR, which
+keeps only the newest settings.PROFILING_MAX_FILES files.
+
+When the rate is 0 a wrapped call costs a cached float comparison; no
+thread is started until the first sampled execution.
+"""
+import functools
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .cache import is_shared
+
+logger = logging.getLogger(__name__)
+
+RATE_KEY = "profiling:sample_rate"
+
+# How long the runtime override is trusted before the cache is read again
+REFRESH_INTERVAL = 10.0  # seconds
+
+_rate = None
+_rate_checked = 0.0
+
+_recordings = {}  # thread id -> Recording
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_sampler = None
+_sequence = itertools.count()
+
+
+def sample_rate():
+    """
+    The current sampling rate: the runtime override if one is set (and the
+    cache is shared), otherwise settings.PROFILING_SAMPLE_RATE.
+    """
+    global _rate, _rate_checked
+
+    now = time.monotonic()
+    if _rate is None or now - _rate_checked > REFRESH_INTERVAL:
+        override = cache.get(RATE_KEY) if is_shared() else None
+        _rate = settings.PROFILING_SAMPLE_RATE if override is None else override
+        _rate_checked = now
+    return _rate
+
+
+def set_sample_rate(rate):
+    """
+    Overrides the sampling rate for every process sharing the cache (None
+    goes back to the setting). Processes pick it up within REFRESH_INTERVAL.
+    Raises ValueError when the cache is not shared.
+    """
+    global _rate
+
+    if not is_shared():
+        raise ValueError("The sample rate can only be overridden through a shared cache")
+    if rate is None:
+        cache.delete(RATE_KEY)
+    else:
+        cache.set(RATE_KEY, rate, timeout=None)
+    _rate = None
+
+
+class Recording:
+    def __init__(self, label, thread_id):
+        self.label = label
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.started = time.time()
+
+
+def _frame_name(code):
+    path = code.co_filename
+    parent, name = os.path.split(path)
+    return f"{os.path.basename(parent)}/{name}:{code.co_name}"
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample():
+    while True:
+        with _lock:
+            recordings = list(_recordings.values())
+        if not recordings:
+            _wakeup.wait()
+            _wakeup.clear()
+            continue
+
+        frames = sys._current_frames()
+        for recording in recordings:
+            frame = frames.get(recording.thread_id)
+            if frame is not None:
+                recording.stacks[_collapse(frame)] += 1
+        del frames
+        time.sleep(settings.PROFILING_INTERVAL)
+
+
+def _start_sampler():
+    global _sampler
+
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample, name="profiling-sampler", daemon=True)
+            _sampler.start()
+
+
+def _write(recording, elapsed):
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(recording.started))
+    name = f"{recording.label}-{stamp}-{os.getpid()}-{next(_sequence)}-{elapsed * 1000:.0f}ms.collapsed"
+    with open(os.path.join(directory, name), "w") as f:
+        for stack, count in recording.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    # Rotate: keep the newest files only
+    files = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".collapsed")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in files[:max(len(files) - settings.PROFILING_MAX_FILES, 0)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def profiled(label):
+    """
+    Decorator: samples a fraction of calls to the function, writing each
+    sampled call's stacks to a file named after `label`.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            rate = sample_rate()
+            if not rate or random.random() >= rate:
+                return fn(*args, **kwargs)
+
+            thread_id = threading.get_ident()
+            recording = Recording(label, thread_id)
+            with _lock:
+                if thread_id in _recordings:
+                    # Already inside a sampled call (e.g. an eager Celery task)
+                    recording = None
+                else:
+                    _recordings[thread_id] = recording
+            if recording is None:
+                return fn(*args, **kwargs)
+
+            _start_sampler()
+            _wakeup.set()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with _lock:
+                    del _recordings[thread_id]
+                # Nothing to write if it finished before the first sample
+                if recording.stacks:
+                    metrics.incr("profiling.recordings")
+                    try:
+                        _write(recording, elapsed)
+                    except OSError:
+                        logger.exception("Could not write profile for %s", label)
+        return wrapper
+    return decorator
@@ -1,7 +1,195 @@
+"""
+Resource catalog lookups.
+
+Resources change rarely (through the admin) and are read on menu taps, so
+each process keeps a snapshot of the catalog per language: the rows plus
+a small inverted index over title, description and category. A version
+number in the Django cache is bumped whenever a Resource is saved or
+deleted; a snapshot older than the current version is rebuilt on next use.
+The version only reaches other processes through a shared cache
+(REDIS_CACHE_URL), and skips QuerySet.update(), so snapshots are also
+rebuilt once they are settings.RESOURCE_SNAPSHOT_TTL seconds old.
+
+Languages with more than settings.RESOURCE_SNAPSHOT_MAX_ROWS resources are
+not snapshotted; their searches use the database full-text index instead
+(FTS5 on SQLite, a tsvector GIN index on Postgres; see migration 0012).
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
 from .models import Resource
 
+
+VERSION_KEY = "resources:version"
+
+# Expression indexed by the Postgres GIN index (must match migration 0012)
+SEARCH_VECTOR = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '') "
+    "|| ' ' || coalesce(category, ''))"
+)
+
+_words = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _words.findall((text or "").lower())
+
+
+class Snapshot:
+    __slots__ = ("version", "built", "resources", "index", "vocabulary")
+
+    def __init__(self, version, resources):
+        self.version = version
+        self.built = time.monotonic()
+        self.resources = resources
+        self.index = {}
+        for position, resource in enumerate(resources):
+            for field in (resource.title, resource.description, resource.category):
+                for word in tokenize(field):
+                    self.index.setdefault(word, set()).add(position)
+        self.vocabulary = sorted(self.index)
+
+    def by_category(self, keyword):
+        keyword = keyword.lower()
+        return [r for r in self.resources if keyword in r.category.lower()]
+
+    def search(self, query, limit):
+        """
+        Resources containing every word of `query` (as a prefix, like an
+        FTS "word*" query), those matching in the title first.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        matches = None
+        for word in words:
+            positions = set()
+            for indexed in self._prefixed(word):
+                positions |= self.index[indexed]
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return []
+
+        def rank(position):
+            title = self.resources[position].title.lower()
+            return (-sum(word in title for word in words), position)
+
+        return [self.resources[position] for position in sorted(matches, key=rank)[:limit]]
+
+    def _prefixed(self, word):
+        # The vocabulary is sorted, so prefixed words are contiguous
+        start = bisect_left(self.vocabulary, word)
+        for indexed in self.vocabulary[start:]:
+            if not indexed.startswith(word):
+                break
+            yield indexed
+
+
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(VERSION_KEY, version, timeout=None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def snapshot(language="English"):
+    """
+    Returns the current Snapshot for `language`, or None when the language
+    has too many resources to keep in memory.
+    """
+    version = _current_version()
+    current = _snapshots.get(language)
+    if (
+        current is not None
+        and current.version == version
+        and time.monotonic() - current.built < settings.RESOURCE_SNAPSHOT_TTL
+    ):
+        return current
+
+    limit = settings.RESOURCE_SNAPSHOT_MAX_ROWS
+    resources = list(Resource.objects.filter(language=language).order_by("id")[:limit + 1])
+    if len(resources) > limit:
+        current = None
+    else:
+        current = Snapshot(version, resources)
+
+    with _lock:
+        if current is None:
+            _snapshots.pop(language, None)
+        else:
+            _snapshots[language] = current
+    return current
+
+
 def get_resources_by_keyword(keyword, language="English"):
-    return Resource.objects.filter(
-        category__icontains=keyword.lower(),
-        language=language
-    )
\ No newline at end of file
+    """
+    Resources whose category contains `keyword`, as a list.
+    """
+    current = snapshot(language)
+    if current is not None:
+        return current.by_category(keyword)
+    return list(Resource.objects.filter(category__icontains=keyword.lower(), language=language))
+
+
+def search_resources(query, language="English", limit=10):
+    """
+    Full-text search over title, description and category.
+    """
+    current = snapshot(language)
+    if current is not None:
+        return current.search(query, limit)
+    return search_database(query, language, limit)
+
+
+def search_database(query, language="English", limit=10):
+    """
+    Full-text search using the database index, ranked by relevance.
+    """
+    words = tokenize(query)
+    if not words:
+        return []
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                "SELECT r.id FROM chatbot_resource_fts f JOIN chatbot_resource r ON r.id = f.rowid "
+                "WHERE chatbot_resource_fts MATCH %s AND r.language = %s "
+                "ORDER BY bm25(chatbot_resource_fts, 10.0, 1.0, 5.0) LIMIT %s",
+                [" ".join(f'"{word}"*' for word in words), language, limit],
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                f"SELECT id FROM chatbot_resource WHERE {SEARCH_VECTOR} @@ to_tsquery('simple', %s) "
+                f"AND language = %s ORDER BY ts_rank({SEARCH_VECTOR}, to_tsquery('simple', %s)) DESC LIMIT %s",
+                [" & ".join(f"{word}:*" for word in words), language,
+                 " & ".join(f"{word}:*" for word in words), limit],
+            )
+        else:
+            return list(
+                Resource.objects.filter(language=language, title__icontains=query.strip())[:limit]
+            )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    found = Resource.objects.in_bulk(ids)
+    return [found[i] for i in ids if i in found]
+
+
+@receiver(post_save, sender=Resource, dispatch_uid="resource_snapshot_save")
+@receiver(post_delete, sender=Resource, dispatch_uid="resource_snapshot_delete")
+def _catalog_changed(sender, **kwargs):
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
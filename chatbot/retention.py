@@ -0,0 +1,68 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import memory, profiles
+from .models import ChatHistory, UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+def clear_chat_history(user):
+    """
+    Forgets the conversation: deletes all of a user's chat history and
+    their rolling summary. ChatHistory has no dependent rows or delete
+    signals, so Django issues a single DELETE without loading the rows.
+    Returns the number of rows removed.
+    """
+    # Turns still waiting for write-behind must not reappear after the reset
+    memory.writer.flush()
+    memory.forget_user(user)
+
+    deleted, _ = ChatHistory.objects.filter(user_id=user.pk).delete()
+
+    UserProfile.objects.filter(pk=user.pk).update(conversation_summary=None, summary_through=None)
+    user.conversation_summary = user.summary_through = None
+    # update() skips post_save, so drop the cached profile by hand
+    profiles.invalidate(user.phone_number)
+    return deleted
+
+
+def purge_chat_history(days=None, batch_size=None, pause=None):
+    """
+    Deletes chat messages older than the retention period in small batches,
+    so the table is never locked for long and normal writes can interleave.
+    Returns the number of rows reclaimed.
+    """
+    days = settings.CHAT_RETENTION_DAYS if days is None else days
+    batch_size = batch_size or settings.CHAT_PURGE_BATCH_SIZE
+    pause = settings.CHAT_PURGE_PAUSE if pause is None else pause
+
+    if not days:
+        return 0
+
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+
+    while True:
+        ids = list(
+            ChatHistory.objects
+            .filter(timestamp__lt=cutoff)
+            .order_by("timestamp")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+
+        count, _ = ChatHistory.objects.filter(id__in=ids).delete()
+        deleted += count
+
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    logger.info("Chat history purge: reclaimed %d rows older than %d days", deleted, days)
+    return deleted
@@ -1,32 +1,182 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import wait
+
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
 from django.utils import timezone
+from . import metrics
 from .models import Reminder
-from .utils import send_whatsapp_message
+from .gateway import PRIORITY_REMINDER, get_gateway
+from .idempotency import purge_processed_messages
+from .profiling import profiled
+from .retention import purge_chat_history
 
+logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
-def send_due_reminders():
-    now = datetime.now().strftime("%H:%M")
+# Identifies this process when it holds reminder leases
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"[:64]
+
+# Columns needed to send a reminder and work out its next occurrence
+REMINDER_FIELDS = (
+    "id", "message", "time", "date", "recurring", "active", "next_fire_at", "user__phone_number",
+)
+
+
+def claim_due_reminders(now, owner=WORKER_ID, batch_size=None, lease_seconds=None):
+    """
+    Leases up to `batch_size` due reminders to `owner` and returns them.
+
+    On databases with SKIP LOCKED (Postgres) the candidate rows are locked
+    with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers pick
+    disjoint batches without waiting on each other. SQLite has no row locks
+    but serialises writes, so there the lease is taken with a conditional
+    UPDATE that only succeeds for rows nobody else holds.
+    A lease that has expired (its worker died) can be claimed again.
+    """
+    batch_size = batch_size or getattr(settings, "REMINDER_BATCH_SIZE", 1000)
+    lease_seconds = lease_seconds or getattr(settings, "REMINDER_LEASE_SECONDS", 120)
+
+    # Leases run on wall-clock time, `now` only decides what is due
+    claimed_at = timezone.now()
+    expires_at = claimed_at + timedelta(seconds=lease_seconds)
 
-    # Fetch reminders matching the time and already created
-    reminders = Reminder.objects.filter(
-        time=now,
-        recurring=True,
-        created_at__lte=timezone.now()
+    unleased = Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=claimed_at)
+    due = (
+        Reminder.objects
+        .filter(active=True, next_fire_at__lte=now)
+        .filter(unleased)
+        .order_by("next_fire_at")
     )
 
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list("id", flat=True)[:batch_size])
+            Reminder.objects.filter(id__in=ids).update(lease_owner=owner, lease_expires_at=expires_at)
+    else:
+        ids = list(due.values_list("id", flat=True)[:batch_size])
+        Reminder.objects.filter(id__in=ids).filter(unleased).update(
+            lease_owner=owner, lease_expires_at=expires_at
+        )
+
+    # One query for the whole batch, with the recipient joined in
+    return list(
+        Reminder.objects
+        .filter(id__in=ids, lease_owner=owner, lease_expires_at=expires_at)
+        .select_related("user")
+        .only(*REMINDER_FIELDS)
+    )
+
+
+def complete_reminders(reminders, now, owner=WORKER_ID):
+    """
+    Moves fired reminders on to their next occurrence and releases the
+    lease. Rows whose lease was lost in the meantime are left alone.
+    Reminders sharing the same next occurrence are updated together.
+    """
+    groups = defaultdict(list)
     for reminder in reminders:
-        try:
-            message = f"⏰ Reminder: {reminder.message}"
-            send_whatsapp_message(reminder.user.phone_number, message)
-            print(f"Reminder sent to {reminder.user.phone_number}: {reminder.message}")
-        except Exception as e:
-            print(f"Failed to send reminder to {reminder.user.phone_number}: {e}")
+        if reminder.recurring:
+            groups[(True, reminder.compute_next_fire(now))].append(reminder.id)
+        else:
+            groups[(False, None)].append(reminder.id)
+
+    completed = 0
+    for (active, next_fire_at), ids in groups.items():
+        completed += Reminder.objects.filter(id__in=ids, lease_owner=owner).update(
+            active=active,
+            next_fire_at=next_fire_at,
+            lease_owner=None,
+            lease_expires_at=None,
+        )
+
+    if completed < len(reminders):
+        logger.warning("Lost the lease on %d reminders before completing them", len(reminders) - completed)
+    return completed
+
+
+@profiled("send_due_reminders")
+def send_due_reminders(now=None, owner=WORKER_ID):
+    """
+    Sends every reminder whose next_fire_at has passed, including any that
+    were missed while the process was down, then moves each one on to its
+    next occurrence. One-off reminders are deactivated after firing.
+
+    Safe to run from any number of processes at once: each batch is leased
+    to one worker, so every occurrence is sent by exactly one of them.
+    Batches are pipelined: the next batch is claimed while the previous one
+    is still being sent by the gateway. Returns a summary of the run.
+    """
+    started = time.monotonic()
+    now = now or timezone.now()
+    max_lateness = timedelta(seconds=getattr(settings, "REMINDER_MAX_LATENESS", 12 * 60 * 60))
+    gateway = get_gateway()
+    summary = {"sent": 0, "failed": 0, "skipped": 0, "batches": 0}
+
+    def submit(reminders):
+        futures = []
+        for reminder in reminders:
+            # Occurrences missed by more than the allowed lateness are skipped, not sent late
+            if now - reminder.next_fire_at > max_lateness:
+                summary["skipped"] += 1
+                continue
+            futures.append(gateway.submit(
+                reminder.user.phone_number,
+                f"⏰ Reminder: {reminder.message}",
+                priority=PRIORITY_REMINDER,
+            ))
+        return futures
+
+    def finish(reminders, futures):
+        wait(futures)
+        for future in futures:
+            if future.exception() is None:
+                summary["sent"] += 1
+            else:
+                summary["failed"] += 1
+        complete_reminders(reminders, now, owner)
+
+    in_flight = None
+    while True:
+        reminders = claim_due_reminders(now, owner)
+        if reminders:
+            summary["batches"] += 1
+            futures = submit(reminders)
+
+        if in_flight:
+            finish(*in_flight)
+            in_flight = None
+
+        if not reminders:
+            break
+        in_flight = (reminders, futures)
+
+    summary["duration"] = round(time.monotonic() - started, 3)
+    metrics.observe("reminder_run", summary["duration"])
+    if summary["batches"]:
+        logger.info(
+            "Reminders: %d sent, %d failed, %d skipped in %.2fs",
+            summary["sent"], summary["failed"], summary["skipped"], summary["duration"],
+        )
+    return summary
 
 
 def start_scheduler():
-    scheduler.add_job(send_due_reminders, 'cron', minute='*')  # runs every minute
+    scheduler.add_job(
+        send_due_reminders, 'cron', minute='*',  # runs every minute
+        max_instances=1, coalesce=True,
+    )
+    # The housekeeping run_reminder_worker does when it dispatches instead
+    scheduler.add_job(purge_chat_history, 'cron', hour=3, minute=17, max_instances=1, coalesce=True)
+    scheduler.add_job(purge_processed_messages, 'cron', minute=41, max_instances=1, coalesce=True)
     scheduler.start()
-    print("Reminder scheduler started.")
+    logger.info("Reminder scheduler started.")
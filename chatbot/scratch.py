@@ -0,0 +1,35 @@
+"""
+A throwaway database for the load tests and benchmarks, so seeding users
+and chat rows never touches the real one.
+"""
+import contextlib
+import os
+
+from django.db import connection
+
+
+@contextlib.contextmanager
+def scratch_database(keep=False):
+    """
+    Creates and migrates the test database of the default alias (what
+    `manage.py test` uses: DATABASES["default"]["TEST"]["NAME"], else
+    test_<NAME>; SQLite gets <NAME>_scratch.sqlite3 instead of an in-memory
+    database, so every thread sees it), points the default connection at it
+    and destroys it afterwards. With `keep` it is left behind, and reused
+    as it is by the next run.
+    """
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict["TEST"]
+    old_test_name = test_settings["NAME"]
+    if connection.vendor == "sqlite" and not old_test_name:
+        root, ext = os.path.splitext(str(old_name))
+        test_settings["NAME"] = f"{root}_scratch{ext or '.sqlite3'}"
+
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keep)
+        try:
+            yield connection.settings_dict["NAME"]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
+    finally:
+        test_settings["NAME"] = old_test_name
@@ -0,0 +1,195 @@
+"""
+Local stand-ins for the external HTTP APIs the bot talks to, so outbound
+throughput and end-to-end latency can be measured offline.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class StubServer:
+    """
+    Runs a ThreadingHTTPServer on a background thread. Subclasses provide the
+    request handler class.
+    """
+
+    handler_class = None
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        handler = type("Handler", (self.handler_class,), {"stub": self})
+        self.httpd = _Server((host, port), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def should_fail(self):
+        """
+        Counts the request, sleeps for the configured latency and decides
+        whether this request should return an error.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        failed = self.error_rate and random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+        return failed
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TwilioHandler(QuietHandler):
+
+    def do_POST(self):
+        form = parse_qs(self.read_body().decode())
+
+        if not self.path.endswith("/Messages.json"):
+            self.send_json(404, {"message": "Not found"})
+            return
+
+        if self.stub.should_fail():
+            self.send_json(500, {"code": 20500, "message": "Stub error"})
+            return
+
+        self.send_json(201, {
+            "sid": f"SM{uuid.uuid4().hex}",
+            "to": form.get("To", [""])[0],
+            "from": form.get("From", [""])[0],
+            "body": form.get("Body", [""])[0],
+            "status": "queued",
+        })
+
+
+class TwilioStub(StubServer):
+    """
+    Imitates POST /2010-04-01/Accounts/<sid>/Messages.json.
+    """
+    handler_class = TwilioHandler
+
+
+class DeepSeekHandler(QuietHandler):
+
+    def do_POST(self):
+        try:
+            payload = json.loads(self.read_body() or b"{}")
+        except ValueError:
+            payload = {}
+
+        if self.stub.should_fail():
+            self.send_json(500, {"error": {"message": "Stub error"}})
+            return
+
+        reply = self.stub.reply
+
+        if not payload.get("stream"):
+            self.send_json(200, {"choices": [{"message": {"role": "assistant", "content": reply}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = reply.split(" ")
+        for index, word in enumerate(words):
+            delta = word if index == len(words) - 1 else word + " "
+            chunk = {"choices": [{"delta": {"content": delta}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class DeepSeekStub(StubServer):
+    """
+    Imitates the chat completions endpoint, streaming (SSE) or not. Every
+    request is answered with `reply` after the configured latency.
+    """
+    handler_class = DeepSeekHandler
+
+    reply = (
+        "Drink plenty of water through the day and keep warm. "
+        "If the pain gets worse or you have a fever, go to the nearest hospital."
+    )
+
+
+class PlacesHandler(QuietHandler):
+
+    def do_GET(self):
+        if self.stub.should_fail():
+            self.send_json(500, {"status": "UNKNOWN_ERROR", "results": []})
+            return
+
+        if self.path.startswith("/textsearch/"):
+            self.send_json(200, {"status": "OK", "results": self.stub.results})
+        elif self.path.startswith("/details/"):
+            self.send_json(200, {"status": "OK", "result": {"formatted_phone_number": "+254 20 000 0000"}})
+        else:
+            self.send_json(404, {"status": "NOT_FOUND"})
+
+
+class PlacesStub(StubServer):
+    """
+    Imitates the Google Places text search (GET /textsearch/json) and Place
+    Details (GET /details/json) endpoints.
+    """
+    handler_class = PlacesHandler
+
+    results = [
+        {
+            "name": f"Stub Hospital {n}",
+            "formatted_address": f"{n} Hospital Road, Nairobi",
+            "geometry": {"location": {"lat": -1.28 - n / 100, "lng": 36.82}},
+            "place_id": f"stub-{n}",
+        }
+        for n in range(1, 4)
+    ]
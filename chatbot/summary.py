@@ -0,0 +1,69 @@
+import os
+
+from django.conf import settings
+from django.db.models import Exists
+
+from . import profiles
+from .models import ChatHistory, UserProfile
+from .utils import call_deepseek
+
+
+SUMMARY_PROMPT = (
+    "You maintain a short memory of a WhatsApp conversation between a sickle cell "
+    "support assistant and a user. Update the existing summary with the new messages. "
+    "Keep lasting facts (who the user cares for, ages, symptoms, medication, location, "
+    "preferences, open questions) and drop small talk. "
+    "Reply with the updated summary only, in plain text, under 120 words."
+)
+
+
+def update_conversation_summary(user_id):
+    """
+    Folds messages that have dropped out of the prompt's recent window into
+    the user's rolling summary. Does nothing until enough of them have
+    accumulated, so most AI turns cost no summarisation call.
+    Returns True when the summary was updated.
+    """
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    user = UserProfile.objects.filter(pk=user_id).only("id", "phone_number", "conversation_summary", "summary_through").first()
+    if not api_key or not user:
+        return False
+
+    recent = settings.AI_PROMPT_RECENT_TURNS * 2
+
+    chats = ChatHistory.objects.filter(user_id=user.pk)
+    if user.summary_through:
+        chats = chats.filter(timestamp__gt=user.summary_through)
+    # Newest first; everything past the recent window is due for summarising
+    pending = list(chats.order_by("-timestamp").values_list("sender", "message", "timestamp")[:200])[recent:]
+
+    if len(pending) < settings.AI_SUMMARY_MIN_MESSAGES:
+        return False
+    pending.reverse()
+
+    transcript = "\n".join(
+        f"{'User' if sender == 'user' else 'Assistant'}: {message}"
+        for sender, message, _ in pending
+    )
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {
+            "role": "user",
+            "content": f"Existing summary:\n{user.conversation_summary or '(none)'}\n\nNew messages:\n{transcript}",
+        },
+    ]
+
+    summary = call_deepseek(messages, api_key)
+
+    # Not written if the chat was reset (or summarised by another run) meanwhile
+    updated = UserProfile.objects.filter(
+        Exists(ChatHistory.objects.filter(user_id=user.pk, timestamp=pending[-1][2])),
+        pk=user.pk,
+        summary_through=user.summary_through,
+    ).update(
+        conversation_summary=summary,
+        summary_through=pending[-1][2],
+    )
+    # update() skips post_save, so drop the cached profile by hand
+    profiles.invalidate(user.phone_number)
+    return bool(updated)
@@ -1,42 +1,221 @@
-from django.utils import timezone
-from datetime import datetime
-
-from .utils import send_whatsapp_message
-from .models import Reminder
-
-def handle_reminder_flow(user, incoming_msg, msg):
-
-    if not user.pending_action:
-        user.pending_action = "ask_reminder_text"
-        user.save()
-        msg.body("📌 Sure! What should I remind you about?")
-        return True
-
-    elif user.pending_action == "ask_reminder_text":
-        user.temp_reminder_text = incoming_msg
-        user.pending_action = "ask_reminder_time"
-        user.save()
-        msg.body("⏰ Great! What time? (24hr format HH:MM)")
-        return True
-
-    elif user.pending_action == "ask_reminder_time":
-        try:
-            datetime.strptime(incoming_msg, "%H:%M")
-            Reminder.objects.create(
-                user=user,
-                message=user.temp_reminder_text,
-                time=incoming_msg,
-                recurring=True
-            )
-            msg.body(f"✅ Daily reminder set for *{incoming_msg}*")
-        except ValueError:
-            msg.body("❌ Invalid time format. Use HH:MM (24hr)")
-
-        user.pending_action = None
-        user.temp_reminder_text = None
-        user.save()
-        return True
-
-    return False
-
-        
\ No newline at end of file
+import logging
+
+import requests
+from billiard.process import current_process
+from celery import shared_task
+from celery.signals import worker_process_init, worker_ready
+from django.conf import settings
+from django.db import OperationalError
+from kombu.exceptions import OperationalError as BrokerError
+
+from sicklecare.celery import app
+from . import bursts, metrics
+from .gateway import GatewayError, get_gateway
+from .profiling import profiled
+from .summary import update_conversation_summary
+from .utils import get_ai_response, handle_crisis, stream_ai_response
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# --- Background jobs ---
+# Queues are declared in settings.CELERY_TASK_ROUTES; run a worker per queue
+# (e.g. `celery -A sicklecare worker -Q crisis,outbound,ai,default`).
+
+TASK_QUEUES = ["crisis", "ai", "outbound", "default"]
+
+
+@shared_task(
+    autoretry_for=(GatewayError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def send_message_async(to, body):
+    get_gateway().send(to, body)
+
+
+@shared_task(
+    autoretry_for=(GatewayError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def send_media_async(to, media_url, caption=None):
+    get_gateway().send(to, caption or "", media_url=media_url)
+
+
+@shared_task(
+    autoretry_for=(GatewayError,),
+    retry_backoff=True,
+    retry_backoff_max=60,
+    max_retries=8,
+)
+def send_alert_async(to, body):
+    # Crisis sends that failed in dispatch_crisis, retried on the crisis queue
+    get_gateway().send(to, body)
+
+
+@shared_task
+def send_media_batch_async(to, media):
+    """
+    Sends [media_url, caption] pairs to one recipient concurrently. Failed
+    sends are retried one by one through send_media_async.
+    """
+    results = get_gateway().send_many([(to, caption or "", media_url) for media_url, caption in media])
+    for (media_url, caption), (_, _, error) in zip(media, results):
+        if error:
+            enqueue(send_media_async, to, media_url, caption)
+
+
+def segment_sender():
+    """
+    Returns a send(to, body) for streamed reply segments. Segments go out
+    straight away; the first one Twilio refuses, and every one after it
+    (so they stay in order), is handed to send_message_async to retry.
+    """
+    failed = False
+
+    def send(to, body):
+        nonlocal failed
+        if not failed:
+            try:
+                get_gateway().send(to, body)
+                return
+            except GatewayError as e:
+                logger.warning("Sending a reply segment to %s failed, queueing the rest: %s", to, e)
+                failed = True
+        enqueue(send_message_async, to, body)
+    return send
+
+
+@shared_task(
+    autoretry_for=(OperationalError,),
+    retry_backoff=True,
+    max_retries=3,
+)
+@profiled("handle_ai_async")
+def handle_ai_async(user_id, text):
+    user = UserProfile.objects.filter(pk=user_id).first()
+    if not user:
+        return
+
+    if settings.AI_STREAMING:
+        # Segments go out in order as they are generated
+        stream_ai_response(user, text, segment_sender())
+    else:
+        reply = get_ai_response(user, text)
+
+        # Sending is its own job so a Twilio hiccup retries the send, not the AI call
+        send_message_async.delay(user.phone_number, reply)
+
+    # Fold older turns into the rolling summary, off the reply path
+    update_summary_async.delay(user.id)
+
+
+@shared_task
+def flush_ai_burst(user_id, seq):
+    # Only the flush for the user's latest message gets the burst
+    text = bursts.take(user_id, seq)
+    # take() hands the burst out once, so answer it in its own (retried) job
+    if text and not enqueue(handle_ai_async, user_id, text):
+        handle_ai_async(user_id, text)
+
+
+@shared_task(
+    autoretry_for=(requests.RequestException, OperationalError),
+    retry_backoff=True,
+    max_retries=3,
+)
+def update_summary_async(user_id):
+    update_conversation_summary(user_id)
+
+
+@shared_task(
+    autoretry_for=(requests.RequestException, OperationalError),
+    retry_backoff=True,
+    max_retries=2,
+)
+def handle_crisis_async(user_id, message):
+    user = UserProfile.objects.filter(pk=user_id).first()
+    if not user:
+        return
+
+    handle_crisis(user, message)
+
+
+def enqueue(task, *args, countdown=None):
+    """
+    Queues `task` and returns True, or logs and returns False when the
+    broker cannot be reached, so the webhook can still answer the user.
+    """
+    try:
+        task.apply_async(args, countdown=countdown)
+    except BrokerError:
+        logger.exception("Could not queue %s", task.name)
+        return False
+    return True
+
+
+def queue_depths():
+    """
+    Returns {queue name: messages waiting} for every task queue.
+    Queues are empty by definition when tasks run eagerly.
+    """
+    if app.conf.task_always_eager:
+        return {name: 0 for name in TASK_QUEUES}
+
+    depths = {}
+    with app.connection_for_read() as connection:
+        for name in TASK_QUEUES:
+            try:
+                with connection.channel() as channel:
+                    depths[name] = channel.queue_declare(queue=name, passive=True).message_count
+            except Exception:
+                depths[name] = 0
+    return depths
+
+
+def active_tasks():
+    """
+    Returns {worker name: tasks it is running} for every Celery worker that
+    answers within half a second. Empty when tasks run eagerly.
+    """
+    if app.conf.task_always_eager:
+        return {}
+
+    replies = app.control.inspect(timeout=0.5).active() or {}
+    return {worker: len(tasks) for worker, tasks in replies.items()}
+
+
+def _scrape(fn):
+    # One quick connection attempt, so a scrape never waits on broker retries
+    def read():
+        if not app.conf.task_always_eager:
+            with app.connection_for_read() as connection:
+                connection.ensure_connection(max_retries=0)
+        return fn()
+    return read
+
+
+metrics.gauge("celery_queue_depth", _scrape(queue_depths), label="queue")
+metrics.gauge("celery_worker_active_tasks", _scrape(active_tasks), label="worker")
+
+
+# Tasks record their own stage timings (AI calls, sends, lookups), so with
+# METRICS_WORKER_PORT set every worker process serves them on
+# METRICS_WORKER_HOST: the main process on METRICS_WORKER_PORT (it runs the
+# tasks with the solo and threads pools), prefork child N on
+# METRICS_WORKER_PORT + 1 + N. Give each worker on a host its own base port.
+
+@worker_ready.connect(dispatch_uid="metrics_exporter_worker")
+def _serve_worker_metrics(**kwargs):
+    if settings.METRICS_WORKER_PORT:
+        metrics.serve(settings.METRICS_WORKER_PORT, host=settings.METRICS_WORKER_HOST, token=settings.METRICS_TOKEN)
+
+
+@worker_process_init.connect(dispatch_uid="metrics_exporter_child")
+def _serve_child_metrics(**kwargs):
+    index = getattr(current_process(), "index", None)
+    if settings.METRICS_WORKER_PORT and index is not None:
+        metrics.serve(
+            settings.METRICS_WORKER_PORT + 1 + index, host=settings.METRICS_WORKER_HOST, token=settings.METRICS_TOKEN,
+        )
@@ -1,3 +1,1282 @@
-from django.test import TestCase
+import asyncio
+import datetime as dt
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
-# Create your tests here.
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from kombu.exceptions import OperationalError as BrokerError
+
+from . import ai_cache, aio, bursts, crisis, detector, handler, hospitals, idempotency, media, memory, metrics, profiles, profiling, resources, scheduler, tasks, twiml, utils
+from .cache import SingleFlight, TTLCache
+from .gateway import PRIORITY_CRISIS, GatewayError, WhatsAppGateway
+from .handler import detect_crisis
+from .crisis_corpus import LABELLED_MESSAGES
+from .dispatch import Context, resolve
+from .models import ChatHistory, ProcessedMessage, Reminder, Resource, UserProfile
+from .profiles import get_profile
+from .retention import clear_chat_history, purge_chat_history
+from .summary import update_conversation_summary
+from .utils import SegmentBuffer, send_whatsapp_message
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+
+def fake_response(status_code=201, json=None, text=""):
+    response = mock.Mock(status_code=status_code, text=text)
+    if isinstance(json, Exception):
+        response.json.side_effect = json
+    else:
+        response.json.return_value = json
+    return response
+
+
+class GatewayTests(SimpleTestCase):
+    def gateway(self, *responses):
+        gateway = WhatsAppGateway("AC123", "token", "+14155238886")
+        gateway.session = mock.Mock()
+        gateway.session.post.side_effect = list(responses)
+        return gateway
+
+    def test_send_returns_sids(self):
+        gateway = self.gateway(fake_response(json={"sid": "SM1"}))
+        self.assertEqual(gateway.send("+254700000001", "hello"), ["SM1"])
+
+    def test_long_message_is_split(self):
+        gateway = self.gateway(fake_response(json={"sid": "SM1"}), fake_response(json={"sid": "SM2"}))
+        self.assertEqual(gateway.send("+254700000001", "x" * 2000), ["SM1", "SM2"])
+
+    def test_http_error_raises_gateway_error(self):
+        gateway = self.gateway(fake_response(status_code=500, text="boom"))
+        with self.assertRaises(GatewayError):
+            gateway.send("+254700000001", "hello")
+
+    def test_non_json_success_raises_gateway_error(self):
+        gateway = self.gateway(fake_response(json=ValueError("no JSON"), text="<html>proxy</html>"))
+        with self.assertRaisesMessage(GatewayError, "proxy"):
+            gateway.send("+254700000001", "hello")
+
+    def test_send_whatsapp_message_logs_bad_response(self):
+        gateway = self.gateway(fake_response(json=ValueError("no JSON"), text="<html>"))
+        with mock.patch("chatbot.utils.get_gateway", return_value=gateway), \
+                self.assertLogs("chatbot.utils", "ERROR"):
+            send_whatsapp_message("+254700000001", "hello")
+
+
+def make_user(phone_number="+254700000001", **fields):
+    fields = {"name": "Ann", "role": "patient", "registered": True, **fields}
+    return UserProfile.objects.create(phone_number=phone_number, **fields)
+
+
+def post_message(client, body, sender="+254700000001", message_sid=None, path="/whatsapp/"):
+    data = {"Body": body, "From": f"whatsapp:{sender}"}
+    if message_sid:
+        data["MessageSid"] = message_sid
+    return client.post(path, data)
+
+
+class AIErrorTests(SimpleTestCase):
+    @mock.patch.dict("os.environ", {"DEEPSEEK_API_KEY": "key"})
+    @mock.patch("chatbot.utils.ai_cache.get_cached_reply", return_value=None)
+    @mock.patch("chatbot.utils.build_prompt", side_effect=OperationalError("database is locked"))
+    def test_database_errors_reach_the_task_retry(self, build_prompt, cached):
+        user = UserProfile(pk=1, phone_number="+254700000001", role="patient")
+        with self.assertRaises(OperationalError):
+            utils.get_ai_response(user, "What helps with pain?")
+
+
+@mock.patch("celery.app.task.Task.apply_async", side_effect=BrokerError("Connection refused"))
+class BrokerDownTests(TestCase):
+    def test_free_text_gets_an_apology(self, apply_async):
+        make_user()
+        with self.assertLogs("chatbot.tasks", "ERROR"):
+            response = post_message(self.client, "What foods help?")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(twiml.text(handler.AI_BUSY), response.content.decode())
+
+    def test_crisis_is_handled_in_the_webhook(self, apply_async):
+        make_user(location="Nairobi", emergency_contacts=["+254711111111"])
+        with mock.patch("chatbot.handler.handle_crisis") as handle_crisis, \
+                self.assertLogs("chatbot.tasks", "ERROR"):
+            response = post_message(self.client, "I'm in severe pain")
+        self.assertEqual(response.status_code, 200)
+        handle_crisis.assert_called_once()
+
+
+class TTLCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache(ttl=60)
+        cache.set("a", 1)
+        with mock.patch("chatbot.cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("a"))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        with ThreadPoolExecutor(4) as pool:
+            first = pool.submit(flight.do, "key", slow)
+            started.wait(5)
+            others = [pool.submit(flight.do, "key", slow) for _ in range(3)]
+            while flight.shared < 3:
+                time.sleep(0.001)
+            release.set()
+            results = [first.result()] + [f.result() for f in others]
+
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+
+
+class AICacheTests(SimpleTestCase):
+    def setUp(self):
+        ai_cache.clear()
+
+    def test_rephrased_question_hits(self):
+        ai_cache.cache_reply("What is sickle cell disease?", "An inherited blood disorder.", "patient")
+        self.assertEqual(
+            ai_cache.get_cached_reply("hi, what is sickle cell disease", "patient"),
+            "An inherited blood disorder.",
+        )
+
+    def test_answers_are_kept_per_role_and_language(self):
+        ai_cache.cache_reply("What is sickle cell disease?", "An inherited blood disorder.", "patient")
+        self.assertIsNone(ai_cache.get_cached_reply("What is sickle cell disease?", "donor"))
+        self.assertIsNone(ai_cache.get_cached_reply("What is sickle cell disease?", "patient", "Swahili"))
+
+    def test_follow_up_questions_are_not_cached(self):
+        ai_cache.cache_reply("Is it safe for him?", "Yes.", "patient")
+        self.assertIsNone(ai_cache.get_cached_reply("Is it safe for him?", "patient"))
+        self.assertTrue(ai_cache.is_context_dependent("why?"))
+        self.assertTrue(ai_cache.is_context_dependent("and what about water"))
+
+
+class FakePlaces:
+    """
+    Stands in for the Google Places session: three hospitals per search,
+    each with a phone number from Place Details. Searches wait for
+    `release`; details take `details_delay` seconds.
+    """
+
+    def __init__(self, details_delay=0.0):
+        self.details_delay = details_delay
+        self.searches = []
+        self.searching = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def get(self, url, params, timeout):
+        if url == hospitals.TEXT_SEARCH_URL:
+            self.searches.append(params["query"])
+            self.searching.set()
+            self.release.wait(5)
+            return fake_response(json={"results": [
+                {"name": f"Hospital {n}", "geometry": {"location": {}}, "place_id": str(n)} for n in range(3)
+            ]})
+        time.sleep(self.details_delay)
+        return fake_response(json={"result": {"formatted_phone_number": f"+254 20 {params['place_id']}"}})
+
+
+class HospitalLookupTests(SimpleTestCase):
+    def setUp(self):
+        hospitals._cache.clear()
+        self.addCleanup(hospitals._cache.clear)
+        self.places = FakePlaces()
+        patcher = mock.patch.object(hospitals, "_session", self.places)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_spellings_of_a_place_share_one_lookup(self):
+        found = hospitals.get_nearby_hospitals("Nairobi, Kenya")
+        self.assertEqual(hospitals.get_nearby_hospitals("set location  nairobi kenya!"), found)
+        self.assertEqual(len(self.places.searches), 1)
+        self.assertEqual([h["phone"] for h in found], ["+254 20 0", "+254 20 1", "+254 20 2"])
+
+    def test_concurrent_lookups_share_one_search(self):
+        self.places.release.clear()
+        shared = hospitals._flight.shared
+        with ThreadPoolExecutor(4) as pool:
+            first = pool.submit(hospitals.get_nearby_hospitals, "Kisumu")
+            self.places.searching.wait(5)
+            others = [pool.submit(hospitals.get_nearby_hospitals, "kisumu") for _ in range(3)]
+            while hospitals._flight.shared < shared + 3:
+                time.sleep(0.001)
+            self.places.release.set()
+            results = [first.result()] + [f.result() for f in others]
+
+        self.assertEqual(len(self.places.searches), 1)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    @override_settings(HOSPITAL_LOOKUP_DEADLINE=0.1)
+    def test_late_details_are_left_out_and_cached_briefly(self):
+        self.places.details_delay = 0.5
+        start = time.monotonic()
+        found = hospitals.get_nearby_hospitals("Mombasa")
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual([h["phone"] for h in found], [None, None, None])
+
+        later = time.monotonic() + hospitals.PARTIAL_RESULT_TTL + 1
+        with mock.patch("chatbot.cache.time.monotonic", return_value=later):
+            self.assertNotIn("mombasa", hospitals._cache)
+
+    def test_complete_results_are_kept(self):
+        hospitals.get_nearby_hospitals("Mombasa")
+        later = time.monotonic() + hospitals.PARTIAL_RESULT_TTL + 1
+        with mock.patch("chatbot.cache.time.monotonic", return_value=later):
+            self.assertIn("mombasa", hospitals._cache)
+
+
+class SegmentBufferTests(SimpleTestCase):
+    def feed_all(self, buffer, text, step=7):
+        segments = []
+        for i in range(0, len(text), step):
+            segments.extend(buffer.feed(text[i:i + step]))
+        return segments, buffer.close()
+
+    def test_first_sentence_is_released_early(self):
+        buffer = SegmentBuffer(first_min=20)
+        self.assertEqual(buffer.feed("Stay well hydrated today."), [])
+        self.assertEqual(buffer.feed(" Drink"), ["Stay well hydrated today."])
+        self.assertEqual(buffer.close(), ["Drink"])
+
+    def test_short_first_sentence_waits_for_more(self):
+        buffer = SegmentBuffer(first_min=40)
+        self.assertEqual(buffer.feed("Yes. "), [])
+        self.assertEqual(buffer.close(), ["Yes."])
+
+    def test_rest_is_grouped_under_the_limit(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(100))
+        early, rest = self.feed_all(SegmentBuffer(first_min=10, max_len=200), text)
+        segments = early + rest
+
+        self.assertEqual(segments[0], "Sentence number 0 is here.")
+        self.assertTrue(all(len(segment) <= 200 for segment in segments))
+        self.assertEqual(" ".join(segments), text)
+        # Grouped into as few messages as fit, not one per sentence
+        self.assertLess(len(segments), 20)
+
+    def test_text_without_boundaries_is_cut_at_spaces(self):
+        text = "word " * 100
+        early, rest = self.feed_all(SegmentBuffer(max_len=50), text)
+        segments = early + rest
+        self.assertTrue(all(len(segment) <= 50 for segment in segments))
+        self.assertEqual(" ".join(segments), text.strip())
+
+
+@mock.patch.dict("os.environ", {"DEEPSEEK_API_KEY": "key"})
+class AIReplySharingTests(TestCase):
+    def setUp(self):
+        ai_cache.clear()
+        self.addCleanup(ai_cache.clear)
+        self.addCleanup(memory.writer.flush)
+        self.parent = make_user(conversation_summary="User's son Tom is 7")
+        self.other = make_user("+254700000002")
+
+    def test_replies_drawing_on_the_summary_stay_with_the_user(self):
+        with mock.patch("chatbot.utils.call_deepseek", side_effect=["For Tom (7): leafy greens.", "Leafy greens."]):
+            utils.get_ai_response(self.parent, "What foods help with sickle cell?")
+            reply = utils.get_ai_response(self.other, "what foods help with sickle cell")
+        self.assertEqual(reply, "Leafy greens.")
+
+    def test_streamed_replies_drawing_on_history_stay_with_the_user(self):
+        chat(self.other, "user", "My daughter is 4")
+        with mock.patch("chatbot.utils.stream_deepseek", return_value=iter(["For your 4 year old: leafy greens."])):
+            utils.stream_ai_response(self.other, "What foods help with sickle cell?", send=mock.Mock())
+        self.assertIsNone(ai_cache.get_cached_reply("What foods help with sickle cell?", "patient"))
+
+    def test_context_free_replies_are_shared(self):
+        self.parent.conversation_summary = None
+        with mock.patch("chatbot.utils.call_deepseek", return_value="Leafy greens.") as call_deepseek:
+            utils.get_ai_response(self.parent, "What foods help with sickle cell?")
+            reply = utils.get_ai_response(self.other, "what foods help with sickle cell")
+        self.assertEqual(reply, "Leafy greens.")
+        call_deepseek.assert_called_once()
+
+
+class StreamAIResponseTests(SimpleTestCase):
+    @mock.patch.dict("os.environ", {"DEEPSEEK_API_KEY": "key"})
+    @mock.patch("chatbot.utils.ai_cache.get_cached_reply", return_value=None)
+    @mock.patch("chatbot.utils.ai_cache.cache_reply")
+    @mock.patch("chatbot.utils.build_prompt", return_value=[])
+    @mock.patch("chatbot.utils.memory.record_turn")
+    def test_segments_are_sent_in_order(self, record_turn, build_prompt, cache_reply, cached):
+        deltas = ["Drink plenty of water ", "throughout every single day. ", "Keep warm ", "and rest."]
+        user = UserProfile(pk=1, phone_number="+254700000001", role="patient")
+        sent = []
+
+        with mock.patch("chatbot.utils.stream_deepseek", return_value=iter(deltas)):
+            reply = utils.stream_ai_response(user, "How do I avoid a crisis?", lambda to, body: sent.append(body))
+
+        self.assertEqual(sent, ["Drink plenty of water throughout every single day.", "Keep warm and rest."])
+        self.assertEqual(reply, "".join(deltas).strip())
+        self.assertEqual([c.args[1] for c in record_turn.call_args_list], ["user", "bot"])
+
+
+class SegmentSenderTests(SimpleTestCase):
+    @mock.patch("chatbot.tasks.enqueue", return_value=True)
+    @mock.patch("chatbot.tasks.get_gateway")
+    def test_segments_after_a_failed_send_are_retried_in_order(self, get_gateway, enqueue):
+        get_gateway.return_value.send.side_effect = [None, GatewayError("HTTP 503")]
+        send = tasks.segment_sender()
+        with self.assertLogs("chatbot.tasks", "WARNING"):
+            for body in ("one", "two", "three"):
+                send("+254700000001", body)
+
+        self.assertEqual(get_gateway.return_value.send.call_count, 2)
+        self.assertEqual(enqueue.call_args_list, [
+            mock.call(tasks.send_message_async, "+254700000001", "two"),
+            mock.call(tasks.send_message_async, "+254700000001", "three"),
+        ])
+
+
+class ReminderScheduleTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+
+    def local_time(self, reminder):
+        return timezone.localtime(reminder.next_fire_at).time()
+
+    def test_next_fire_at_is_set_on_create(self):
+        reminder = Reminder.objects.create(user=self.user, message="Meds", time=dt.time(8, 30), recurring=True)
+        self.assertEqual(self.local_time(reminder), dt.time(8, 30))
+        self.assertGreater(reminder.next_fire_at, timezone.now())
+
+    def test_changing_the_time_reschedules(self):
+        reminder = Reminder.objects.create(user=self.user, message="Meds", time=dt.time(8, 30), recurring=True)
+        reminder = Reminder.objects.get(pk=reminder.pk)
+        reminder.time = dt.time(21, 15)
+        reminder.save(update_fields=["time"])
+
+        reminder.refresh_from_db()
+        self.assertEqual(self.local_time(reminder), dt.time(21, 15))
+
+    def test_moving_a_one_off_reminder_reschedules(self):
+        tomorrow = timezone.localdate() + dt.timedelta(days=1)
+        reminder = Reminder.objects.create(user=self.user, message="Clinic", time=dt.time(9, 0), date=tomorrow)
+        reminder = Reminder.objects.get(pk=reminder.pk)
+        reminder.date = tomorrow + dt.timedelta(days=6)
+        reminder.save()
+        self.assertEqual(timezone.localtime(reminder.next_fire_at).date(), reminder.date)
+
+    def test_reactivating_reschedules(self):
+        reminder = Reminder.objects.create(user=self.user, message="Meds", time=dt.time(8, 30), recurring=True)
+        reminder.active = False
+        reminder.save()
+        self.assertIsNone(reminder.next_fire_at)
+
+        reminder = Reminder.objects.get(pk=reminder.pk)
+        reminder.active = True
+        reminder.save()
+        self.assertEqual(self.local_time(reminder), dt.time(8, 30))
+
+    def test_unrelated_edit_keeps_the_due_time(self):
+        reminder = Reminder.objects.create(user=self.user, message="Meds", time=dt.time(8, 30), recurring=True)
+        overdue = timezone.now() - dt.timedelta(minutes=1)
+        Reminder.objects.filter(pk=reminder.pk).update(next_fire_at=overdue)
+
+        reminder = Reminder.objects.get(pk=reminder.pk)
+        reminder.message = "Take meds"
+        reminder.save()
+        self.assertEqual(reminder.next_fire_at, overdue)
+
+
+class ReminderLeaseTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.now = timezone.now()
+
+    def due(self, count=1, **fields):
+        reminders = []
+        for i in range(count):
+            reminder = Reminder.objects.create(
+                user=self.user, message=f"Meds {i}", time=dt.time(8, 30), recurring=True, **fields
+            )
+            reminders.append(reminder)
+        Reminder.objects.filter(pk__in=[r.pk for r in reminders]).update(
+            next_fire_at=self.now - dt.timedelta(minutes=1)
+        )
+        return reminders
+
+    def test_workers_claim_disjoint_batches(self):
+        self.due(5)
+        first = scheduler.claim_due_reminders(self.now, owner="a", batch_size=3)
+        second = scheduler.claim_due_reminders(self.now, owner="b", batch_size=3)
+        third = scheduler.claim_due_reminders(self.now, owner="c", batch_size=3)
+
+        self.assertEqual((len(first), len(second), len(third)), (3, 2, 0))
+        self.assertFalse({r.pk for r in first} & {r.pk for r in second})
+
+    def test_expired_lease_can_be_reclaimed(self):
+        self.due()
+        scheduler.claim_due_reminders(self.now, owner="a")
+        Reminder.objects.update(lease_expires_at=timezone.now() - dt.timedelta(seconds=1))
+        self.assertEqual(len(scheduler.claim_due_reminders(self.now, owner="b")), 1)
+
+    def test_completing_moves_on_and_releases(self):
+        recurring = self.due()[0]
+        one_off = Reminder.objects.create(
+            user=self.user, message="Clinic", time=dt.time(9, 0), date=timezone.localdate() + dt.timedelta(days=1)
+        )
+        Reminder.objects.filter(pk=one_off.pk).update(next_fire_at=self.now - dt.timedelta(minutes=1))
+
+        claimed = scheduler.claim_due_reminders(self.now, owner="a")
+        self.assertEqual(scheduler.complete_reminders(claimed, self.now, owner="a"), 2)
+
+        recurring.refresh_from_db()
+        one_off.refresh_from_db()
+        self.assertGreater(recurring.next_fire_at, self.now)
+        self.assertIsNone(recurring.lease_owner)
+        self.assertFalse(one_off.active)
+        self.assertIsNone(one_off.next_fire_at)
+
+    def test_lost_lease_is_not_completed(self):
+        self.due()
+        claimed = scheduler.claim_due_reminders(self.now, owner="a")
+        Reminder.objects.update(lease_owner="b")
+        with self.assertLogs("chatbot.scheduler", "WARNING"):
+            self.assertEqual(scheduler.complete_reminders(claimed, self.now, owner="a"), 0)
+
+    def test_send_due_reminders_sends_each_once(self):
+        self.due(3)
+        gateway = mock.Mock()
+        gateway.submit.side_effect = lambda *args, **kwargs: completed_future()
+        with mock.patch("chatbot.scheduler.get_gateway", return_value=gateway), \
+                self.assertLogs("chatbot.scheduler", "INFO"):
+            first = scheduler.send_due_reminders(self.now, owner="a")
+            second = scheduler.send_due_reminders(self.now, owner="b")
+
+        self.assertEqual(first["sent"], 3)
+        self.assertEqual(second["sent"], 0)
+        self.assertEqual(gateway.submit.call_count, 3)
+
+
+def completed_future(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class ChatHistoryRetentionTests(TestCase):
+    def test_reset_deletes_with_one_query(self):
+        user = make_user()
+        other = make_user("+254700000002")
+        ChatHistory.objects.bulk_create(
+            [ChatHistory(user=user, sender="user", message=f"Message {i}") for i in range(20)]
+            + [ChatHistory(user=other, sender="user", message="Keep me")]
+        )
+
+        with self.assertNumQueries(2):
+            self.assertEqual(clear_chat_history(user), 20)
+        self.assertEqual(ChatHistory.objects.count(), 1)
+
+    def test_reset_forgets_the_summary(self):
+        user = make_user(conversation_summary="Cares for her son, aged 6.", summary_through=timezone.now())
+        ChatHistory.objects.create(user=user, sender="user", message="Hello")
+
+        response = post_message(self.client, "reset")
+
+        self.assertIn(twiml.text(handler.CHAT_CLEARED), response.content.decode())
+        user.refresh_from_db()
+        self.assertIsNone(user.conversation_summary)
+        self.assertIsNone(user.summary_through)
+        self.assertFalse(ChatHistory.objects.filter(user=user).exists())
+
+        prompt = utils.build_prompt(get_profile(user.phone_number), "What should I eat?")
+        self.assertFalse(any("son" in message["content"] for message in prompt))
+
+    def test_purge_removes_only_expired_rows(self):
+        user = make_user()
+        old = timezone.now() - dt.timedelta(days=200)
+        ChatHistory.objects.bulk_create(
+            [ChatHistory(user=user, sender="user", message="Old", timestamp=old) for _ in range(5)]
+            + [ChatHistory(user=user, sender="user", message="New")]
+        )
+
+        with self.assertLogs("chatbot.retention", "INFO"):
+            self.assertEqual(purge_chat_history(days=180, batch_size=2, pause=0), 5)
+        self.assertEqual(list(ChatHistory.objects.values_list("message", flat=True)), ["New"])
+
+    @override_settings(CHAT_PURGE_PAUSE=0)
+    @mock.patch("chatbot.management.commands.run_reminder_worker.send_due_reminders")
+    def test_reminder_worker_enforces_retention(self, send_due_reminders):
+        user = make_user()
+        chat(user, "user", "Old", minutes_ago=(settings.CHAT_RETENTION_DAYS + 1) * 24 * 60)
+        with self.assertLogs("chatbot.retention", "INFO"):
+            call_command("run_reminder_worker", once=True, stdout=StringIO())
+        self.assertFalse(ChatHistory.objects.exists())
+
+
+class ConversationSummaryTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        start = timezone.now() - dt.timedelta(hours=1)
+        ChatHistory.objects.bulk_create([
+            ChatHistory(user=self.user, sender="user" if i % 2 == 0 else "bot", message=f"Message {i}",
+                        timestamp=start + dt.timedelta(minutes=i))
+            for i in range(12)
+        ])
+
+    @mock.patch.dict("os.environ", {"DEEPSEEK_API_KEY": "key"})
+    def test_older_turns_are_folded_in(self):
+        with mock.patch("chatbot.summary.call_deepseek", return_value="Summary"):
+            self.assertTrue(update_conversation_summary(self.user.pk))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.conversation_summary, "Summary")
+
+    @mock.patch.dict("os.environ", {"DEEPSEEK_API_KEY": "key"})
+    def test_reset_during_summarising_wins(self):
+        def reset_meanwhile(messages, api_key):
+            clear_chat_history(self.user)
+            return "Stale summary"
+
+        with mock.patch("chatbot.summary.call_deepseek", side_effect=reset_meanwhile):
+            self.assertFalse(update_conversation_summary(self.user.pk))
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.conversation_summary)
+
+
+class SharedCacheMixin:
+    """
+    Runs each test with a file-based default cache, which every process
+    sees, standing in for Redis.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        override = override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory},
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+def chat(user, sender, message, minutes_ago=0):
+    return ChatHistory.objects.create(
+        user=user, sender=sender, message=message, timestamp=timezone.now() - dt.timedelta(minutes=minutes_ago)
+    )
+
+
+def messages(turns):
+    return [turn.message for turn in turns]
+
+
+class TurnBufferTests(TestCase):
+    def test_without_a_shared_cache_every_read_goes_to_the_database(self):
+        user = make_user()
+        buffer = memory.TurnBuffer(turns=4)
+        chat(user, "user", "one", minutes_ago=2)
+        self.assertEqual(messages(buffer.recent(user.pk)), ["one"])
+
+        # Written by another process
+        chat(user, "bot", "two", minutes_ago=1)
+        self.assertEqual(messages(buffer.recent(user.pk)), ["one", "two"])
+
+
+class SharedTurnBufferTests(SharedCacheMixin, TestCase):
+    def test_turns_are_served_from_memory(self):
+        user = make_user()
+        buffer = memory.TurnBuffer(turns=4)
+        chat(user, "user", "one", minutes_ago=1)
+        buffer.recent(user.pk)
+
+        buffer.append(user.pk, "bot", "two", timezone.now())
+        with self.assertNumQueries(0):
+            self.assertEqual(messages(buffer.recent(user.pk)), ["one", "two"])
+        self.assertEqual(buffer.hits, 1)
+
+    def test_turns_written_by_another_process_are_picked_up(self):
+        user = make_user()
+        this, other = memory.TurnBuffer(turns=4), memory.TurnBuffer(turns=4)
+        chat(user, "user", "one", minutes_ago=1)
+        this.recent(user.pk)
+
+        row = chat(user, "bot", "two")
+        other.append(user.pk, row.sender, row.message, row.timestamp)
+        self.assertEqual(messages(this.recent(user.pk)), ["one", "two"])
+
+    def test_reset_in_another_process_is_picked_up(self):
+        user = make_user()
+        this, other = memory.TurnBuffer(turns=4), memory.TurnBuffer(turns=4)
+        chat(user, "user", "one")
+        this.recent(user.pk)
+
+        ChatHistory.objects.filter(user=user).delete()
+        other.forget(user.pk)
+        self.assertEqual(this.recent(user.pk), [])
+
+
+class HistoryWriterTests(TestCase):
+    def test_rows_are_kept_when_a_flush_fails(self):
+        user = make_user()
+        writer = memory.HistoryWriter(interval=3600)
+        writer.add(ChatHistory(user_id=user.pk, sender="user", message="hi", timestamp=timezone.now()))
+
+        with mock.patch.object(ChatHistory.objects, "bulk_create", side_effect=OperationalError("locked")):
+            with self.assertRaises(OperationalError):
+                writer.flush()
+        self.assertEqual(writer.pending(), 1)
+
+        writer.flush()
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(ChatHistory.objects.filter(user=user).count(), 1)
+
+    def test_turns_are_written_when_a_task_ends(self):
+        user = make_user()
+        memory.record_turn(user, "user", "hi")
+        task_postrun.send(sender=None)
+        self.assertEqual(memory.writer.pending(), 0)
+        self.assertTrue(ChatHistory.objects.filter(user=user, message="hi").exists())
+
+
+class DispatchTests(TestCase):
+    def test_every_message_refreshes_last_interaction(self):
+        user = make_user()
+        long_ago = timezone.now() - dt.timedelta(days=3)
+        UserProfile.objects.filter(pk=user.pk).update(last_interaction=long_ago)
+
+        post_message(self.client, "menu")
+
+        user.refresh_from_db()
+        self.assertGreater(user.last_interaction, long_ago + dt.timedelta(days=2))
+
+    def test_only_changed_fields_are_written(self):
+        user = make_user()
+        UserProfile.objects.filter(pk=user.pk).update(location="Kisumu")
+
+        post_message(self.client, "add contact")
+
+        user.refresh_from_db()
+        self.assertEqual(user.pending_action, "add_emergency_contact")
+        # Not overwritten from the copy loaded before the update
+        self.assertEqual(user.location, "Kisumu")
+
+    def test_routing_order(self):
+        user = UserProfile(name="Ann", role="patient", registered=True, pending_action="ask_reminder_time")
+        self.assertEqual(resolve(Context(user, "menu")), handler.show_menu)
+        self.assertEqual(resolve(Context(user, "08:30")), handler.save_reminder_time)
+        self.assertEqual(resolve(Context(user, "I'm in severe pain")), handler.start_crisis_support)
+        self.assertEqual(resolve(Context(UserProfile(), "hi")), handler.register_new_user)
+
+
+class ProfileCacheTests(TestCase):
+    def test_without_a_shared_cache_profiles_come_from_the_database(self):
+        user = make_user()
+        get_profile(user.phone_number)
+
+        # Changed by another process
+        UserProfile.objects.filter(pk=user.pk).update(pending_action="add_emergency_contact")
+        self.assertEqual(get_profile(user.phone_number).pending_action, "add_emergency_contact")
+
+    def test_first_contact_creates_the_profile(self):
+        profile = get_profile("+254700000009")
+        self.assertFalse(profile.registered)
+        self.assertTrue(UserProfile.objects.filter(phone_number="+254700000009").exists())
+
+
+class SharedProfileCacheTests(SharedCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        profiles._cache.clear()
+        self.addCleanup(profiles._cache.clear)
+
+    def test_profiles_are_served_from_the_cache(self):
+        user = make_user()
+        get_profile(user.phone_number)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_profile(user.phone_number).name, "Ann")
+
+    def test_save_in_another_process_is_picked_up(self):
+        user = make_user()
+        get_profile(user.phone_number)
+        stale = profiles._cache.get(user.phone_number)
+
+        # Saved by another process: this one still holds its old copy
+        user.location = "Kisumu"
+        user.save(update_fields=["location"])
+        profiles._cache.set(user.phone_number, stale)
+
+        self.assertEqual(get_profile(user.phone_number).location, "Kisumu")
+
+    def test_cached_copies_are_not_shared_between_requests(self):
+        user = make_user(emergency_contacts=["+254711111111"])
+        get_profile(user.phone_number).emergency_contacts.append("+254722222222")
+        self.assertEqual(get_profile(user.phone_number).emergency_contacts, ["+254711111111"])
+
+
+class CrisisDetectorTests(SimpleTestCase):
+    def test_labelled_corpus(self):
+        for message, expected in LABELLED_MESSAGES:
+            with self.subTest(message=message):
+                self.assertEqual(detect_crisis(message), expected)
+
+    def test_negation_cancels_a_phrase(self):
+        self.assertFalse(detector.detect("I'm not in pain anymore").is_crisis)
+        self.assertFalse(detector.detect("sina maumivu").is_crisis)
+        self.assertFalse(detector.detect("hakuna dharura").is_crisis)
+
+    def test_negation_stops_at_a_clause_break(self):
+        self.assertTrue(detector.detect("no fever but severe pain").is_crisis)
+        self.assertTrue(detector.detect("sina homa lakini nina maumivu makali").is_crisis)
+
+    def test_swahili_and_sheng(self):
+        for message in ["siwezi kupumua", "nina maumivu makali", "mtoto amezimia", "siezi pumua", "mwili inauma"]:
+            with self.subTest(message=message):
+                self.assertTrue(detector.detect(message).is_crisis)
+
+    def test_questions_about_crises_are_not_crises(self):
+        detection = detector.detect("What is a sickle cell crisis?")
+        self.assertFalse(detection.is_crisis)
+        self.assertLess(detection.confidence, detector.THRESHOLD)
+
+    def test_confidence_and_matches(self):
+        detection = detector.detect("Severe pain in my legs and I can't breathe")
+        self.assertEqual(detection.confidence, 1.0)
+        self.assertIn("severe pain", detection.matches)
+        self.assertEqual(detector.detect("").confidence, 0.0)
+
+
+@override_settings(AI_STREAMING=False)
+@mock.patch.dict("os.environ", {"DEEPSEEK_API_KEY": "key"})
+class AsyncReplyTests(SimpleTestCase):
+    user = UserProfile(pk=1, phone_number="+254700000001", role="patient")
+
+    async def test_cache_and_database_calls_run_off_the_event_loop(self):
+        where = []
+
+        def record(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                where.append("event loop")
+            except RuntimeError:
+                where.append("thread")
+
+        def build_prompt(user, text):
+            record()
+            return [{"role": "system", "content": utils.SYSTEM_PROMPT}, {"role": "user", "content": text}]
+
+        with mock.patch("chatbot.aio.ai_cache.get_cached_reply", side_effect=record), \
+                mock.patch("chatbot.aio.ai_cache.cache_reply", side_effect=record), \
+                mock.patch("chatbot.aio.utils.build_prompt", side_effect=build_prompt), \
+                mock.patch("chatbot.aio.memory.record_turn", side_effect=record), \
+                mock.patch("chatbot.aio.call_deepseek", return_value="Drink water."), \
+                mock.patch("chatbot.aio.send_message") as send:
+            reply = await aio.reply_with_ai(self.user, "How much water should I drink?")
+
+        self.assertEqual(reply, "Drink water.")
+        send.assert_awaited_once_with(self.user.phone_number, "Drink water.")
+        self.assertEqual(where, ["thread"] * 5)
+
+    async def test_personal_replies_are_not_cached(self):
+        prompt = [
+            {"role": "system", "content": utils.SYSTEM_PROMPT},
+            {"role": "system", "content": "What you know from earlier in this conversation: son Tom is 7"},
+            {"role": "user", "content": "What foods help?"},
+        ]
+        with mock.patch("chatbot.aio.ai_cache.get_cached_reply", return_value=None), \
+                mock.patch("chatbot.aio.ai_cache.cache_reply") as cache_reply, \
+                mock.patch("chatbot.aio.utils.build_prompt", return_value=prompt), \
+                mock.patch("chatbot.aio.memory.record_turn"), \
+                mock.patch("chatbot.aio.call_deepseek", return_value="For Tom: leafy greens."), \
+                mock.patch("chatbot.aio.send_message"), \
+                override_settings(AI_STREAMING=False):
+            await aio.reply_with_ai(self.user, "What foods help?")
+        cache_reply.assert_not_called()
+
+    async def test_text_streamed_before_a_failure_is_still_sent(self):
+        async def stream(prompt, api_key):
+            yield "Drink plenty of water throughout every day. "
+            yield "Keep warm and"
+            raise ValueError("connection reset")
+
+        with mock.patch("chatbot.aio.ai_cache.get_cached_reply", return_value=None), \
+                mock.patch("chatbot.aio.utils.build_prompt", return_value=[]), \
+                mock.patch("chatbot.aio.memory.record_turn"), \
+                mock.patch("chatbot.aio.stream_deepseek", stream), \
+                mock.patch("chatbot.aio.send_message") as send, \
+                override_settings(AI_STREAMING=True), \
+                self.assertLogs("chatbot.aio", "ERROR"):
+            await aio.reply_with_ai(self.user, "How do I avoid a crisis?")
+
+        self.assertEqual(
+            [c.args[1] for c in send.await_args_list],
+            ["Drink plenty of water throughout every day.", "Keep warm and"],
+        )
+
+    async def test_failed_sends_are_queued_for_retry(self):
+        with mock.patch("chatbot.aio.ai_cache.get_cached_reply", return_value="Drink water."), \
+                mock.patch("chatbot.aio.utils.save_exchange"), \
+                mock.patch("chatbot.aio.send_message", side_effect=GatewayError("HTTP 503")), \
+                mock.patch("chatbot.aio.tasks.enqueue", return_value=True) as enqueue, \
+                self.assertLogs("chatbot.aio", "WARNING"):
+            await aio.reply_with_ai(self.user, "How much water should I drink?")
+
+        enqueue.assert_called_once_with(tasks.send_message_async, self.user.phone_number, "Drink water.")
+
+    async def test_missing_httpx_gets_the_unavailable_reply(self):
+        with mock.patch.object(aio, "httpx", None), mock.patch.object(aio, "_timeouts", ()), \
+                mock.patch("chatbot.aio.ai_cache.get_cached_reply", return_value=None), \
+                mock.patch("chatbot.aio.utils.build_prompt", return_value=[]), \
+                mock.patch("chatbot.aio.memory.record_turn"), \
+                mock.patch("chatbot.aio.send_message") as send, \
+                self.assertLogs("chatbot.aio", "ERROR"):
+            reply = await aio.reply_with_ai(self.user, "How much water should I drink?")
+
+        self.assertIn("unavailable", reply)
+        send.assert_awaited_once()
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        idempotency._cache.clear()
+        self.addCleanup(idempotency._cache.clear)
+        self.user = make_user()
+
+    def test_retry_gets_the_same_answer_without_rerunning(self):
+        first = post_message(self.client, "add contact", message_sid="SM1")
+        UserProfile.objects.filter(pk=self.user.pk).update(pending_action=None)
+        idempotency._cache.clear()
+
+        retry = post_message(self.client, "add contact", message_sid="SM1")
+
+        self.assertEqual(retry.content, first.content)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.pending_action)
+        self.assertEqual(ProcessedMessage.objects.count(), 1)
+
+    def test_retry_while_the_first_is_running_gets_an_empty_answer(self):
+        self.assertIsNone(idempotency.begin("SM2"))
+        self.assertEqual(idempotency.begin("SM2"), idempotency.EMPTY_RESPONSE)
+
+    def test_failed_delivery_releases_the_message(self):
+        with mock.patch("chatbot.views.dispatch", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                post_message(self.client, "menu", message_sid="SM3")
+        self.assertFalse(ProcessedMessage.objects.filter(message_sid="SM3").exists())
+
+        retry = post_message(self.client, "menu", message_sid="SM3")
+        self.assertIn(twiml.text(handler.MENU), retry.content.decode())
+
+    def test_failed_async_delivery_releases_the_message(self):
+        with mock.patch("chatbot.views.adispatch", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                post_message(self.client, "menu", message_sid="SM4", path="/whatsapp/async/")
+        self.assertFalse(ProcessedMessage.objects.filter(message_sid="SM4").exists())
+
+    def test_old_records_are_purged(self):
+        ProcessedMessage.objects.create(message_sid="SM5", created_at=timezone.now() - dt.timedelta(days=2))
+        ProcessedMessage.objects.create(message_sid="SM6")
+        self.assertEqual(idempotency.purge_processed_messages(), 1)
+        self.assertEqual(list(ProcessedMessage.objects.values_list("message_sid", flat=True)), ["SM6"])
+
+    @mock.patch("chatbot.management.commands.run_reminder_worker.send_due_reminders")
+    def test_reminder_worker_purges_old_records(self, send_due_reminders):
+        ProcessedMessage.objects.create(message_sid="SM5", created_at=timezone.now() - dt.timedelta(days=2))
+        call_command("run_reminder_worker", once=True, stdout=StringIO())
+        self.assertFalse(ProcessedMessage.objects.exists())
+
+
+@mock.patch("chatbot.tasks.enqueue", return_value=True)
+@mock.patch("chatbot.handler.enqueue", return_value=True)
+class BurstTests(TestCase):
+    def test_without_a_shared_cache_every_message_is_answered(self, enqueue, task_enqueue):
+        user = make_user()
+        post_message(self.client, "What foods help?")
+        enqueue.assert_called_once_with(tasks.handle_ai_async, user.id, "What foods help?")
+
+
+@mock.patch("chatbot.tasks.enqueue", return_value=True)
+@mock.patch("chatbot.handler.enqueue", return_value=True)
+class SharedBurstTests(SharedCacheMixin, TestCase):
+    def test_messages_are_answered_together(self, enqueue, task_enqueue):
+        user = make_user()
+        post_message(self.client, "My son has a fever")
+        post_message(self.client, "and his hands are swollen")
+        self.assertEqual(
+            enqueue.call_args_list,
+            [
+                mock.call(tasks.flush_ai_burst, user.id, 1, countdown=settings.AI_BURST_WINDOW),
+                mock.call(tasks.flush_ai_burst, user.id, 2, countdown=settings.AI_BURST_WINDOW),
+            ],
+        )
+
+        tasks.flush_ai_burst(user.id, 1)
+        task_enqueue.assert_not_called()
+        tasks.flush_ai_burst(user.id, 2)
+        task_enqueue.assert_called_once_with(
+            tasks.handle_ai_async, user.id, "My son has a fever\nand his hands are swollen"
+        )
+
+    def test_burst_parked_by_the_webhook_is_taken_by_a_worker(self, enqueue, task_enqueue):
+        seq, _ = bursts.add(7, "hello")
+        # A thread gets its own cache connection, like another process would
+        with ThreadPoolExecutor(1) as worker:
+            self.assertEqual(worker.submit(bursts.take, 7, seq).result(), "hello")
+        self.assertIsNone(bursts.take(7, seq))
+
+    def test_eager_tasks_are_not_held_back(self, enqueue, task_enqueue):
+        user = make_user()
+        conf = tasks.flush_ai_burst.app.conf
+        previous, conf.CELERY_TASK_ALWAYS_EAGER = conf.task_always_eager, True  # settings use the CELERY_ namespace
+        try:
+            post_message(self.client, "What foods help?")
+        finally:
+            conf.CELERY_TASK_ALWAYS_EAGER = previous
+        enqueue.assert_called_once_with(tasks.handle_ai_async, user.id, "What foods help?")
+
+
+class ResourceSnapshotTests(TestCase):
+    def setUp(self):
+        resources._snapshots.clear()
+        self.addCleanup(resources._snapshots.clear)
+        Resource.objects.create(title="Drink water often", category="nutrition")
+
+    def test_lookups_are_served_from_the_snapshot(self):
+        resources.search_resources("water")
+        with self.assertNumQueries(0):
+            self.assertEqual([r.title for r in resources.search_resources("wat")], ["Drink water often"])
+            self.assertEqual(len(resources.get_resources_by_keyword("nutrition")), 1)
+
+    def test_saves_rebuild_the_snapshot(self):
+        resources.search_resources("water")
+        Resource.objects.create(title="Water and heat", category="nutrition")
+        self.assertEqual(len(resources.search_resources("water")), 2)
+
+    def test_snapshots_expire(self):
+        resources.search_resources("water")
+        # e.g. a change made in another process without a shared cache
+        Resource.objects.update(title="Drink fluids often")
+        self.assertEqual(len(resources.search_resources("water")), 1)
+
+        later = time.monotonic() + settings.RESOURCE_SNAPSHOT_TTL + 1
+        with mock.patch("chatbot.resources.time.monotonic", return_value=later):
+            self.assertEqual(resources.search_resources("water"), [])
+
+
+def image_upload(name, size):
+    # Noise, so it does not compress below the limit by itself
+    image = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    buffer = BytesIO()
+    image.save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(PUBLIC_BASE_URL="https://sicklecare.example")
+class ResourceMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        resources._snapshots.clear()
+        self.addCleanup(resources._snapshots.clear)
+        media._urls.clear()
+        self.addCleanup(media._urls.clear)
+
+    def test_media_url_is_absolute_and_resolved_once(self):
+        resource = Resource.objects.create(
+            title="Pain diary", category="pain", file=SimpleUploadedFile("diary.pdf", b"%PDF-1.4"),
+        )
+        self.assertEqual(media.media_url(resource), f"https://sicklecare.example/media/{resource.file.name}")
+
+        with mock.patch("django.core.files.storage.FileSystemStorage.url") as url:
+            media.media_url(resource)
+        url.assert_not_called()
+        self.assertIsNone(media.media_url(Resource(title="Link only", category="pain")))
+
+    @skipIf(Image is None, "Pillow is not installed")
+    @override_settings(RESOURCE_MEDIA_MAX_BYTES=20_000, RESOURCE_IMAGE_MAX_DIMENSION=200)
+    def test_oversized_images_are_shrunk_once_on_upload(self):
+        resource = Resource.objects.create(title="Hydration chart", category="nutrition", file=image_upload("chart.png", 600))
+
+        self.assertTrue(resource.file.name.endswith(".jpg"))
+        self.assertLessEqual(resource.file.size, 20_000)
+        with Image.open(resource.file.path) as stored:
+            self.assertLessEqual(max(stored.size), 200)
+
+        name = resource.file.name
+        resource.title = "Hydration chart (2024)"
+        resource.save()
+        self.assertEqual(resource.file.name, name)
+
+    @skipIf(Image is None, "Pillow is not installed")
+    @override_settings(RESOURCE_MEDIA_MAX_BYTES=20_000)
+    def test_small_files_and_pdfs_are_stored_as_they_are(self):
+        small = Resource.objects.create(title="Icon", category="pain", file=image_upload("icon.png", 20))
+        pdf = Resource.objects.create(title="Guide", category="pain", file=SimpleUploadedFile("guide.pdf", b"%PDF" * 10_000))
+        self.assertTrue(small.file.name.endswith(".png"))
+        self.assertTrue(pdf.file.name.endswith(".pdf"))
+        self.assertEqual(pdf.file.size, 40_000)
+
+    @mock.patch("chatbot.handler.enqueue", return_value=True)
+    def test_files_are_queued_after_the_reply(self, enqueue):
+        user = make_user()
+        resource = Resource.objects.create(
+            title="Pain diary", category="pain", link="https://example.org/diary",
+            file=SimpleUploadedFile("diary.pdf", b"%PDF-1.4"),
+        )
+
+        post_message(self.client, "resources")
+        response = post_message(self.client, "3")
+
+        self.assertIn("Resources for Pain Management", response.content.decode())
+        self.assertIn("https://example.org/diary", response.content.decode())
+        enqueue.assert_called_once_with(
+            tasks.send_media_batch_async, user.phone_number, [(media.media_url(resource), "Pain diary")],
+        )
+        user.refresh_from_db()
+        self.assertIsNone(user.pending_action)
+
+    @mock.patch("chatbot.handler.enqueue", return_value=False)
+    def test_user_is_told_when_files_cannot_be_queued(self, enqueue):
+        make_user(pending_action="choose_resource")
+        Resource.objects.create(title="Pain diary", category="pain", file=SimpleUploadedFile("diary.pdf", b"%PDF-1.4"))
+
+        response = post_message(self.client, "3")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("files can't be sent right now", response.content.decode())
+
+    def test_other_messages_leave_the_resource_menu(self):
+        user = make_user(pending_action="choose_resource")
+
+        response = post_message(self.client, "menu")
+
+        self.assertIn(twiml.text(handler.MENU), response.content.decode())
+        user.refresh_from_db()
+        self.assertIsNone(user.pending_action)
+
+    @mock.patch("chatbot.tasks.enqueue", return_value=True)
+    @mock.patch("chatbot.tasks.get_gateway")
+    def test_failed_files_are_retried_one_by_one(self, get_gateway, enqueue):
+        get_gateway.return_value.send_many.return_value = [
+            ("+254700000001", ["SM1"], None),
+            ("+254700000001", None, GatewayError("HTTP 503")),
+        ]
+        files = [["https://sicklecare.example/a.pdf", "A"], ["https://sicklecare.example/b.pdf", "B"]]
+
+        tasks.send_media_batch_async("+254700000001", files)
+
+        get_gateway.return_value.send_many.assert_called_once_with([
+            ("+254700000001", "A", "https://sicklecare.example/a.pdf"),
+            ("+254700000001", "B", "https://sicklecare.example/b.pdf"),
+        ])
+        enqueue.assert_called_once_with(tasks.send_media_async, "+254700000001", "https://sicklecare.example/b.pdf", "B")
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        for name in ("_timings", "_counters", "_gauges"):
+            patcher = mock.patch.object(metrics, name, {})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_prometheus_format(self):
+        metrics.observe("stage.ai_call", 0.3)
+        metrics.observe("ai_prompt_tokens", 250)
+        metrics.incr("webhook.messages")
+        metrics.gauge("celery_queue_depth", lambda: {"ai": 2}, label="queue")
+        pid = f'pid="{os.getpid()}"'
+
+        lines = metrics.render_prometheus().splitlines()
+        self.assertIn(f'sicklecare_stage_seconds_bucket{{{pid},stage="ai_call",le="0.5"}} 1', lines)
+        self.assertIn(f'sicklecare_stage_seconds_count{{{pid},stage="ai_call"}} 1', lines)
+        self.assertIn(f'sicklecare_ai_prompt_tokens_bucket{{{pid},le="300"}} 1', lines)
+        self.assertIn(f"sicklecare_webhook_messages_total{{{pid}}} 1", lines)
+        self.assertIn(f'sicklecare_celery_queue_depth{{{pid},queue="ai"}} 2', lines)
+        for line in lines:
+            if not line.startswith("#"):
+                self.assertIn(pid, line)
+
+    def test_worker_exporter(self):
+        metrics.incr("webhook.messages")
+        server = metrics.serve(0, token="secret")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(url, timeout=5)
+        raised.exception.close()
+        self.assertEqual(raised.exception.code, 401)
+
+        with urlopen(Request(url, headers={"Authorization": "Bearer secret"}), timeout=5) as response:
+            self.assertIn("sicklecare_webhook_messages_total", response.read().decode())
+        self.assertEqual(server.server_address[0], "127.0.0.1")
+
+    def test_exporter_needs_a_token_off_loopback(self):
+        with self.assertLogs("chatbot.metrics", "ERROR"):
+            self.assertIsNone(metrics.serve(0, host=""))
+            self.assertIsNone(metrics.serve(0, host="0.0.0.0"))
+
+        server = metrics.serve(0, host="localhost")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    @mock.patch("chatbot.tasks.metrics.serve")
+    def test_worker_exporters_are_opt_in(self, serve):
+        tasks._serve_worker_metrics()
+        serve.assert_not_called()
+
+        with override_settings(METRICS_WORKER_PORT=9400, METRICS_WORKER_HOST="10.0.0.5", METRICS_TOKEN="secret"):
+            tasks._serve_worker_metrics()
+        serve.assert_called_once_with(9400, host="10.0.0.5", token="secret")
+
+
+class ProfilingRateTests(SimpleTestCase):
+    def setUp(self):
+        profiling._rate = None
+        self.addCleanup(setattr, profiling, "_rate", None)
+
+    def test_runtime_override_needs_a_shared_cache(self):
+        with self.assertRaises(CommandError):
+            call_command("profiling", rate=0.5, stdout=StringIO())
+        self.assertEqual(profiling.sample_rate(), settings.PROFILING_SAMPLE_RATE)
+
+
+class SharedProfilingRateTests(SharedCacheMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        profiling._rate = None
+        self.addCleanup(setattr, profiling, "_rate", None)
+
+    def test_runtime_override(self):
+        call_command("profiling", rate=0.5, stdout=StringIO())
+        self.assertEqual(profiling.sample_rate(), 0.5)
+        call_command("profiling", reset=True, stdout=StringIO())
+        self.assertEqual(profiling.sample_rate(), settings.PROFILING_SAMPLE_RATE)
+
+
+class FakeGateway:
+    """
+    Answers submit() with a Future settled after the recipient's delay:
+    behaviour maps a number to ("ok" | "fail", seconds), or "hang" for a
+    send that never finishes.
+    """
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.submitted = []
+
+    def submit(self, to, body=None, media_url=None, priority=None):
+        self.submitted.append((to, body, priority))
+        future = Future()
+        action = self.behaviour.get(to, ("ok", 0))
+        if action != "hang":
+            outcome, delay = action
+
+            def settle():
+                if outcome == "ok":
+                    future.set_result(["SM1"])
+                else:
+                    future.set_exception(GatewayError("HTTP 503"))
+
+            if delay:
+                timer = threading.Timer(delay, settle)
+                timer.daemon = True
+                timer.start()
+            else:
+                settle()
+        return future
+
+
+@mock.patch("chatbot.tasks.enqueue", return_value=True)
+@mock.patch("chatbot.crisis.get_nearby_hospitals", return_value=[
+    {"name": "Kenyatta Hospital", "address": "Hospital Rd", "phone": "+254 20 2726300"},
+])
+class CrisisDispatchTests(SimpleTestCase):
+    patient = "+254700000001"
+    contacts = ["+254711111111", "+254722222222", "+254733333333"]
+
+    def dispatch(self, behaviour, deadline=2.0):
+        user = UserProfile(phone_number=self.patient, location="Nairobi", emergency_contacts=self.contacts)
+        gateway = FakeGateway(behaviour)
+        with mock.patch("chatbot.crisis.get_gateway", return_value=gateway), \
+                self.assertLogs("chatbot.crisis") as logs:
+            report = crisis.dispatch_crisis(user, "I'm in severe pain", deadline=time.monotonic() + deadline)
+        return report, gateway, logs
+
+    def patient_message(self, gateway):
+        return next(body for to, body, _ in gateway.submitted if to == self.patient)
+
+    def test_alerts_go_out_together_on_the_crisis_lane(self, lookup, enqueue):
+        behaviour = {number: ("ok", 0.2) for number in self.contacts}
+        start = time.monotonic()
+        report, gateway, _ = self.dispatch(behaviour)
+
+        # Concurrent: three 0.2s sends take about 0.2s, not 0.6s
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual({to for to, _, _ in gateway.submitted}, {*self.contacts, self.patient})
+        self.assertEqual({priority for _, _, priority in gateway.submitted}, {PRIORITY_CRISIS})
+        for number in self.contacts:
+            self.assertTrue(report[number]["ok"])
+            self.assertGreaterEqual(report[number]["latency"], 0.2)
+        self.assertIn("Kenyatta Hospital", self.patient_message(gateway))
+        enqueue.assert_not_called()
+
+    def test_failed_alerts_are_retried_on_the_crisis_queue(self, lookup, enqueue):
+        behaviour = {self.contacts[0]: ("fail", 0), self.contacts[1]: ("ok", 0), self.contacts[2]: ("fail", 0.1)}
+        report, gateway, _ = self.dispatch(behaviour)
+
+        self.assertEqual([report[number]["retried"] for number in self.contacts], [True, False, True])
+        alert = gateway.submitted[0][1]
+        self.assertCountEqual(enqueue.call_args_list, [
+            mock.call(tasks.send_alert_async, self.contacts[0], alert),
+            mock.call(tasks.send_alert_async, self.contacts[2], alert),
+        ])
+        self.assertIn(crisis.ALERT_STATUS["sent"], self.patient_message(gateway))
+
+    def test_patient_is_not_told_failed_alerts_were_sent(self, lookup, enqueue):
+        report, gateway, _ = self.dispatch({number: ("fail", 0) for number in self.contacts})
+
+        message = self.patient_message(gateway)
+        self.assertIn(crisis.ALERT_STATUS["failed"], message)
+        self.assertNotIn(crisis.ALERT_STATUS["sent"], message)
+        self.assertEqual(enqueue.call_count, 3)
+
+    def test_dispatch_returns_at_the_deadline(self, lookup, enqueue):
+        behaviour = {self.contacts[0]: "hang", self.contacts[1]: ("ok", 0), self.contacts[2]: ("ok", 5)}
+        start = time.monotonic()
+        report, _, logs = self.dispatch(behaviour, deadline=0.3)
+
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(report[self.contacts[0]], {"ok": False, "latency": None, "retried": False})
+        self.assertTrue(report[self.contacts[1]]["ok"])
+        self.assertFalse(report[self.contacts[2]]["ok"])
+        self.assertTrue(any("not delivered in time" in line for line in logs.output))
@@ -0,0 +1,63 @@
+"""
+Pre-rendered TwiML for replies that never change.
+
+Menu navigation, registration prompts and the clear/reset confirmations
+are constant text. Handlers register them with static_reply() and answer
+with ctx.reply_static(); render_static() (run from AppConfig.ready)
+renders each one to TwiML bytes once per language, so the webhook serves
+them with a dict lookup instead of building a MessagingResponse.
+
+Replies without a translation are served in DEFAULT_LANGUAGE.
+"""
+from twilio.twiml.messaging_response import MessagingResponse
+
+from . import metrics
+
+
+DEFAULT_LANGUAGE = "English"
+
+# Answer for messages that get no immediate reply (e.g. the AI replies later)
+EMPTY = b'<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+STATIC_REPLIES = {}  # name -> {language: text}
+_rendered = {}  # (name, language) -> TwiML bytes
+
+
+def static_reply(name, text, language=DEFAULT_LANGUAGE):
+    """
+    Registers the constant reply `name` in `language` and returns `name`.
+    """
+    STATIC_REPLIES.setdefault(name, {})[language] = text
+    _rendered.pop((name, language), None)
+    return name
+
+
+def text(name, language=DEFAULT_LANGUAGE):
+    texts = STATIC_REPLIES[name]
+    return texts.get(language) or texts[DEFAULT_LANGUAGE]
+
+
+def render(*bodies):
+    response = MessagingResponse()
+    msg = response.message()
+    for body in bodies:
+        msg.body(body)
+    return str(response).encode()
+
+
+def render_static():
+    for name, texts in STATIC_REPLIES.items():
+        for language, body in texts.items():
+            _rendered[(name, language)] = render(body)
+
+
+def get(name, language=DEFAULT_LANGUAGE):
+    """
+    The TwiML bytes for static reply `name` in `language`.
+    """
+    metrics.incr("twiml.static")
+    rendered = _rendered.get((name, language))
+    if rendered is None:
+        # Untranslated, or registered after startup
+        rendered = _rendered[(name, language)] = render(text(name, language))
+    return rendered
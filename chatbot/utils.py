@@ -1,202 +1,352 @@
+import json
+import logging
 import os
+import re
+import time
 import requests
-from django.utils import timezone
-from .models import ChatHistory
-from twilio.rest import Client
+from django.conf import settings
+from django.db import OperationalError
+from . import ai_cache, memory, metrics
+from .gateway import PRIORITY_CRISIS, GatewayError, get_gateway
+from .crisis import dispatch_crisis
+from .hospitals import get_nearby_hospitals
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You are SickleCare, a caring WhatsApp assistant for sickle cell awareness. "
+    "Keep replies short, friendly, and under 1500 characters."
+    "Limit emojis strictly to **no more than 1 per message** and only if appropriate. "
+)
+
+DEEPSEEK_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+
+
+def call_deepseek(messages, api_key):
+    """
+    Sends a chat completion request and returns the reply trimmed for WhatsApp.
+    Raises requests exceptions on failure.
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept-Encoding": "gzip" 
+    }
+    payload = {
+        "model": "deepseek-chat",
+        "messages": messages,
+        "max_tokens": 300,          # keeps response concise
+        "temperature": 0.6,         # reduces rambling
+    }
+
+    with metrics.timed("stage.ai_call"):
+        response = requests.post(DEEPSEEK_URL, headers=headers, json=payload, timeout=15)
+    response.raise_for_status()
+    data = response.json()
+
+    # Extract AI response
+    return shorten_reply(data["choices"][0]["message"]["content"])
+
+
+def shorten_reply(ai_reply):
+    ai_reply = ai_reply.strip()
+
+    # Limit for WhatsApp
+    if len(ai_reply) > 1500:
+        ai_reply = ai_reply[:1500].rsplit(' ', 1)[0] + "\n\n… Message shortened for WhatsApp."
+
+    return ai_reply
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def build_prompt(user, user_input):
+    """
+    System prompt + rolling conversation summary + the last few turns,
+    trimmed to settings.AI_PROMPT_TOKEN_BUDGET (oldest turns go first,
+    then the summary is shortened).
+    """
+    budget = settings.AI_PROMPT_TOKEN_BUDGET
+    recent = settings.AI_PROMPT_RECENT_TURNS * 2
+
+    # The recent window, plus any older turns not yet folded into the summary
+    past_messages = memory.recent_turns(user)[::-1]
+    past_messages = [
+        chat for index, chat in enumerate(past_messages)
+        if index < recent or not user.summary_through or chat.timestamp > user.summary_through
+    ][::-1]
+
+    question = {"role": "user", "content": user_input.strip()}
+    turns = [
+        {"role": "user" if chat.sender == "user" else "assistant", "content": chat.message}
+        for chat in past_messages
+    ]
+
+    used = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(question["content"])
+    while turns and used + sum(estimate_tokens(t["content"]) for t in turns) > budget:
+        turns.pop(0)
+    used += sum(estimate_tokens(t["content"]) for t in turns)
+
+    history = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    summary = user.conversation_summary
+    if summary:
+        room = (budget - used) * 4
+        if room > 80:
+            history.append({
+                "role": "system",
+                "content": f"What you know from earlier in this conversation: {summary[:room]}",
+            })
+
+    history.extend(turns)
+
+    # Add latest user message
+    history.append(question)
+    metrics.observe("ai_prompt_tokens", sum(estimate_tokens(m["content"]) for m in history))
+    return history
+
+
+def is_generic_prompt(prompt):
+    """
+    True when `prompt` is only the system prompt and the question: the
+    reply then holds nothing about the user and can be cached for everyone.
+    """
+    return len(prompt) == 2 and prompt[0] == {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def save_exchange(user, user_input, ai_reply):
+    memory.record_turn(user, "user", user_input)
+    memory.record_turn(user, "bot", ai_reply)
 
 
 def get_ai_response(user, user_input):
     """
     Optimized DeepSeek response generator with context and response limiting.
-    Designed for fast replies (~5-8s typical).
+    Designed for fast replies (~5-8s typical). Context-free questions are
+    answered from the response cache when possible.
     """
     try:
         api_key = os.getenv("DEEPSEEK_API_KEY")
+
+        ai_reply = ai_cache.get_cached_reply(user_input, user.role, user.preferred_language)
+        if ai_reply is not None:
+            save_exchange(user, user_input, ai_reply)
+            return ai_reply
+
         if not api_key:
+            memory.record_turn(user, "user", user_input)
             return "⚠️ AI service unavailable. Please try again later."
 
-        # Limit context to 3–5 latest messages for speed
-        past_messages = ChatHistory.objects.filter(user=user).order_by("-timestamp")[:5][::-1]
+        # Build the prompt before recording the new turn so it is not sent twice
+        history = build_prompt(user, user_input)
+        memory.record_turn(user, "user", user_input)
 
-        history = [
-            {
-                "role": "system",
-                "content": "You are SickleCare, a caring WhatsApp assistant for sickle cell awareness. "
-                           "Keep replies short, friendly, and under 1500 characters."
-                           "Limit emojis strictly to **no more than 1 per message** and only if appropriate. "                    
-            }
-        ]
-
-        for chat in past_messages:
-            role = "user" if chat.sender == "user" else "assistant"
-            history.append({"role": role, "content": chat.message})
-
-        # Add latest user message
-        history.append({"role": "user", "content": user_input.strip()})
-
-        # Prepare API call
-        url = "https://api.deepseek.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Accept-Encoding": "gzip" 
-        }
-        payload = {
-            "model": "deepseek-chat",
-            "messages": history,
-            "max_tokens": 300,          # keeps response concise
-            "temperature": 0.6,         # reduces rambling
-        }
-
-        # Log time for benchmarking (optional)
-        import time; start = time.time()
-
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        # Timed as stage.ai_call
+        ai_reply = call_deepseek(history, api_key)
+        # Replies that drew on the summary or earlier turns are this user's only
+        if is_generic_prompt(history):
+            ai_cache.cache_reply(user_input, ai_reply, user.role, user.preferred_language)
+
+        # Save to chat history
+        memory.record_turn(user, "bot", ai_reply)
+
+        return ai_reply
+
+    except requests.Timeout:
+        return "⚠️ The AI service took too long to respond. Please try again."
+    except OperationalError:
+        # Database trouble (e.g. loading the history): nothing has been sent
+        # yet, so the caller (handle_ai_async) can retry
+        raise
+    except Exception:
+        logger.exception("AI request failed")
+        return "⚠️ AI service unavailable. Please try again later."
+
+
+def stream_deepseek(messages, api_key):
+    """
+    Yields content deltas from a streaming (SSE) chat completion.
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    payload = {
+        "model": "deepseek-chat",
+        "messages": messages,
+        "max_tokens": 300,
+        "temperature": 0.6,
+        "stream": True,
+    }
+
+    with metrics.timed("stage.ai_call"), \
+            requests.post(DEEPSEEK_URL, headers=headers, json=payload, timeout=15, stream=True) as response:
         response.raise_for_status()
-        data = response.json()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
 
-        # Extract AI response
-        ai_reply = data["choices"][0]["message"]["content"].strip()
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
 
-        # Limit for WhatsApp
-        if len(ai_reply) > 1500:
-            ai_reply = ai_reply[:1500].rsplit(' ', 1)[0] + "\n\n… Message shortened for WhatsApp."
+            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
 
-        # Save to chat history
-        ChatHistory.objects.bulk_create([
-            ChatHistory(user=user, message=user_input, sender="user", timestamp=timezone.now()),
-            ChatHistory(user=user, message=ai_reply, sender="bot", timestamp=timezone.now())
-        ])
 
-        print(f"DeepSeek response time: {time.time() - start:.2f}s")
+class SegmentBuffer:
+    """
+    Turns a token stream into WhatsApp-sized messages.
+
+    The first sentence (or paragraph) is released as soon as it is complete so
+    the user sees something quickly; the remainder is grouped into as few
+    follow-up messages as possible, each under `max_len` characters.
+    """
+
+    SENTENCE_END = re.compile(r"(?:[.!?](?=\s)|\n\n)")
+
+    def __init__(self, first_min=40, max_len=1500):
+        self.first_min = first_min
+        self.max_len = max_len
+        self.buffer = ""
+        self.sent_first = False
+
+    def feed(self, text):
+        self.buffer += text
+        segments = []
+
+        if not self.sent_first:
+            for match in self.SENTENCE_END.finditer(self.buffer):
+                if match.end() >= self.first_min:
+                    segments.append(self._take(match.end()))
+                    self.sent_first = True
+                    break
+
+        while len(self.buffer) > self.max_len:
+            segments.append(self._take(self._cut_point()))
 
+        return [s for s in segments if s]
+
+    def close(self):
+        segments = []
+        while len(self.buffer) > self.max_len:
+            segments.append(self._take(self._cut_point()))
+        segments.append(self._take(len(self.buffer)))
+        return [s for s in segments if s]
+
+    def _cut_point(self):
+        window = self.buffer[:self.max_len]
+        boundaries = [m.end() for m in self.SENTENCE_END.finditer(window)]
+        if boundaries:
+            return boundaries[-1]
+        space = window.rfind(" ")
+        return space if space > 0 else self.max_len
+
+    def _take(self, end):
+        segment, self.buffer = self.buffer[:end], self.buffer[end:]
+        self.buffer = self.buffer.lstrip()
+        return segment.strip()
+
+
+def stream_ai_response(user, user_input, send=None):
+    """
+    Streaming variant of get_ai_response: sends the reply to the user in
+    segments as it is generated and returns the full reply text.
+    Records the time until the first segment was handed to WhatsApp.
+    """
+    send = send or send_whatsapp_message
+    start = time.monotonic()
+    sent_any = False
+
+    def deliver(segment):
+        nonlocal sent_any
+        send(user.phone_number, segment)
+        if not sent_any:
+            sent_any = True
+            metrics.observe("ai_time_to_first_message", time.monotonic() - start)
+
+    ai_reply = ai_cache.get_cached_reply(user_input, user.role, user.preferred_language)
+    if ai_reply is not None:
+        deliver(ai_reply)
+        save_exchange(user, user_input, ai_reply)
+        return ai_reply
+
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        memory.record_turn(user, "user", user_input)
+        ai_reply = "⚠️ AI service unavailable. Please try again later."
+        deliver(ai_reply)
         return ai_reply
 
+    # Build the prompt before recording the new turn so it is not sent twice
+    prompt = build_prompt(user, user_input)
+    memory.record_turn(user, "user", user_input)
+
+    segments = SegmentBuffer()
+    parts = []
+    complete = False
+    try:
+        for delta in stream_deepseek(prompt, api_key):
+            parts.append(delta)
+            for segment in segments.feed(delta):
+                deliver(segment)
+        complete = True
     except requests.Timeout:
-        return "⚠️ The AI service took too long to respond. Please try again."
-    except Exception as e:
-        print(f"AI Error: {e}")
-        return "⚠️ AI service unavailable. Please try again later."
-    
-def handle_crisis(user, message):
-    raw_contacts = user.emergency_contacts
-    
-    if isinstance(raw_contacts, list):
-        contacts = [c for c in raw_contacts if c]
-    elif isinstance(raw_contacts, str):
-        contacts = [c.strip() for c in raw_contacts.split(",") if c.strip()]
-    else:
-        contacts = []
+        if not sent_any:
+            ai_reply = "⚠️ The AI service took too long to respond. Please try again."
+            deliver(ai_reply)
+            return ai_reply
+    except Exception:
+        logger.exception("AI request failed")
+        if not sent_any:
+            ai_reply = "⚠️ AI service unavailable. Please try again later."
+            deliver(ai_reply)
+            return ai_reply
+
+    for segment in segments.close():
+        deliver(segment)
+
+    ai_reply = "".join(parts).strip()
+    if ai_reply:
+        if complete:
+            metrics.observe("ai_stream_total", time.monotonic() - start)
+            if is_generic_prompt(prompt):
+                ai_cache.cache_reply(user_input, ai_reply, user.role, user.preferred_language)
+        memory.record_turn(user, "bot", ai_reply)
+    return ai_reply
 
-    alert_text = (
-        f"🚨 *SickleCare Emergency Alert!*\n\n"
-        f"User: {user.name or user.phone_number}\n"
-        f"Phone: {user.phone_number}\n"
-        f"Message: {message}\n\n"
-        f"The user may be in crisis. Please contact them immediately."
-    )
 
-    for number in contacts:
-        send_whatsapp_message(number, alert_text)
-
-    # 2. Optionally send local medical facility suggestions
-    if user.location:
-        hospitals = get_nearby_hospitals(user.location)
-
-        if hospitals:
-            # Combine all hospitals into ONE text block
-            hospital_lines = []
-            for h in hospitals:
-                hospital_lines.append(
-                    f"🏥 *{h['name']}*\n📍 {h['address']}\n📞 {h.get('phone', 'N/A')}"
-                )
-            
-            hospitals_text = "\n\n".join(hospital_lines)
-
-            final_msg = (
-                "🚨 Crisis Detected!\n"
-                "I've notified your emergency contacts.\n\n"
-                "Here are nearby hospitals:\n\n"
-                f"{hospitals_text}\n\n"
-                "Follow the steps above and stay safe. ❤️"
-            )
-
-            # Send ONE message only
-            send_whatsapp_message(user.phone_number, final_msg)
-
-        else:
-            send_whatsapp_message(
-                user.phone_number,
-                "⚠️ No nearby hospitals were found for your location."
-            )
-            
-
-def get_nearby_hospitals(user_location):
-    google_api_key = os.getenv("GOOGLE_MAPS_KEY")
-
-    url = (
-        "https://maps.googleapis.com/maps/api/place/textsearch/json"
-        f"?query=hospitals near {user_location}"
-        f"&key={google_api_key}"
-    )
+def handle_crisis(user, message):
+    return dispatch_crisis(user, message)
 
-    response = requests.get(url)
-    data = response.json()
 
-    hospitals = []
-    
-    for result in data.get("results", [])[:3]:  # Return top 3
-        hospital = {
-            "name": result["name"],
-            "address": result.get("formatted_address", "N/A"),
-            "location": result["geometry"]["location"],
-            "phone": None
-        }
-        
-        place_id = result.get("place_id")
-        if place_id:
-            details_url = (
-                "https://maps.googleapis.com/maps/api/place/details/json"
-                f"?place_id={place_id}"
-                "&fields=formatted_phone_number"
-                f"&key={google_api_key}"
-            )
-            details_response = requests.get(details_url)
-            details_data = details_response.json()
-            phone = details_data.get("result", {}).get("formatted_phone_number")
-            if phone:
-                hospital["phone"] = phone
-
-        hospitals.append(hospital)       
-    # print("GOOGLE API RESULT:", response.json())
-    return hospitals
-    
 def send_emergency_alert(user, message):
     """
     Sends an alert to all emergency contacts for a user.
     """
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    from_whatsapp = "whatsapp:+14155238886"
-
-    client = Client(account_sid, auth_token)
-
     if not user.emergency_contacts:
         return False
-    
-    raw_numbers = [num.strip() for num in user.emergency_contacts.split(",")]
+
+    if isinstance(user.emergency_contacts, list):
+        raw_numbers = [str(num).strip() for num in user.emergency_contacts]
+    else:
+        raw_numbers = [num.strip() for num in user.emergency_contacts.split(",")]
     
     contacts = list({
         num.lstrip("+").replace(" ", "") 
         for num in raw_numbers 
-        if num.strip().replace("+", "").isdigit()
+        if num.strip().replace("+", "").replace(" ", "").isdigit()
     })
     
     if not contacts:
-        print("No valid emergency contacts")
+        logger.warning("No valid emergency contacts for %s", user.phone_number)
         return False
 
-    # contacts = [num.strip() for num in user.emergency_contacts.split(",") if num.strip()]
     alert_msg = (
         f"🚨 *SickleCare Emergency Alert!*\n\n"
         f"User: {user.name or 'Unknown'}\n"
@@ -205,65 +355,27 @@ def send_emergency_alert(user, message):
         f"Please reach out or check on them immediately."
     )
 
-    for contact in contacts:
-        try:
-            client.messages.create(
-                from_=from_whatsapp,
-                to=f"whatsapp:+{contact}" if not contact.startswith("whatsapp:") else contact,
-                body=alert_msg
-            )
-        except Exception as e:
-            print(f"Error sending alert to {contact}: {e}")
+    results = get_gateway().send_many([(contact, alert_msg) for contact in contacts], priority=PRIORITY_CRISIS)
+    for contact, _, error in results:
+        if error:
+            logger.error("Error sending alert to %s: %s", contact, error)
 
     return True
 
 def send_whatsapp_message(to, message):
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    whatsapp_number = os.getenv("TWILIO_WHATSAPP_NUMBER")
-
-    if not account_sid or not auth_token:
-        print("⚠️ Twilio credentials not set in environment variables.")
-        return
-
-    client = Client(account_sid, auth_token)
-    
-     # Twilio WhatsApp max per message
-    MAX_LEN = 1600  
-
-    # Split the message into chunks
-    parts = [message[i:i+MAX_LEN] for i in range(0, len(message), MAX_LEN)]
-
     try:
-        for part in parts:
-            client.messages.create(
-                body=part,
-                from_=whatsapp_number,
-            to=f"whatsapp:{to}"
-        )
-        print(f"WhatsApp message sent to {to}")
-    except Exception as e:
-        print(f"Failed to send message to {to}: {e}")
+        get_gateway().send(to, message)
+        logger.debug("WhatsApp message sent to %s", to)
+    except GatewayError as e:
+        logger.error("Failed to send message to %s: %s", to, e)
         
 
 def send_whatsapp_media(to, media_url, caption=None):
     """
     Sends media (PDF, image, etc.)
     """
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    whatsapp_number = os.getenv("TWILIO_WHATSAPP_NUMBER")
-
-    client = Client(account_sid, auth_token)
-
     try:
-        client.messages.create(
-            body=caption or "",
-            media_url=[media_url],
-            from_=whatsapp_number,
-            to=f"whatsapp:{to}"
-        )
-        print(f"Media sent to {to}: {media_url}")
-    except Exception as e:
-        print(f"Failed to send media to {to}: {e}")
-
+        get_gateway().send(to, caption or "", media_url=media_url)
+        logger.debug("Media sent to %s: %s", to, media_url)
+    except GatewayError as e:
+        logger.error("Failed to send media to %s: %s", to, e)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -89,8 +90,154 @@ DATABASES = {
 }
 
 # Celery Configuration
-CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Redis as the message broker
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'  # Store task results in Redis
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')  # Redis as the message broker
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')  # Store task results in Redis
+
+# Run tasks inline in the calling process (tests / local dev without Redis)
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'false').lower() == 'true'
+CELERY_TASK_EAGER_PROPAGATES = False
+
+# Only ack once a task has finished, so work survives a worker restart
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_WORKER_CONCURRENCY = int(os.getenv('CELERY_WORKER_CONCURRENCY', '8'))
+CELERY_TASK_IGNORE_RESULT = True
+
+# Workers listening on several queues drain them in the order given to -Q,
+# so start them with `-Q crisis,outbound,ai,default` to keep crisis work first
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'chatbot.tasks.handle_crisis_async': {'queue': 'crisis'},
+    'chatbot.tasks.send_alert_async': {'queue': 'crisis'},
+    'chatbot.tasks.handle_ai_async': {'queue': 'ai'},
+    'chatbot.tasks.flush_ai_burst': {'queue': 'ai'},
+    'chatbot.tasks.send_message_async': {'queue': 'outbound'},
+    'chatbot.tasks.send_media_async': {'queue': 'outbound'},
+    'chatbot.tasks.send_media_batch_async': {'queue': 'outbound'},
+    'chatbot.tasks.update_summary_async': {'queue': 'default'},
+}
+
+# Caches
+# Per-process by default; point REDIS_CACHE_URL at Redis to share between workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # Holds per-user version keys (chat history, profiles)
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+}
+if os.getenv('REDIS_CACHE_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL'),
+    }
+
+# AI response cache (context-free questions only)
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '1000'))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', str(24 * 60 * 60)))  # seconds
+AI_CACHE_SHARED_ALIAS = 'default' if os.getenv('REDIS_CACHE_URL') else None
+
+# Hospital lookups (Google Places) on the crisis path
+HOSPITAL_CACHE_MAX_ENTRIES = int(os.getenv('HOSPITAL_CACHE_MAX_ENTRIES', '2000'))
+HOSPITAL_CACHE_TTL = int(os.getenv('HOSPITAL_CACHE_TTL', str(7 * 24 * 60 * 60)))  # seconds
+HOSPITAL_CACHE_SHARED_ALIAS = 'default' if os.getenv('REDIS_CACHE_URL') else None
+HOSPITAL_LOOKUP_DEADLINE = float(os.getenv('HOSPITAL_LOOKUP_DEADLINE', '4'))  # seconds, end to end
+
+# End-to-end budget for crisis alerts + hospital lookup + patient reply
+CRISIS_DEADLINE = float(os.getenv('CRISIS_DEADLINE', '8'))  # seconds
+# Messages the detector scores at least this high start the crisis flow
+CRISIS_THRESHOLD = float(os.getenv('CRISIS_THRESHOLD', '0.6'))
+
+# Reminders missed by more than this (e.g. long downtime) are skipped, not sent late
+REMINDER_MAX_LATENESS = int(os.getenv('REMINDER_MAX_LATENESS', str(12 * 60 * 60)))  # seconds
+
+# Reminder dispatch: due reminders are leased to one worker in batches
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', '1000'))
+REMINDER_LEASE_SECONDS = int(os.getenv('REMINDER_LEASE_SECONDS', '120'))
+REMINDER_POLL_INTERVAL = int(os.getenv('REMINDER_POLL_INTERVAL', '15'))  # seconds, run_reminder_worker
+# Start the in-process scheduler outside `runserver` too (e.g. under gunicorn)
+REMINDER_SCHEDULER_ENABLED = os.getenv('REMINDER_SCHEDULER_ENABLED', 'false').lower() == 'true'
+
+# Chat history retention (0 keeps everything); purged daily in batches by
+# whichever process dispatches reminders (run_reminder_worker, or the
+# in-process scheduler)
+CHAT_RETENTION_DAYS = int(os.getenv('CHAT_RETENTION_DAYS', '180'))
+CHAT_PURGE_BATCH_SIZE = int(os.getenv('CHAT_PURGE_BATCH_SIZE', '2000'))
+CHAT_PURGE_PAUSE = float(os.getenv('CHAT_PURGE_PAUSE', '0.05'))  # seconds between batches
+
+# AI prompt: rolling summary + the last few turns, within a token budget
+AI_PROMPT_RECENT_TURNS = int(os.getenv('AI_PROMPT_RECENT_TURNS', '2'))  # user + bot pairs
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '900'))
+AI_SUMMARY_MIN_MESSAGES = int(os.getenv('AI_SUMMARY_MIN_MESSAGES', '4'))  # fold older turns in groups
+
+# In-memory recent-turn buffer for AI prompts (only with REDIS_CACHE_URL, which
+# keeps processes in sync); turns are persisted write-behind
+AI_HISTORY_BUFFER_USERS = int(os.getenv('AI_HISTORY_BUFFER_USERS', '10000'))
+AI_HISTORY_BUFFER_MAX_BYTES = int(os.getenv('AI_HISTORY_BUFFER_MAX_BYTES', str(32 * 1024 * 1024)))
+AI_HISTORY_FLUSH_INTERVAL = float(os.getenv('AI_HISTORY_FLUSH_INTERVAL', '1'))  # seconds
+
+# Profiles looked up by the webhook, keyed by phone number (only cached with
+# REDIS_CACHE_URL, so every process sees each other's changes)
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', '10000'))
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', str(15 * 60)))  # seconds
+PROFILE_CACHE_SHARED_ALIAS = 'default' if os.getenv('REDIS_CACHE_URL') else None
+
+# Connection pool sizes of the async webhook's HTTP clients
+ASYNC_HTTP_MAX_CONNECTIONS = {
+    # DeepSeek calls are slow, so many are in flight at once
+    'deepseek': int(os.getenv('ASYNC_DEEPSEEK_MAX_CONNECTIONS', '1000')),
+    # Twilio sends are quick; a small pool keeps up and is cheaper to manage
+    'twilio': int(os.getenv('ASYNC_TWILIO_MAX_CONNECTIONS', '32')),
+}
+
+# Twilio webhook retries (same MessageSid) are answered from this record;
+# older records are purged hourly by whichever process dispatches reminders
+# (run_reminder_worker, or the in-process scheduler)
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', str(24 * 60 * 60)))  # seconds
+IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_CACHE_MAX_ENTRIES', '10000'))
+
+# Quick successive free-text messages are answered together once the user
+# pauses this long (0 answers every message on its own). Needs a shared
+# cache (REDIS_CACHE_URL): the flush runs in a worker
+AI_BURST_WINDOW = float(os.getenv('AI_BURST_WINDOW', '4'))  # seconds
+AI_BURST_MAX_MESSAGES = int(os.getenv('AI_BURST_MAX_MESSAGES', '6'))
+
+# Languages with up to this many resources are searched in memory; larger
+# catalogs fall back to the database full-text index
+RESOURCE_SNAPSHOT_MAX_ROWS = int(os.getenv('RESOURCE_SNAPSHOT_MAX_ROWS', '5000'))
+# Admin edits reach other processes through a shared cache; without one
+# (or after QuerySet.update()) snapshots are at most this stale
+RESOURCE_SNAPSHOT_TTL = float(os.getenv('RESOURCE_SNAPSHOT_TTL', '300'))  # seconds
+
+# Resource files are sent to WhatsApp by URL, so Twilio must be able to
+# fetch them: PUBLIC_BASE_URL is where this site is reachable from outside
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '')
+# Uploaded images over this size are downscaled once (needs Pillow);
+# WhatsApp rejects images over 5 MB
+RESOURCE_MEDIA_MAX_BYTES = int(os.getenv('RESOURCE_MEDIA_MAX_BYTES', str(5 * 1024 * 1024)))
+RESOURCE_IMAGE_MAX_DIMENSION = int(os.getenv('RESOURCE_IMAGE_MAX_DIMENSION', '1600'))  # pixels
+
+# Bearer token required by the /metrics endpoint (open when empty)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Celery workers serve their metrics on this port (prefork children on the
+# ports after it), e.g. 9400; off (0) unless set
+METRICS_WORKER_PORT = int(os.getenv('METRICS_WORKER_PORT', '0'))
+# Address the worker exporters listen on; anything but loopback needs METRICS_TOKEN
+METRICS_WORKER_HOST = os.getenv('METRICS_WORKER_HOST', '127.0.0.1')
+
+# Sampling profiler: fraction of webhook requests and AI/reminder jobs profiled
+# (0 turns it off; with a shared cache, `manage.py profiling` overrides it
+# at runtime)
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', '0.005'))  # seconds between stack samples
+PROFILING_DIR = os.getenv('PROFILING_DIR', str(BASE_DIR / 'profiles'))  # collapsed stacks, for flame graphs
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '500'))  # oldest files are deleted beyond this
+
+# Stream DeepSeek replies and send the first sentence as soon as it is ready
+AI_STREAMING = os.getenv('AI_STREAMING', 'true').lower() == 'true'
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,6 +275,25 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded resource files
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Logging
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'chatbot': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -14,11 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path
-from chatbot.views import whatsapp_webhook
+from chatbot.views import metrics_endpoint, whatsapp_webhook, whatsapp_webhook_async
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("whatsapp/", whatsapp_webhook, name="whatsapp-webhook")
+    path("whatsapp/", whatsapp_webhook, name="whatsapp-webhook"),
+    # Prometheus scrape target (see METRICS_TOKEN)
+    path("metrics", metrics_endpoint, name="metrics"),
+    # Serve with an ASGI server (e.g. `uvicorn sicklecare.asgi:application`)
+    path("whatsapp/async/", whatsapp_webhook_async, name="whatsapp-webhook-async"),
 ]
+
+# Uploaded resource files, in development only (DEBUG); serve MEDIA_ROOT from the web server in production
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)